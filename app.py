@@ -7,23 +7,60 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import json, os, re, sys, io
+import plotly.graph_objects as go
+import json, os, re, sys, io, time, tempfile, secrets
 from datetime import datetime
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 try:
     from engine import *
+    import llm_gateway, llm_metrics
+    from chat_context import ChatContext, cap_history
+    import image_store
+    import history_store
+    import perf_profile
 except ImportError as e:
     st.error(f"❌ engine.py 로딩 실패: {e}")
     st.stop()
 
 st.set_page_config(page_title="🧪 음료개발 AI 플랫폼", page_icon="🧪", layout="wide")
 
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "음료개발_데이터베이스_v4-1.xlsx")
-
-@st.cache_data
+@st.cache_resource
 def load_data(path):
-    return {n: pd.read_excel(path, sheet_name=n) for n in pd.ExcelFile(path).sheet_names}
+    # 시트 로딩 + 수치 정리 + 압축 (engine.load_db, 스냅샷 캐시)
+    # 프로세스당 1벌을 모든 세션이 복사 없이 공유 — 읽기 전용으로만 사용
+    return load_db(path)
+
+@st.cache_resource
+def load_nutrients(path):
+    # 원료 × 영양성분 행렬 (식품표시사항 영양성분 계산용) — 프로세스당 1회
+    data = load_data(path)
+    return build_nutrient_matrix(data['원료DB'], data.get('원료영양DB'))
+
+@st.cache_resource
+def load_substitutes(path):
+    # 대체 원료 색인 (원료 1%당 Brix·산도·감미·ΔpH 기여 벡터) — 프로세스당 1회
+    df = load_data(path)['원료DB']
+    return build_substitute_index(df, ph_column(df))
+
+@st.cache_resource
+def load_prices(path):
+    # 원료 단가장 (원료DB 예상단가 + 단가 이력, 적용일별 버전) — 프로세스당 1회
+    data = load_data(path)
+    return build_price_book(data['원료DB'], data.get('원료단가이력'))
+
+@st.cache_resource
+def load_history(path):
+    # 배합 히스토리 저장소 (SQLite) — 프로세스당 연결 1개를 모든 세션이 공유, 슬롯은 조회할 때만 복원
+    return history_store.HistoryStore(path)
+
+# ── 프로파일링 (opt-in: APP_PROFILE=1|cprofile|pyinstrument, APP_PROFILE=url이면 URL ?profile=1만) ──
+PROFILE_MODE = perf_profile.resolve_mode(st.query_params.get('profile'))
+if PROFILE_MODE:
+    st.session_state.setdefault('_profile_sid', os.urandom(4).hex())
+    perf_profile.start('', PROFILE_MODE, st.session_state['_profile_sid'])
+    perf_profile.instrument(globals(), sys.modules['engine'], extra=['load_data', 'load_nutrients', 'load_substitutes',
+                                                                    'load_prices', 'load_history'])
 
 try:
     DATA = load_data(DB_PATH)
@@ -37,12 +74,11 @@ df_ing     = DATA['원료DB']
 df_spec    = DATA['음료규격기준']
 df_process = DATA['표준제조공정_HACCP']
 df_guide   = DATA['가이드배합비DB']
-
-for c in ['Brix(°)', 'pH', '산도(%)', '감미도(설탕대비)', '예상단가(원/kg)',
-          '1%사용시 Brix기여(°)', '1%사용시 산도기여(%)', '1%사용시 감미기여']:
-    df_ing[c] = pd.to_numeric(df_ing[c], errors='coerce').fillna(0)
-PH_COL = [c for c in df_ing.columns if 'pH영향' in str(c) or 'ΔpH' in str(c)][0]
-df_ing[PH_COL] = pd.to_numeric(df_ing[PH_COL], errors='coerce').fillna(0)
+PH_COL     = ph_column(df_ing)
+NUT_MATRIX = load_nutrients(DB_PATH)
+SUB_INDEX  = load_substitutes(DB_PATH)
+PRICE_BOOK = load_prices(DB_PATH)
+HISTORY    = load_history(history_store.DB_PATH)
 
 try:
     OPENAI_KEY = st.secrets["openai"]["OPENAI_API_KEY"]
@@ -55,11 +91,15 @@ ING_NAMES = ['(선택)', '✏️ 직접입력'] + ING_LIST
 # ── session_state 초기화 ──
 for k, v in [
     ('slots',           init_slots()),
-    ('history',         []),
     ('product_name',    ''),
     ('bev_type',        ''),
     ('flavor',          ''),
     ('volume',          500),
+    ('ph_model',        'linear'),
+    ('sweet_model',     'linear'),
+    ('zero_sugar',      None),
+    ('sweep',           None),
+    ('price_overlay',   {}),        # 원료명 → 적용 단가 (원료DB 단가 덮어쓰기)
     ('container',       'PET'),
     ('target_price',    1500),
     ('ai_response',     ''),
@@ -74,6 +114,22 @@ for k, v in [
     if k not in st.session_state:
         st.session_state[k] = v
 
+
+def _workspace():
+    # 히스토리 작업공간 — 로그인 사용자면 이메일, 아니면 URL ?ws= (처음 접속 시 만들어 URL에 붙임 → 북마크로 유지)
+    try:
+        email = st.user.get('email') if st.user.get('is_logged_in') else None   # st.login 인증 사용 시만
+    except Exception:
+        email = None
+    if email:
+        return str(email)
+    ws = st.query_params.get('ws')
+    if not ws:
+        ws = st.query_params['ws'] = secrets.token_urlsafe(16)   # 128비트 — 추측으로 남의 작업공간을 열 수 없게
+    return ws
+
+WORKSPACE = _workspace()
+
 st.markdown("""<style>
 .sim-hdr{background:#1a237e;color:white;padding:12px 18px;border-radius:6px;font-weight:bold;font-size:22px;margin-bottom:14px}
 .grp-lbl{background:#fff9c4;padding:6px 14px;font-weight:bold;font-size:17px;border-left:5px solid #f9a825;margin:10px 0;border-radius:3px}
@@ -96,12 +152,20 @@ div[data-testid="stTextArea"] textarea{font-size:15px!important}
 
 st.sidebar.title("🧪 음료개발 AI 플랫폼")
 st.sidebar.markdown("---")
-PAGES = ["🎯 컨셉→배합설계", "🧪 배합 시뮬레이터", "🧑‍🔬 AI 연구원 평가", "🎨 제품 이미지 생성",
+PAGES = ["🎯 컨셉→배합설계", "🧪 배합 시뮬레이터", "📈 설계공간 탐색", "🧑‍🔬 AI 연구원 평가", "🎨 제품 이미지 생성",
          "🔄 역설계", "📊 시장분석", "🎓 교육용 실습", "📋 기획서/HACCP",
-         "📑 식품표시사항", "🧫 시작 레시피", "📓 배합 히스토리"]
+         "📑 식품표시사항", "🧫 시작 레시피", "📓 배합 히스토리", "🛠️ LLM 사용량"]
 page = st.sidebar.radio("메뉴", PAGES)
 st.sidebar.markdown("---")
 st.sidebar.caption(f"원료 {len(df_ing)}종 · 제품 {len(df_product)}종")
+st.sidebar.radio("pH 계산", PH_MODELS, key='ph_model', horizontal=True,
+                 format_func={'linear': '빠른 추정(ΔpH)', 'equilibrium': '평형(전하균형)'}.get,
+                 help="평형: 산미료·염류 pKa와 과즙 완충능으로 전하균형을 풀어 계산 (고산·저완충 배합에서 정확)")
+st.sidebar.radio("감미도 계산", SWEET_MODELS, key='sweet_model', horizontal=True,
+                 format_func={'linear': '선형(감미기여 합)', 'beidler': '포화곡선+상승작용'}.get,
+                 help="포화곡선: 고감미료는 농도가 높을수록 감미가 포화되고, 아스파탐+Ace-K 등 블렌드는 상승작용 반영")
+st.sidebar.caption(f"📓 작업공간 `{WORKSPACE}`", help="배합 히스토리는 작업공간별로 저장됩니다. "
+                   "이 주소(?ws=)를 북마크하면 다음 접속에도 같은 히스토리를 씁니다.")
 if st.session_state.product_name:
     st.sidebar.info(f"📦 {st.session_state.product_name}\n{st.session_state.bev_type}/{st.session_state.flavor}")
 
@@ -235,13 +299,15 @@ def page_concept():
                 st.download_button("📥 CSV", csv, "추천배합표.csv", "text/csv", use_container_width=True)
         with bc3:
             if st.button("💾 히스토리 저장", use_container_width=True):
-                st.session_state.history.append({
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M'),
+                HISTORY.save(WORKSPACE, {
                     'name':      f"컨셉_{r.get('flavor','AI')}",
+                    'product':   st.session_state.product_name,
                     'type':      r.get('bev_type', ''),
                     'flavor':    r.get('flavor', ''),
-                    'slots':     [s.copy() for s in st.session_state.slots],
-                    'result':    calc_formulation(st.session_state.slots, st.session_state.volume),
+                    'slots':     st.session_state.slots,
+                    'volume':    st.session_state.volume,
+                    'result':    calc_formulation(st.session_state.slots, st.session_state.volume,
+                                                  st.session_state.ph_model, st.session_state.sweet_model),
                     'notes':     '',
                 })
                 st.success("✅ 저장")
@@ -308,6 +374,69 @@ def page_simulator():
             clear_slot_widget_keys()
             st.rerun()
 
+    # 배합표/결과/에이전트는 각각 독립 재실행되는 프래그먼트
+    # (행 입력 → 그리드+결과만, 채팅 → 에이전트만, 배합 일괄변경 → 전체 rerun)
+    _sim_grid()
+    _sim_agent()
+
+
+def _record_timing(section, t0):
+    """프래그먼트별 서버 처리시간(ms) — session_state['_sim_timing']"""
+    ms = round((time.perf_counter() - t0) * 1000, 1)
+    st.session_state.setdefault('_sim_timing', {})[section] = ms
+    if PROFILE_MODE and perf_profile.current() is None:   # 프래그먼트 단독 재실행
+        perf_profile.record_fragment(section, ms, st.session_state.get('_profile_sid', ''))
+
+
+def _rerun_fragment():
+    """현재 프래그먼트만 재실행 — 전체 rerun 도중 호출되면(프래그먼트 단독 실행이 아님) 전체 rerun"""
+    try:
+        st.rerun(scope="fragment")
+    except st.errors.StreamlitAPIException:
+        st.rerun()
+
+
+# ── 배합표 행 콜백: 바뀐 슬롯 1개만 갱신 (위젯 값은 session_state의 위젯 키에서 읽음) ──
+def _on_slot_pick(idx):
+    picked = st.session_state[f"i{idx}"]
+    s      = st.session_state.slots[idx]
+    cur    = s.get('원료명', '')
+    if picked == '✏️ 직접입력':
+        if cur and not s.get('is_custom'):
+            st.session_state.slots[idx] = EMPTY_SLOT.copy()   # 원료명 입력 전까지 비움
+    elif picked == '(선택)':
+        if cur:
+            st.session_state.slots[idx] = EMPTY_SLOT.copy()
+    elif picked != cur:
+        old_pct = safe_float(s.get('배합비(%)', 0))
+        st.session_state.slots[idx] = fill_slot_from_db(EMPTY_SLOT.copy(), picked, df_ing, PH_COL)
+        st.session_state.slots[idx]['배합비(%)'] = old_pct
+    st.session_state.slots[idx] = calc_slot_contributions(st.session_state.slots[idx])
+
+
+def _on_slot_custom(idx):
+    cname = st.session_state.get(f"ci{idx}", '')
+    s     = st.session_state.slots[idx]
+    cur   = s.get('원료명', '')
+    if cname and cname != cur:
+        new_s = fill_slot_from_db(EMPTY_SLOT.copy(), cname, df_ing, PH_COL)
+        new_s['배합비(%)']   = safe_float(s.get('배합비(%)', 0))
+        new_s['AI용도특성'] = s.get('AI용도특성', '')
+        st.session_state.slots[idx] = new_s
+    elif not cname and cur:
+        st.session_state.slots[idx] = EMPTY_SLOT.copy()
+    st.session_state.slots[idx] = calc_slot_contributions(st.session_state.slots[idx])
+
+
+def _on_slot_pct(idx):
+    st.session_state.slots[idx]['배합비(%)'] = st.session_state[f"pct{idx}"]
+    st.session_state.slots[idx] = calc_slot_contributions(st.session_state.slots[idx])
+
+
+@st.fragment
+def _sim_grid():
+    """배합표 그리드 — 행 위젯 변경 시 해당 행 콜백 + 합계/결과 패널만 재계산"""
+    t0 = time.perf_counter()
     st.markdown("---")
     hdr = st.columns([0.3, 2.5, 1.0, 0.7, 0.7, 0.7, 0.7, 0.7, 0.6])
     for i, h in enumerate(['No', '원료명', '배합비(%)', 'Bx', '산도', '감미', '단가', '당기여', 'g/kg']):
@@ -319,6 +448,9 @@ def page_simulator():
         st.markdown(f'<div class="grp-lbl">{group_name}</div>', unsafe_allow_html=True)
         for rn in group_rows:
             idx      = rn - 1
+            # 위젯 키가 없으면(최초 진입/일괄 로드 직후) 기여도 재계산, 이후엔 콜백에서만 갱신
+            if f"pct{idx}" not in st.session_state:
+                st.session_state.slots[idx] = calc_slot_contributions(st.session_state.slots[idx])
             s        = st.session_state.slots[idx]
             cur      = s.get('원료명', '')
             is_custom = s.get('is_custom', False)
@@ -335,41 +467,21 @@ def page_simulator():
                     def_idx = 0
 
                 picked = st.selectbox("원료", ING_NAMES, index=def_idx,
-                                      label_visibility="collapsed", key=f"i{idx}")
+                                      label_visibility="collapsed", key=f"i{idx}",
+                                      on_change=_on_slot_pick, args=(idx,))
 
                 if picked == '✏️ 직접입력':
-                    cname = st.text_input("원료명입력", value=cur if is_custom else "",
-                                          label_visibility="collapsed", key=f"ci{idx}",
-                                          placeholder="원료명 입력 후 Enter")
-                    if cname and cname != cur:
-                        new_s = fill_slot_from_db(EMPTY_SLOT.copy(), cname, df_ing, PH_COL)
-                        new_s['배합비(%)']   = safe_float(s.get('배합비(%)', 0))
-                        new_s['AI용도특성'] = s.get('AI용도특성', '')
-                        st.session_state.slots[idx] = new_s
-                        s = new_s
-                    elif not cname and cur:
-                        st.session_state.slots[idx] = EMPTY_SLOT.copy()
-                        s = st.session_state.slots[idx]
-
-                elif picked == '(선택)':
-                    if cur:
-                        st.session_state.slots[idx] = EMPTY_SLOT.copy()
-                        s = st.session_state.slots[idx]
-
-                elif picked != cur:
-                    old_pct = safe_float(s.get('배합비(%)', 0))
-                    st.session_state.slots[idx] = fill_slot_from_db(EMPTY_SLOT.copy(), picked, df_ing, PH_COL)
-                    st.session_state.slots[idx]['배합비(%)'] = old_pct
-                    s = st.session_state.slots[idx]
+                    st.text_input("원료명입력", value=cur if is_custom else "",
+                                  label_visibility="collapsed", key=f"ci{idx}",
+                                  placeholder="원료명 입력 후 Enter",
+                                  on_change=_on_slot_custom, args=(idx,))
 
             with c[2]:
-                new_pct = st.number_input("pct", 0.0, 100.0, float(s.get('배합비(%)', 0)),
-                                          0.1, format="%.3f", label_visibility="collapsed", key=f"pct{idx}")
-                st.session_state.slots[idx]['배합비(%)'] = new_pct
+                st.number_input("pct", 0.0, 100.0, float(s.get('배합비(%)', 0)),
+                                0.1, format="%.3f", label_visibility="collapsed", key=f"pct{idx}",
+                                on_change=_on_slot_pct, args=(idx,))
 
-            st.session_state.slots[idx] = calc_slot_contributions(st.session_state.slots[idx])
             s = st.session_state.slots[idx]
-
             css = 't-cust' if s.get('is_custom') and s.get('원료명') else 't-cel'
             c[3].markdown(f'<span class="{css}">{s.get("당도(Bx)", 0)}</span>',    unsafe_allow_html=True)
             c[4].markdown(f'<span class="{css}">{s.get("산도(%)", 0)}</span>',      unsafe_allow_html=True)
@@ -423,7 +535,7 @@ def page_simulator():
                     est_results.append({'슬롯': ci+1, '원료명': nm, '오류': str(e)})
                 bar.progress((pi+1) / len(custom_zero))
             st.session_state.ai_est_results = est_results
-            st.rerun()
+            _rerun_fragment()
 
     if st.session_state.ai_est_results:
         st.markdown('<div class="est-box">🤖 <b>AI 이화학분석 결과</b></div>', unsafe_allow_html=True)
@@ -434,13 +546,13 @@ def page_simulator():
         st.error(f"⚠️ 원료합계 **{ing_total:.3f}%** > 100%")
         if st.button("💧 정제수 0%로 설정", type="primary", use_container_width=True):
             st.session_state.slots[19]['배합비(%)'] = 0
-            st.rerun()
+            _rerun_fragment()
     elif ing_total < 100:
         st.info(f"원료합계 **{ing_total:.3f}%** — 정제수 **{water_pct:.3f}%**")
         if abs(water_pct - safe_float(st.session_state.slots[19].get('배합비(%)', 0))) > 0.001:
             if st.button(f"💧 정제수 → {water_pct:.3f}% 조정", type="primary", use_container_width=True):
                 st.session_state.slots[19]['배합비(%)'] = water_pct
-                st.rerun()
+                _rerun_fragment()
     else:
         st.success(f"✅ 합계 100.000%")
 
@@ -472,7 +584,7 @@ def page_simulator():
                         try:
                             est = call_gpt_estimate_ingredient(OPENAI_KEY, s['원료명'])
                             st.session_state.slots[ci] = apply_estimation_to_slot(st.session_state.slots[ci], est)
-                            st.rerun()
+                            _rerun_fragment()
                         except Exception as e:
                             st.error(str(e))
                 st.session_state.slots[ci] = calc_slot_contributions(st.session_state.slots[ci])
@@ -491,10 +603,19 @@ def page_simulator():
                 except:
                     pass
                 bar.progress((pi+1)/len(no_info))
-            st.rerun()
+            _rerun_fragment()
+
+    _sim_results()
+    _record_timing('grid', t0)
+
 
+@st.fragment
+def _sim_results():
+    """시뮬레이션 결과 패널 — 그리드 재실행 시 함께, 저장/출력 위젯은 단독 재실행"""
+    t0 = time.perf_counter()
     st.markdown("---")
-    result = calc_formulation(st.session_state.slots, st.session_state.volume)
+    result = calc_formulation(st.session_state.slots, st.session_state.volume, st.session_state.ph_model,
+                              st.session_state.sweet_model)
     st.markdown('<div class="sim-hdr">▶ 시뮬레이션 결과</div>', unsafe_allow_html=True)
     spec  = get_spec(df_spec, st.session_state.bev_type)
     comp  = check_compliance(result, spec) if spec else {}
@@ -527,14 +648,16 @@ def page_simulator():
     with b1:
         sn = st.text_input("저장명", f"{st.session_state.product_name}_{datetime.now().strftime('%H%M')}")
         if st.button("💾 히스토리 저장", use_container_width=True):
-            st.session_state.history.append({
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M'), 'name': sn,
+            HISTORY.save(WORKSPACE, {
+                'name':      sn,
+                'product':   st.session_state.product_name,
                 'type':      st.session_state.bev_type,
                 'flavor':    st.session_state.flavor,
-                'slots':     [s.copy() for s in st.session_state.slots],
-                'result':    result.copy(), 'notes': '',
+                'slots':     st.session_state.slots,
+                'volume':    st.session_state.volume,
+                'result':    result, 'notes': '',
             })
-            st.success(f"✅ 저장 ({len(st.session_state.history)}건)")
+            st.success(f"✅ 저장 ({HISTORY.count(WORKSPACE):,}건)")
     with b2:
         st.markdown("<br>", unsafe_allow_html=True)
         out_rows = [{'No': i+1, '원료명': s['원료명'], '배합비(%)': round(s['배합비(%)'], 3),
@@ -553,6 +676,86 @@ def page_simulator():
         if out_rows and st.button("📋 배합표 출력", use_container_width=True):
             st.dataframe(pd.DataFrame(out_rows), use_container_width=True, hide_index=True)
 
+    with st.expander("🍃 당류 대체 탐색 (제로슈거)"):
+        st.caption("당류(Brix>0)를 빼고 현재 감미(포화곡선+상승작용 기준)를 맞추는 감미료 단일·2종 블렌드 — 원가 순")
+        zc = st.columns(2)
+        max_bulk = zc[0].number_input("당알코올 등 벌크 감미료 상한(%)", 0.0, 20.0, 8.0, 0.5)
+        zs_tol = zc[1].number_input("감미 허용오차(%)", 0.5, 10.0, 2.0, 0.5)
+        if st.button("🔍 대체 조합 탐색", use_container_width=True):
+            st.session_state.zero_sugar = zero_sugar_search(
+                st.session_state.slots, df_ing, max_bulk_pct=max_bulk, tol=zs_tol / 100)
+        zs = st.session_state.zero_sugar
+        if zs is not None:
+            if zs.empty:
+                st.info("대체할 당류가 없습니다")
+            else:
+                st.dataframe(zs, use_container_width=True, hide_index=True)
+                pick = st.selectbox("적용할 조합", zs.index[zs['가능']],
+                                    format_func=lambda i: f"{zs.at[i, '조합']} ({zs.at[i, '원가변화(원/kg)']:+,.0f}원/kg)")
+                if pick is not None and st.button("✅ 배합에 적용", use_container_width=True):
+                    apply_sweetener_blend(st.session_state.slots, zs.loc[pick], df_ing, PH_COL)
+                    st.session_state.zero_sugar = None
+                    clear_slot_widget_keys()
+                    st.rerun()
+
+    with st.expander("🔁 대체 원료 찾기 (단가 인상·품절)"):
+        st.caption("같은 Brix·산도·감미·pH 기여를 내는 원료 — 배합비는 배합 기여 합계가 유지되도록 다시 계산")
+        slots = st.session_state.slots
+        used  = [i for i, s in enumerate(slots[:19]) if s.get('원료명') and safe_float(s.get('배합비(%)', 0)) > 0]
+        if used:
+            sc = st.columns([3, 1, 1])
+            si = sc[0].selectbox("대상 원료", used, key="sub_slot", format_func=lambda i: f"{i+1}. {slots[i]['원료명']}")
+            same_cat = sc[1].checkbox("같은 분류만", True, key="sub_same")
+            cheaper = sc[2].checkbox("더 싼 것만", False, key="sub_cheap")
+            cands = find_substitutes(slots[si], SUB_INDEX, 10, same_cat, cheaper)
+            if cands.empty:
+                st.info("후보 없음")
+            else:
+                st.dataframe(cands, use_container_width=True, hide_index=True)
+                pick = st.selectbox("적용할 원료", cands.index, key="sub_pick",
+                                    format_func=lambda r: f"{cands.at[r, '원료명']} {cands.at[r, '배합비(%)']}% "
+                                                          f"({cands.at[r, '원가변화(원/kg)']:+,.1f}원/kg)")
+                if st.button("✅ 대체 적용", use_container_width=True, key="sub_apply"):
+                    s = fill_slot_from_db(EMPTY_SLOT.copy(), cands.at[pick, '원료명'], df_ing, PH_COL)
+                    s['배합비(%)'] = float(cands.at[pick, '배합비(%)'])
+                    slots[si] = calc_slot_contributions(s)
+                    clear_slot_widget_keys()
+                    st.rerun()
+
+    with st.expander("📅 단가 이력 · 원가 추이"):
+        if len(PRICE_BOOK['dates']) < 2:
+            st.info(f"단가 이력 없음 — 엑셀 옆에 {PRICE_CSV} (원료명, 적용일, 단가(원/kg), 공급사)를 두면 기준일별 원가를 계산합니다")
+        else:
+            if PRICE_BOOK['unmatched']:
+                st.warning(f"{PRICE_CSV}의 원료DB에 없는 원료명 {len(PRICE_BOOK['unmatched'])}종은 반영하지 않음 (이름 정확히 일치 필요): "
+                           + ', '.join(PRICE_BOOK['unmatched']))
+            day = st.date_input("단가 기준일", datetime.now().date(), key="price_day")
+            asof = calc_formulation(st.session_state.slots, st.session_state.volume, st.session_state.ph_model,
+                                    st.session_state.sweet_model, price_date=day, price_book=PRICE_BOOK)
+            pc = st.columns(2)
+            pc[0].metric(f"원가(원/kg) · {day}", f"{asof['원재료비(원/kg)']:,.0f}",
+                         f"{asof['원재료비(원/kg)'] - result['원재료비(원/kg)']:+,.1f} (슬롯 단가 대비)", delta_color="inverse")
+            pc[1].metric(f"원가(원/병) · {day}", f"{asof['원재료비(원/병)']:,.0f}",
+                         f"{asof['원재료비(원/병)'] - result['원재료비(원/병)']:+,.1f}", delta_color="inverse")
+            hist = cost_history(st.session_state.slots, PRICE_BOOK, st.session_state.volume)
+            if len(hist) > 1:
+                x = hist['적용일'].fillna(hist['적용일'].min() - pd.Timedelta(days=90))   # 원료DB 기준은 첫 적용일 앞에 표시
+                x = pd.concat([x, pd.Series([max(pd.Timestamp(day), x.iloc[-1])])], ignore_index=True)
+                y = pd.concat([hist['원재료비(원/kg)'], hist['원재료비(원/kg)'].iloc[-1:]], ignore_index=True)
+                fig = go.Figure(go.Scatter(x=x, y=y, mode='lines+markers', line_shape='hv',
+                                           hovertext=list(hist['변경원료']) + [''], name='원재료비(원/kg)'))
+                fig.update_layout(height=280, margin=dict(l=10, r=10, t=10, b=10), yaxis_title='원/kg')
+                st.plotly_chart(fig, use_container_width=True)
+                st.dataframe(hist, use_container_width=True, hide_index=True)
+            else:
+                st.caption("배합 원료에 단가 이력이 없습니다 (원료DB 예상단가 고정)")
+    _record_timing('results', t0)
+
+
+@st.fragment
+def _sim_agent():
+    """Gemini 배합 에이전트 — 채팅 입력은 이 프래그먼트만 재실행 (배합 적용 시 전체 rerun)"""
+    t0 = time.perf_counter()
     # ══════════════════════════════════════════════════════
     # 🤖 Gemini 배합 에이전트 챗봇
     # ══════════════════════════════════════════════════════
@@ -586,7 +789,8 @@ def page_simulator():
         st.warning("⚠️ Gemini API 키 없음 — secrets.toml에 GOOGLE_API_KEY 추가 필요")
     else:
         def _build_context():
-            result = calc_formulation(st.session_state.slots, st.session_state.volume)
+            result = calc_formulation(st.session_state.slots, st.session_state.volume, st.session_state.ph_model,
+                                      st.session_state.sweet_model)
             lines  = []
             for i, s in enumerate(st.session_state.slots):
                 nm  = s.get('원료명', '')
@@ -606,72 +810,23 @@ def page_simulator():
                 f"원가 {result['원재료비(원/kg)']:,.0f}원/kg"
             )
 
-        def _call_gemini_agent(user_msg: str, history: list) -> str:
-            import requests as _req
-
-            ctx = _build_context()
-
-            # 컨텍스트를 매 질문마다 user 메시지 앞에 주입
-            full_msg = (
-                f"[음료 R&D 수석연구원으로 답변]\n"
-                f"[현재 배합 데이터]\n{ctx}\n\n"
-                f"[배합 변경 제안 시 답변 끝에 포함]\n"
-                f'```json\n{{"changes":[{{"슬롯":1,"원료명":"구연산","배합비":0.15}}]}}\n```\n'
-                f"변경 없는 질문은 JSON 없이 텍스트만. 한국어 답변.\n\n"
-                f"질문: {user_msg}"
-            )
+        _GEMINI_RULES = (
+            "[음료 R&D 수석연구원으로 답변]\n"
+            "[배합 변경 제안 시 답변 끝에 포함]\n"
+            '```json\n{"changes":[{"슬롯":1,"원료명":"구연산","배합비":0.15}]}\n```\n'
+            "변경 없는 질문은 JSON 없이 텍스트만. 한국어 답변."
+        )
 
-            # 히스토리 role 교대 보정 (user↔model 엄격히 교대)
-            contents = []
-            expected = "user"
-            for turn in history[-6:]:
-                role = "model" if turn["role"] in ("model", "assistant") else "user"
-                if role != expected:
-                    continue   # 순서 어긋나는 턴 스킵
-                contents.append({"role": role, "parts": [{"text": turn["text"]}]})
-                expected = "model" if expected == "user" else "user"
-
-            # 마지막이 user면 model 더미 삽입
-            if contents and contents[-1]["role"] == "user":
-                contents.append({"role": "model", "parts": [{"text": "확인했습니다."}]})
-
-            contents.append({"role": "user", "parts": [{"text": full_msg}]})
-
-            payload = {
-                "contents": contents,
-                "generationConfig": {
-                    "maxOutputTokens": 8192,
-                    "temperature": 0.4,
-                },
-            }
-            url = (
-                "https://generativelanguage.googleapis.com/v1/models/"
-                f"gemini-2.5-pro:generateContent?key={gemini_key}"
-            )
-            resp = _req.post(
-                url,
-                headers={"Content-Type": "application/json"},
-                json=payload,
-                timeout=60,
-            )
-            if not resp.ok:
-                try:
-                    err = resp.json().get("error", {}).get("message", resp.text[:300])
-                except Exception:
-                    err = resp.text[:300]
-                raise RuntimeError(f"HTTP {resp.status_code}: {err}")
+        def _call_gemini_agent(user_msg: str, history: list) -> str:
+            # 답변 규칙·기준 배합·이전 대화 요약은 고정 프리앰블로, 매 질문에는 배합 변경분만 전송
+            if 'gemini_ctx' not in st.session_state:
+                st.session_state.gemini_ctx = ChatContext(_GEMINI_RULES)
+            contents = st.session_state.gemini_ctx.build_contents(
+                history, user_msg, _build_context())
 
-            data = resp.json()
-            try:
-                parts = data["candidates"][0]["content"]["parts"]
-                return parts[0]["text"]
-            except (KeyError, IndexError):
-                # MAX_TOKENS 등으로 parts 없을 때
-                finish = data.get("candidates", [{}])[0].get("finishReason", "UNKNOWN")
-                if finish == "MAX_TOKENS":
-                    raise RuntimeError("응답이 너무 길어 잘렸습니다. 질문을 더 짧게 해보세요.")
-                import json as _j
-                raise RuntimeError(f"응답 파싱 실패 ({finish}): {_j.dumps(data, ensure_ascii=False)[:400]}")
+            # REST 호출/오류처리는 engine.call_gemini_rest (llm_gateway 경유)
+            return call_gemini_rest(gemini_key, contents, model="gemini-2.5-pro",
+                                    max_tok=8192, temp=0.4, timeout=60)
 
         def _parse_changes(text: str):
             import re as _re
@@ -718,11 +873,11 @@ def page_simulator():
                         st.session_state.ai_est_results = est_results
                     st.session_state.gemini_pending = None
                     clear_slot_widget_keys()
-                    st.rerun()
+                    st.rerun()   # 배합표 변경 → 전체 rerun
             with ap2:
                 if st.button("❌ 무시", use_container_width=True, key="gem_dismiss"):
                     st.session_state.gemini_pending = None
-                    st.rerun()
+                    _rerun_fragment()
 
         # 입력창
         user_input = st.chat_input(
@@ -742,13 +897,98 @@ def page_simulator():
                 except Exception as e:
                     st.session_state.gemini_chat.append(
                         {"role": "model", "text": f"❌ Gemini 오류: {e}"})
-            st.rerun()
+            cap_history(st.session_state.gemini_chat)
+            _rerun_fragment()
 
         if st.session_state.gemini_chat:
             if st.button("🔄 대화 초기화", key="gem_clear"):
                 st.session_state.gemini_chat    = []
                 st.session_state.gemini_pending = None
-                st.rerun()
+                st.session_state.pop('gemini_ctx', None)
+                _rerun_fragment()
+    _record_timing('agent', t0)
+
+
+# ============================================================
+# PAGE 1-2: 설계공간 탐색 (파레토)
+# ============================================================
+def page_sweep():
+    st.title("📈 설계공간 탐색 (파레토)")
+    slots  = st.session_state.slots
+    active = [i for i, s in enumerate(slots[:19]) if s.get('원료명') and safe_float(s.get('배합비(%)', 0)) > 0]
+    if len(active) < 2:
+        st.warning("시뮬레이터에서 원료를 2개 이상 입력하세요")
+        return
+    sel = st.multiselect("변수 원료 (2~4개, 나머지는 현재 배합비 고정)", active, default=active[:3],
+                         max_selections=4,
+                         format_func=lambda i: f"{i+1}. {slots[i]['원료명']} ({slots[i]['배합비(%)']}%)")
+    bounds = []
+    for i in sel:
+        p = safe_float(slots[i].get('배합비(%)', 0))
+        c = st.columns([3, 1, 1])
+        c[0].markdown(f"**{slots[i]['원료명']}**")
+        lo = c[1].number_input("하한(%)", 0.0, 100.0, round(p * 0.5, 4), format="%.4f", key=f"sw_lo{i}")
+        hi = c[2].number_input("상한(%)", 0.0, 100.0, round(p * 1.5, 4), format="%.4f", key=f"sw_hi{i}")
+        bounds.append((i, lo, max(lo, hi)))
+    c = st.columns(2)
+    method = c[0].radio("표본", SWEEP_METHODS, horizontal=True,
+                        format_func={'lhs': '라틴 하이퍼큐브', 'grid': '격자'}.get)
+    n = c[1].select_slider("점 수", [1_000, 10_000, 50_000, 100_000, 200_000], 100_000)
+    spec = get_spec(df_spec, st.session_state.bev_type) if st.session_state.bev_type else None
+    st.caption(f"규격: {st.session_state.bev_type} Brix {spec['Brix_min']}~{spec['Brix_max']} · "
+               f"산도 {spec['산도_min']}~{spec['산도_max']}%" if spec else
+               "음료유형 규격 없음 → 현재 배합의 Brix·산도 ±10%를 목표 창으로 사용")
+
+    if len(sel) >= 2 and st.button("🚀 탐색", type="primary", use_container_width=True):
+        t0 = time.perf_counter()
+        out, front = design_sweep(slots, bounds, spec, n, method, st.session_state.volume,
+                                  st.session_state.ph_model, st.session_state.sweet_model)
+        st.session_state.sweep = (out, front, [b[0] for b in bounds], (time.perf_counter() - t0) * 1000)
+    if not st.session_state.sweep:
+        return
+    out, front, var_idx, ms = st.session_state.sweep
+    var_cols = list(out.columns[:len(var_idx)])
+    k = st.columns(4)
+    k[0].metric("평가 점", f"{len(out):,}")
+    k[1].metric("규격적합", f"{int(out['규격적합'].sum()):,}")
+    k[2].metric("파레토 전선", f"{int(front.sum()):,}")
+    k[3].metric("계산", f"{ms:,.0f} ms")
+
+    ok_only = st.toggle("규격적합 점만", value=True)
+    show = front & out['규격적합'].to_numpy() if ok_only else front
+    pf = out[show].sort_values('원재료비(원/kg)')
+    bg = out.sample(min(len(out), 5000), random_state=0)
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(x=bg['원재료비(원/kg)'], y=bg['규격편차'], mode='markers', name='표본',
+                               marker=dict(color='#cfd8dc', size=4), hoverinfo='skip'))
+    fig.add_trace(go.Scatter(
+        x=pf['원재료비(원/kg)'], y=pf['규격편차'], mode='markers', name='파레토',
+        marker=dict(color=pf['과즙함량(%)'], colorscale='Viridis', size=8, showscale=True,
+                    colorbar=dict(title='과즙(%)')),
+        customdata=pf[var_cols + ['예상당도(Bx)', '예상산도(%)']].to_numpy(),
+        hovertemplate='<br>'.join([f"{c} %{{customdata[{j}]:.3f}}" for j, c in enumerate(var_cols)]
+                                  + ["Brix %{customdata[" + str(len(var_cols)) + "]:.2f}",
+                                     "산도 %{customdata[" + str(len(var_cols) + 1) + "]:.3f}%"])
+                      + '<extra></extra>'))
+    fig.add_hline(y=1, line_dash='dot', annotation_text='규격 경계')
+    fig.update_layout(xaxis_title='원재료비(원/kg)', yaxis_title='규격편차 (0=중심, 1=경계)', height=480,
+                      margin=dict(l=10, r=10, t=30, b=10))
+    st.plotly_chart(fig, use_container_width=True)
+
+    cols = var_cols + ['원재료비(원/kg)', '규격편차', '과즙함량(%)', '예상당도(Bx)', '예상산도(%)', '예상pH',
+                       '예상감미도', '규격적합']
+    st.dataframe(pf[cols], use_container_width=True, hide_index=True, height=300)
+    if not pf.empty:
+        pick = st.selectbox("시뮬레이터에 적용할 점", pf.index,
+                            format_func=lambda r: " · ".join(f"{c} {pf.at[r, c]:.3f}" for c in var_cols)
+                            + f" → {pf.at[r, '원재료비(원/kg)']:,.0f}원/kg")
+        if st.button("✅ 배합에 적용", use_container_width=True):
+            for i, c in zip(var_idx, var_cols):
+                slots[i]['배합비(%)'] = round(float(pf.at[pick, c]), 4)
+                calc_slot_contributions(slots[i])
+            calc_formulation(slots, st.session_state.volume)
+            clear_slot_widget_keys()
+            st.success("✅ 적용 — 🧪 배합 시뮬레이터에서 확인")
 
 
 # ============================================================
@@ -759,7 +999,8 @@ def page_ai_researcher():
     if not OPENAI_KEY:
         st.error("⚠️ OpenAI API 키 필요")
         return
-    result = calc_formulation(st.session_state.slots, st.session_state.volume)
+    result = calc_formulation(st.session_state.slots, st.session_state.volume, st.session_state.ph_model,
+                              st.session_state.sweet_model)
     active = [(s['원료명'], s['배합비(%)']) for s in st.session_state.slots
               if safe_float(s.get('배합비(%)', 0)) > 0 and s.get('원료명')]
     if not active:
@@ -815,41 +1056,18 @@ def page_image():
             if s.get('원료명') and safe_float(s.get('배합비(%)', 0)) > 0
         ]
 
-        # ── 플레이버/색상/가니쉬 매핑 ──
-        FLAVOR_MAP = {
-            '자몽':    ('grapefruit',    '#FF6B4A', 'fresh grapefruit halves with zest'),
-            '레몬':    ('lemon',         '#FFF176', 'bright lemon slices and zest ribbons'),
-            '라임':    ('lime',          '#A5D6A7', 'lime wedges with crushed mint'),
-            '오렌지':  ('orange',        '#FF9800', 'orange slices with peel curl'),
-            '사과':    ('apple',         '#C8E6C9', 'crisp green apple slices'),
-            '복숭아':  ('peach',         '#FFCCBC', 'ripe peach slices showing texture'),
-            '딸기':    ('strawberry',    '#EF9A9A', 'halved fresh strawberries with seeds'),
-            '포도':    ('grape',         '#CE93D8', 'purple grape clusters glistening'),
-            '망고':    ('mango',         '#FFE082', 'tropical mango cubes with leaf'),
-            '유자':    ('yuzu',          '#FFF9C4', 'yuzu citrus with white blossom'),
-            '키위':    ('kiwi',          '#DCEDC8', 'kiwi cross-section showing seeds'),
-            '파인애플':('pineapple',     '#FFF176', 'golden pineapple chunks with core'),
-            '블루베리':('blueberry',     '#9FA8DA', 'plump fresh blueberries'),
-            '석류':    ('pomegranate',   '#EF9A9A', 'pomegranate seeds glistening red'),
-            '매실':    ('plum',          '#B39DDB', 'green-tinted plum halved'),
-            '녹차':    ('green tea',     '#C8E6C9', 'unfurled green tea leaves'),
-            '홍차':    ('black tea',     '#D7CCC8', 'rolled black tea leaves with steam'),
-            '커피':    ('coffee',        '#8D6E63', 'roasted coffee beans and crema'),
-            '아사이':  ('acai',          '#7B1FA2', 'dark acai berries'),
-            '히비스커스':('hibiscus',    '#E91E63', 'dried hibiscus petals'),
-        }
-
+        # ── 플레이버/색상/가니쉬 매핑 (engine.RTD_FLAVORS) ──
         detected_flavors  = []
         garnish_elements  = []
         liquid_color_hint = 'light cyan'
 
         for ing in active_ings:
-            for kr, (en, color_hex, garnish) in FLAVOR_MAP.items():
-                if kr in ing:
-                    detected_flavors.append(en)
-                    liquid_color_hint = en
-                    if garnish:
-                        garnish_elements.append(garnish)
+            for kr in KEYWORDS.matches(ing, 'rtd_flavor'):
+                en, color_hex, garnish = RTD_FLAVORS[kr]
+                detected_flavors.append(en)
+                liquid_color_hint = en
+                if garnish:
+                    garnish_elements.append(garnish)
 
         detected_flavors = list(dict.fromkeys(detected_flavors))
         garnish_elements = list(dict.fromkeys(garnish_elements))
@@ -872,53 +1090,15 @@ def page_image():
         }
         container_desc = CONTAINER_MAP.get(container, f'{volume}ml {container} container')
 
-        # ── 음료유형별 액체 묘사 ──
-        BEV_LIQUID = {
-            '탄산': ('sparkling carbonated liquid with rising micro-bubbles, '
-                     'effervescent surface, CO2 streams clearly visible'),
-            '과즙': ('slightly cloudy fruit juice, natural pulp opacity, '
-                     'rich layered fruit pigmentation'),
-            '차':   ('translucent amber tea liquid, delicate tannin golden hue, '
-                     'clean bright appearance'),
-            '기능': ('crystal-clear functional beverage, '
-                     'clean transparent appearance with slight tint'),
-        }
-        liquid_desc = 'refreshing translucent beverage'
-        for key, desc in BEV_LIQUID.items():
-            if key in (bev_type or ''):
-                liquid_desc = desc
-                break
-        if any('탄산' in i or 'soda' in i for i in active_ings):
-            liquid_desc = BEV_LIQUID['탄산']
-
-        # ── 기능성 포지셔닝 ──
-        functional_tags = []
-        if any(x in ' '.join(active_ings) for x in ['제로', '에리스', '수크랄', '스테비']):
-            functional_tags.append('zero sugar clean-label positioning')
-        if any(x in ' '.join(active_ings) for x in ['비타민', '아스코르']):
-            functional_tags.append('vitamin-enriched wellness')
-        if any(x in ' '.join(active_ings) for x in ['콜라겐', 'collagen']):
-            functional_tags.append('beauty collagen drink')
-        if any(x in ' '.join(active_ings) for x in ['유산균', '프로바이']):
-            functional_tags.append('probiotic health drink')
-        if any(x in ' '.join(active_ings) for x in ['홍삼', '인삼']):
-            functional_tags.append('Korean red ginseng health drink')
-
-        # ── 마케팅 컨셉에서 분위기 키워드 추출 ──
-        mood_tags = []
-        concept_low = (concept_text or '').lower()
-        if any(x in concept_low for x in ['프리미엄', 'premium', '고급']):
-            mood_tags.append('luxury premium feel')
-        if any(x in concept_low for x in ['여성', '우먼', 'woman', '2030']):
-            mood_tags.append('feminine elegant aesthetic, soft pastel tones')
-        if any(x in concept_low for x in ['건강', 'health', '웰니스', 'wellness']):
-            mood_tags.append('healthy clean wellness vibe')
-        if any(x in concept_low for x in ['청량', '상큼', 'refresh', '시원']):
-            mood_tags.append('ultra-refreshing cool atmosphere')
-        if any(x in concept_low for x in ['어린이', '키즈', 'kids', '아동']):
-            mood_tags.append('playful colorful fun design')
-        if any(x in concept_low for x in ['스포츠', 'sport', '에너지', 'energy']):
-            mood_tags.append('dynamic energetic sporty mood')
+        # ── 음료유형별 액체 묘사 / 기능성 포지셔닝 / 컨셉 분위기 (engine.RTD_* 표, 키워드 스캔 1회씩) ──
+        ing_hits    = KEYWORDS.find(' '.join(active_ings))
+        liquid_key  = KEYWORDS.first(bev_type or '', 'rtd_liquid')
+        liquid_desc = RTD_BEV_LIQUID[liquid_key] if liquid_key else 'refreshing translucent beverage'
+        if KEYWORDS.pick(ing_hits, 'rtd_carbonated'):
+            liquid_desc = RTD_BEV_LIQUID['탄산']
+
+        functional_tags = KEYWORDS.pick(ing_hits, 'rtd_functional')
+        mood_tags       = KEYWORDS.matches((concept_text or '').lower(), 'rtd_mood')
 
         # ── 프롬프트 조립 ──
         flavor_str   = ' and '.join(detected_flavors[:3]) if detected_flavors else 'natural'
@@ -980,31 +1160,42 @@ def page_image():
             return ""
         try:
             import requests as _req
-            resp = _req.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={"Authorization": f"Bearer {OPENAI_KEY}",
-                         "Content-Type": "application/json"},
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system",
-                         "content": (
-                             "You are a creative director specializing in beverage product photography. "
-                             "Convert Korean beverage marketing concepts into concise English "
-                             "visual style keywords for DALL-E prompts. "
-                             "Output: 1 sentence, max 30 words, English only, "
-                             "focus on visual atmosphere, lighting, and color palette."
-                         )},
-                        {"role": "user",
-                         "content": f"Korean concept: {concept_text}\nConvert to visual style keywords:"}
-                    ],
-                    "max_tokens": 60,
-                    "temperature": 0.7,
-                },
-                timeout=10,
-            )
-            if resp.status_code == 200:
-                return resp.json()["choices"][0]["message"]["content"].strip()
+            body = {
+                "model": "gpt-4o-mini",
+                "messages": [
+                    {"role": "system",
+                     "content": (
+                         "You are a creative director specializing in beverage product photography. "
+                         "Convert Korean beverage marketing concepts into concise English "
+                         "visual style keywords for DALL-E prompts. "
+                         "Output: 1 sentence, max 30 words, English only, "
+                         "focus on visual atmosphere, lighting, and color palette."
+                     )},
+                    {"role": "user",
+                     "content": f"Korean concept: {concept_text}\nConvert to visual style keywords:"}
+                ],
+                "max_tokens": 60,
+                "temperature": 0.7,
+            }
+            with llm_metrics.track('openai', 'gpt-4o-mini', 'STYLE_TRANSLATOR') as rec:
+                resp, shared = llm_gateway.call_shared(
+                    'openai', (OPENAI_KEY, body),
+                    lambda: _req.post(
+                        os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1") + "/chat/completions",
+                        headers={"Authorization": f"Bearer {OPENAI_KEY}",
+                                 "Content-Type": "application/json"},
+                        json=body, timeout=10, hooks={'response': rec.first_byte}),
+                    tokens=llm_gateway.estimate_tokens(concept_text, 60))
+                rec.cache = 'coalesced' if shared else 'miss'
+                if resp.status_code != 200:
+                    rec.outcome = 'error'
+                    rec.error = f"HTTP {resp.status_code}"
+                    return ""
+                data = resp.json()
+                if not shared:
+                    u = data.get("usage", {})
+                    rec.usage(u.get("prompt_tokens", 0), u.get("completion_tokens", 0))
+                return data["choices"][0]["message"]["content"].strip()
         except Exception:
             pass
         return ""
@@ -1086,35 +1277,29 @@ def page_image():
             st.stop()
         with st.spinner("🎨 DALL-E 3 생성 중… (15~30초 소요)"):
             try:
-                # call_dalle 시그니처에 따라 파라미터 조정
-                try:
-                    st.session_state.generated_image = call_dalle(
-                        OPENAI_KEY, prompt, size=img_size, quality=img_quality)
-                except TypeError:
-                    # engine.py의 call_dalle가 size/quality 미지원 시 fallback
-                    st.session_state.generated_image = call_dalle(OPENAI_KEY, prompt)
-                st.success("✅ 이미지 생성 완료!")
+                # 같은 프롬프트·사이즈·품질은 로컬 저장소에서 재사용 (재생성/재다운로드 없음)
+                key, hit = image_store.get_or_create(
+                    prompt, img_size, img_quality,
+                    lambda: call_dalle(OPENAI_KEY, prompt, size=img_size, quality=img_quality))
+                st.session_state.generated_image = key
+                st.success("✅ 저장된 이미지를 불러왔습니다." if hit else "✅ 이미지 생성 완료!")
             except Exception as e:
                 st.error(f"❌ 생성 실패: {e}")
 
-    # 결과
-    if st.session_state.get('generated_image'):
+    # 결과 (디스크에서 제공 — rerun 시 네트워크 요청 없음)
+    img_key = st.session_state.get('generated_image')
+    if img_key and image_store.has(img_key):
         st.markdown("---")
         st.markdown("#### 🖼️ 생성 결과")
-        st.image(st.session_state.generated_image, use_container_width=True)
+        st.image(image_store.thumbnail(img_key), use_container_width=True)
 
         dl_col, reset_col = st.columns(2)
         with dl_col:
-            try:
-                import requests as _req
-                img_bytes = _req.get(st.session_state.generated_image, timeout=15).content
-                st.download_button(
-                    "📥 이미지 다운로드", img_bytes,
-                    file_name=f"{st.session_state.get('product_name','beverage')}_image.png",
-                    mime="image/png", use_container_width=True,
-                )
-            except Exception:
-                st.caption("URL로 직접 저장하세요.")
+            st.download_button(
+                "📥 이미지 다운로드", image_store.read_bytes(img_key),
+                file_name=f"{st.session_state.get('product_name','beverage')}_image.png",
+                mime="image/png", use_container_width=True,
+            )
         with reset_col:
             if st.button("🔄 이미지 초기화", use_container_width=True, key="dalle_reset"):
                 st.session_state.generated_image = ''
@@ -1191,7 +1376,7 @@ def page_education():
             st.session_state.edu_slots[si] = calc_slot_contributions(st.session_state.edu_slots[si])
             ec[3].markdown(f'<span class="t-num">Bx: {st.session_state.edu_slots[si].get("당기여",0):.2f}</span>', unsafe_allow_html=True)
         st.markdown("---")
-    er = calc_formulation(st.session_state.edu_slots, 500)
+    er = calc_formulation(st.session_state.edu_slots, 500, st.session_state.ph_model, st.session_state.sweet_model)
     mc = st.columns(5)
     mc[0].metric("Brix",  f"{er['예상당도(Bx)']:.2f}°")
     mc[1].metric("pH",    f"{er['예상pH']:.2f}")
@@ -1210,9 +1395,20 @@ def page_education():
 # ============================================================
 # PAGE 7: HACCP
 # ============================================================
+def _haccp_zip(jobs):
+    """HACCP 서류 묶음 ZIP 바이트 — 다운로드 클릭 시 별도 스레드에서 실행.
+    서류는 1건씩 렌더링해 바로 압축 기록, 8MB 넘으면 임시파일로 넘김. 저장 배합 슬롯도 차례가 올 때 복원"""
+    jobs = ({**j, 'slots': HISTORY.slots(WORKSPACE, j['history_id'])} if 'history_id' in j else j for j in jobs)
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as f:
+        write_haccp_zip(f, jobs, df_process)
+        f.seek(0)
+        return f.read()
+
+
 def page_planner():
     st.title("📋 기획서 + 공정시방서 + HACCP")
-    result = calc_formulation(st.session_state.slots, st.session_state.volume)
+    result = calc_formulation(st.session_state.slots, st.session_state.volume, st.session_state.ph_model,
+                              st.session_state.sweet_model)
     active = [(s['원료명'], s['배합비(%)']) for s in st.session_state.slots
               if safe_float(s.get('배합비(%)', 0)) > 0 and s.get('원료명')]
     if not active:
@@ -1229,24 +1425,24 @@ def page_planner():
     tabs = st.tabs(["📋 기획서", "🏭 SOP", "📄 HACCP (6종)", "🤖 AI 보고서"])
     with tabs[0]:
         raw_b = result['원재료비(원/병)']
-        pkg   = {'PET':120,'캔':90,'유리병':200,'종이팩':80,'파우치':60}.get(st.session_state.container,100)
-        mfg   = raw_b * 0.4
-        total = raw_b + pkg + mfg
+        pkg   = PACKAGING_COST.get(st.session_state.container, 100)
+        mfg   = raw_b * MFG_COST_RATIO
         price = st.session_state.target_price
-        margin = price - total
+        total, margin = bottle_margin(raw_b, price, st.session_state.container)
         st.dataframe(pd.DataFrame({
             '항목':    ['원재료비','포장재비','제조비','총원가','판매가','마진'],
             '금액(원/병)':[f'{raw_b:,.0f}',f'{pkg:,.0f}',f'{mfg:,.0f}',
                           f'{total:,.0f}',f'{price:,.0f}',f'{margin:,.0f}'],
         }), use_container_width=True, hide_index=True)
+    # 공정 매칭 1회 → SOP 탭·HACCP 6종 공용
+    proc_rows = process_rows(st.session_state.bev_type, df_process)
+    docs = haccp_documents(st.session_state.bev_type, df_process, st.session_state.product_name,
+                           st.session_state.slots, rows=proc_rows) if proc_rows else {}
     with tabs[1]:
-        matched = match_process(st.session_state.bev_type, df_process)
-        if not matched.empty:
-            for _, p in matched.iterrows():
+        if proc_rows:
+            for p in proc_rows:
                 step    = str(p.get('세부공정', ''))
-                icon    = '⚙️'
-                for kw, ic in HACCP_ICONS.items():
-                    if kw in step: icon = ic; break
+                icon    = get_step_icon(step)   # HACCP 문서와 같은 오토마톤·아이콘 표
                 ccp_raw = str(p.get('CCP여부', ''))
                 ccp_tag = f" 🔴 **{ccp_raw}**" if ccp_raw.startswith('CCP') else ""
                 with st.expander(f"{icon} {p.get('공정단계','')} — {step}{ccp_tag}"):
@@ -1254,29 +1450,27 @@ def page_planner():
                     st.markdown(f"**조건**: {p.get('주요조건/파라미터','-')}")
                     if ccp_raw.startswith('CCP'):
                         st.error(f"🔴 {ccp_raw} | CL: {p.get('한계기준(CL)','-')} | 모니터링: {p.get('모니터링방법','-')}")
-            st.download_button("💾 SOP",
-                               haccp_sop(st.session_state.bev_type, df_process,
-                                         st.session_state.product_name, st.session_state.slots),
-                               "SOP.txt")
+            st.download_button("💾 SOP", docs['sop'], "SOP.txt")
     with tabs[2]:
-        matched = match_process(st.session_state.bev_type, df_process)
-        if not matched.empty:
-            docs = {
-                "① 위해분석표":  haccp_ha_worksheet(st.session_state.bev_type, df_process),
-                "② CCP결정도":   haccp_ccp_decision_tree(st.session_state.bev_type, df_process),
-                "③ CCP관리계획서":haccp_ccp_plan(st.session_state.bev_type, df_process),
-                "④ 모니터링일지": haccp_monitoring_log(st.session_state.bev_type, df_process),
-                "⑤ 공정흐름도":  haccp_flow_diagram(st.session_state.bev_type, df_process),
-                "⑥ SOP":         haccp_sop(st.session_state.bev_type, df_process,
-                                            st.session_state.product_name, st.session_state.slots),
-            }
-            for t, d in docs.items():
+        if proc_rows:
+            for k, d in docs.items():
+                t = HACCP_DOC_TITLES[k]
                 with st.expander(t):
                     st.code(d, language=None)
                     st.download_button("💾", d, f"HACCP_{t[:4]}.txt", key=f"dl_{t}")
-            st.download_button("📦 6종 일괄",
-                               '\n\n'.join([f"{'='*60}\n{t}\n{'='*60}\n{d}" for t,d in docs.items()]),
-                               "HACCP_전체.txt", type="primary")
+        # 일괄 ZIP — 다운로드를 누를 때만 생성 (매 rerun마다 묶음을 만들지 않음)
+        scope = st.radio("📦 일괄 ZIP 범위", ["현재 제품 6종", "전 음료유형", "히스토리 제품"],
+                         horizontal=True, key="haccp_zip_scope")
+        if scope == "현재 제품 6종":
+            jobs = [{'bev_type': st.session_state.bev_type, 'product_name': st.session_state.product_name,
+                     'slots': [s.copy() for s in st.session_state.slots]}]
+        elif scope == "전 음료유형":
+            jobs = [{'bev_type': bt} for bt in df_spec['음료유형'].dropna().astype(str)]
+        else:   # 제품별 최신 버전 — 슬롯은 ZIP을 만들 때 복원
+            jobs = [{'bev_type': h['type'], 'product_name': h['name'], 'history_id': h['id']}
+                    for h in HISTORY.query(WORKSPACE, limit=None, latest=True) if h['type']]
+        st.download_button(f"📦 ZIP 다운로드 ({len(jobs)}건 × 6종)", lambda: _haccp_zip(jobs),
+                           "HACCP.zip", "application/zip", type="primary", disabled=not jobs)
     with tabs[3]:
         if not OPENAI_KEY:
             st.error("API 키 필요")
@@ -1304,7 +1498,7 @@ def page_labeling():
         st.warning("배합표가 비어있습니다.")
         return
     label = generate_food_label(st.session_state.slots, st.session_state.product_name,
-                                st.session_state.volume, st.session_state.bev_type)
+                                st.session_state.volume, st.session_state.bev_type, NUT_MATRIX)
     items = []
     for k, v in label.items():
         if isinstance(v, dict):
@@ -1322,20 +1516,81 @@ def page_lab_recipe():
     if not active:
         st.warning("비어있음")
         return
-    scales = st.multiselect("스케일", [1, 5, 10, 20, 50, 100], default=[1, 5, 20])
-    if scales:
-        for sc, items in generate_lab_recipe(st.session_state.slots, scales).items():
-            st.subheader(f"📋 {sc}")
-            st.dataframe(pd.DataFrame(items), use_container_width=True, hide_index=True)
+    tab_lab, tab_plant = st.tabs(["🧫 실험실 (1~100 L)", "🏭 생산 배치 지시서"])
+    with tab_lab:
+        scales = st.multiselect("스케일", [1, 5, 10, 20, 50, 100], default=[1, 5, 20])
+        if scales:
+            for sc, items in generate_lab_recipe(st.session_state.slots, scales).items():
+                st.subheader(f"📋 {sc}")
+                st.dataframe(pd.DataFrame(items), use_container_width=True, hide_index=True)
+    with tab_plant:
+        _plant_batches()
+
+
+def _plant_batches():
+    """여러 SKU(현재 배합 + 저장 배합) × 배치량 → 탱크 분할 · 원액/프리믹스 · 투입 순서 지시서"""
+    st.caption("제품 Brix로 밀도 환산 → 탱크별 칭량(kg)·부피(L). 분말 산미료·고감미료는 원액, 안정제는 분말 당류와 프리믹스")
+    saved = {f"{h['name']} — {h['timestamp']}": h for h in HISTORY.query(WORKSPACE, limit=200, latest=True)}   # 제품별 최신
+    pc = st.columns([3, 2, 1])
+    picked = pc[0].multiselect("SKU", ["현재 배합", *saved], default=["현재 배합"], key="plant_skus")
+    batches = pc[1].multiselect("배치량(L)", [5_000, 8_000, 10_000, 15_000, 20_000, 30_000],
+                                default=[5_000, 30_000], key="plant_batches")
+    tank = pc[2].number_input("탱크 용량(L)", 1_000, 50_000, TANK_CAPACITY_L, 1_000, key="plant_tank")
+    if not picked or not batches:
+        return
+    skus = [{'name': st.session_state.product_name or "현재 배합", 'slots': st.session_state.slots} if k == "현재 배합"
+            else {'name': saved[k]['name'], 'slots': HISTORY.slots(WORKSPACE, saved[k]['id'])} for k in picked]
+    df = production_batches(skus, df_ing, tank, sorted(batches))
+    summary = df.groupby(['SKU', '배치(L)'], sort=False).agg(
+        탱크수=('탱크수', 'first'), 탱크량=('탱크량(L)', 'first'), 제품Brix=('제품Brix', 'first'),
+        배치중량=('투입량(kg)', 'sum'), 원액=('투입방식', lambda m: int((m == '원액').sum())),
+        프리믹스=('투입방식', lambda m: int((m == '프리믹스').sum()))).reset_index()
+    summary['원액'] //= summary['탱크수']
+    summary['프리믹스'] //= summary['탱크수']
+    st.dataframe(summary.rename(columns={'탱크량': '탱크량(L)', '배치중량': '배치중량(kg)'}),
+                 use_container_width=True, hide_index=True)
+    sheets = dict(iter_batch_sheets(df))
+    key = st.selectbox("지시서 미리보기", list(sheets), key="plant_sheet")
+    st.code(sheets[key], language=None)
+    d1, d2 = st.columns(2)
+    d1.download_button("📦 지시서 ZIP (전체 + 칭량표)", lambda: _batch_zip(df),
+                       f"배치지시서_{datetime.now():%Y%m%d}.zip", "application/zip", use_container_width=True)
+    d2.download_button("📥 칭량표 CSV", df.to_csv(index=False).encode('utf-8-sig'),
+                       f"칭량표_{datetime.now():%Y%m%d}.csv", "text/csv", use_container_width=True)
+
+
+def _batch_zip(df):
+    """배치 지시서 ZIP 바이트 — 다운로드 클릭 시 생성"""
+    buf = io.BytesIO()
+    write_batch_sheet_zip(buf, df)
+    return buf.getvalue()
 
 
 def page_history():
     st.title("📓 히스토리")
-    if not st.session_state.history:
+    n_all, n_prod, n_blob, size = HISTORY.stats(WORKSPACE)
+    if not n_all:
         st.info("시뮬레이터에서 저장하세요.")
         return
-    for idx, h in enumerate(st.session_state.history):
+    st.caption(f"저장 {n_all:,}건 · 제품 {n_prod:,}개 · 고유 슬롯 {n_blob:,}개 · {size / 1e6:.1f}MB")
+    _history_reprice()
+    fc = HISTORY.facets(WORKSPACE)
+    f = st.columns([2, 2, 2, 3])
+    product  = f[0].selectbox("제품", ['(전체)', *fc['product']], key="hist_product")
+    bev_type = f[1].selectbox("음료유형", ['(전체)', *fc['bev_type']], key="hist_type")
+    flavor   = f[2].selectbox("맛", ['(전체)', *fc['flavor']], key="hist_flavor")
+    period   = f[3].date_input("저장일", [], key="hist_period")
+    filters = {'product':  None if product == '(전체)' else product,
+               'bev_type': None if bev_type == '(전체)' else bev_type,
+               'flavor':   None if flavor == '(전체)' else flavor,
+               'since':    period[0] if len(period) > 0 else None,
+               'until':    period[1] if len(period) > 1 else None}
+    n = HISTORY.count(WORKSPACE, **filters)
+    pages = max(1, -(-n // history_store.PAGE_SIZE))
+    page = st.number_input(f"페이지 (총 {n:,}건, {pages}쪽)", 1, pages, 1) if pages > 1 else 1
+    for h in HISTORY.query(WORKSPACE, limit=history_store.PAGE_SIZE, offset=(page - 1) * history_store.PAGE_SIZE, **filters):
         with st.expander(f"**{h['name']}** — {h['timestamp']}"):
+            st.caption(' · '.join(x for x in (h['product'], h['type'], h['flavor']) if x))
             r  = h.get('result', {})
             cc = st.columns(5)
             cc[0].metric("Brix",  r.get('예상당도(Bx)', '-'))
@@ -1343,28 +1598,142 @@ def page_history():
             cc[2].metric("산도",  f"{r.get('예상산도(%)', 0):.4f}%")
             cc[3].metric("당산비",r.get('당산비', '-'))
             cc[4].metric("원가",  f"{r.get('원재료비(원/kg)', 0):,.0f}")
-            if st.button("📤 로드", key=f"ld{idx}"):
-                st.session_state.slots = [s.copy() for s in h['slots']]
+            if st.button("📤 로드", key=f"ld{h['id']}"):
+                st.session_state.slots = HISTORY.slots(WORKSPACE, h['id'])
                 clear_slot_widget_keys()
                 st.success("✅")
-            if st.button("🗑️", key=f"rm{idx}"):
-                st.session_state.history.pop(idx)
+            with st.popover("🗑️"):
+                st.caption("이 버전을 삭제합니다 (되돌릴 수 없음)")
+                if st.button("삭제 확인", key=f"rm{h['id']}", type="primary"):
+                    HISTORY.delete(WORKSPACE, h['id'])
+                    st.rerun()
+
+
+def _history_reprice():
+    """원료DB·단가 오버레이 변경 → 영향받는 저장 배합만 불러와 원가 재계산 (저장소 단가 역색인, 보고서 + 반영)"""
+    db_prices = current_prices(df_ing)
+    prices = current_prices(df_ing, st.session_state.price_overlay)
+    history = [HISTORY.get(WORKSPACE, hid) for hid in HISTORY.stale(WORKSPACE, prices)]
+    deps = index_history(history)
+    report = reprice_history(history, deps, prices, st.session_state.target_price, st.session_state.container)
+    with st.expander(f"💲 단가 변경 반영 — 영향 배합 {len(report)}건", expanded=not report.empty):
+        used = HISTORY.used_ingredients(WORKSPACE)
+        ed = st.data_editor(pd.DataFrame({
+            '원료명': used,
+            'DB단가(원/kg)': [db_prices.get(n, 0.0) for n in used],
+            '적용단가(원/kg)': [prices.get(n, 0.0) for n in used],
+        }), disabled=['원료명', 'DB단가(원/kg)'], hide_index=True, use_container_width=True, key="price_ed")
+        overlay = {n: float(p) for n, d, p in ed.itertuples(index=False) if p != d}
+        if overlay != st.session_state.price_overlay:
+            st.session_state.price_overlay = overlay
+            st.rerun()
+        if report.empty:
+            st.success("✅ 저장 배합 원가가 현재 단가와 일치")
+            return
+        st.caption(f"판매가 {st.session_state.target_price:,}원 · {st.session_state.container} 기준 마진")
+        k = st.columns(2)
+        k[0].metric("원재료비 변화 합계(원/병)",
+                    f"{(report['원재료비(원/병) 이후'] - report['원재료비(원/병) 이전']).sum():+,.1f}")
+        k[1].metric("마진 변화 합계(원/병)", f"{report['마진변화(원/병)'].sum():+,.1f}")
+        st.dataframe(report, use_container_width=True, hide_index=True)
+        with st.popover("✅ 재계산 반영", use_container_width=True):
+            st.caption(f"작업공간 `{WORKSPACE}`의 저장 배합 {len(report)}건 단가·원가를 현재 적용단가로 덮어씁니다")
+            if st.button("반영 확인", key="reprice_apply", type="primary"):
+                reprice_history(history, deps, prices, apply=True)
+                for h in history:
+                    HISTORY.update(WORKSPACE, h['id'], slots=h['slots'], result=h['result'])
                 st.rerun()
 
 
+# ============================================================
+# PAGE 11: LLM 사용량 (관리자)
+# ============================================================
+def page_llm_metrics():
+    st.title("🛠️ LLM 사용량 · 지연시간 · 비용")
+    days = st.selectbox("기간", [1, 7, 30, 90], index=1, format_func=lambda d: f"최근 {d}일")
+    df = llm_metrics.load_calls(days)
+    if df.empty:
+        st.info("기록된 LLM 호출이 없습니다.")
+        return
+    live = df[df['cache'] == 'miss']
+    k = st.columns(6)
+    k[0].metric("호출수",   f"{len(df):,}")
+    k[1].metric("p50",      f"{df['wall_ms'].quantile(0.50):,.0f}ms")
+    k[2].metric("p95",      f"{df['wall_ms'].quantile(0.95):,.0f}ms")
+    k[3].metric("p99",      f"{df['wall_ms'].quantile(0.99):,.0f}ms")
+    k[4].metric("병합/캐시", f"{(df['cache'] != 'miss').mean()*100:.1f}%")
+    k[5].metric("비용",     f"${df['cost_usd'].sum():,.2f}")
+
+    st.subheader("📅 일별 비용 ($)")
+    spend = llm_metrics.daily_spend(df)
+    st.bar_chart(spend)
+
+    tabs = st.tabs(["🧑‍🔬 페르소나별", "📄 페이지별", "🤖 모델별", "❌ 최근 오류"])
+    for tab, by in zip(tabs[:3], ['persona', 'page', 'model']):
+        with tab:
+            st.dataframe(llm_metrics.latency_table(df, by), use_container_width=True, hide_index=True)
+    with tabs[3]:
+        err = df[df['outcome'] != 'ok'].tail(50)
+        if err.empty:
+            st.success("오류 없음")
+        else:
+            st.dataframe(err[['ts', 'page', 'persona', 'model', 'wall_ms', 'error']].iloc[::-1],
+                         use_container_width=True, hide_index=True)
+    st.caption(f"실호출 {len(live):,}건 · 입력 {live['prompt_tokens'].sum():,} / "
+               f"출력 {live['completion_tokens'].sum():,} 토큰 · 저장소: {llm_metrics.METRICS_DB}")
+
+
+def _profile_panel(row):
+    """사이드바 디버그 패널 — 이번 rerun 분해 + 세션 최근 rerun 추이 + 로그 집계"""
+    runs = st.session_state.setdefault('_profile_runs', [])
+    runs.append(row)
+    del runs[:-30]
+    with st.sidebar.expander(f"⏱️ 프로파일 · {row['total_ms']:,.0f}ms", expanded=False):
+        c = st.columns(2)
+        c[0].metric("DB", f"{row['db_ms']:,.0f}ms")
+        c[1].metric("엔진", f"{row['engine_ms']:,.0f}ms")
+        c = st.columns(2)
+        c[0].metric("LLM", f"{row['llm_ms']:,.0f}ms", f"{row['llm_calls']}회", delta_color="off")
+        c[1].metric("렌더링", f"{row['render_ms']:,.0f}ms")
+        if row['top']:
+            st.caption("상위 호출: " + " · ".join(f"{n} {ms:,.0f}ms" for n, ms in row['top']))
+        if st.session_state.get('_sim_timing'):
+            st.caption("프래그먼트: " + " · ".join(f"{k} {v:,.0f}ms"
+                                                 for k, v in st.session_state['_sim_timing'].items()))
+        hist = pd.DataFrame(runs)[['db_ms', 'engine_ms', 'llm_ms', 'render_ms']]
+        st.bar_chart(hist, height=160)
+        if perf_profile.slowest():
+            st.caption("느린 rerun 프로파일: " + ", ".join(
+                f"{ms:,.0f}ms {os.path.basename(p)}" for ms, p in perf_profile.slowest()))
+        if st.toggle("페이지별 집계 (로그)", key="_profile_log"):
+            st.dataframe(perf_profile.page_table(perf_profile.load_log(limit=5000)),
+                         use_container_width=True, hide_index=True)
+            st.caption(perf_profile.LOG_PATH)
+
+
 # ============================================================
 # 라우팅
 # ============================================================
-{
-    "🎯 컨셉→배합설계":  page_concept,
-    "🧪 배합 시뮬레이터": page_simulator,
-    "🧑‍🔬 AI 연구원 평가": page_ai_researcher,
-    "🎨 제품 이미지 생성": page_image,
-    "🔄 역설계":          page_reverse,
-    "📊 시장분석":        page_market,
-    "🎓 교육용 실습":     page_education,
-    "📋 기획서/HACCP":    page_planner,
-    "📑 식품표시사항":    page_labeling,
-    "🧫 시작 레시피":     page_lab_recipe,
-    "📓 배합 히스토리":   page_history,
-}[page]()
+llm_metrics.set_page(page)
+if PROFILE_MODE:
+    perf_profile.set_page(page)
+try:
+    {
+        "🎯 컨셉→배합설계":  page_concept,
+        "🧪 배합 시뮬레이터": page_simulator,
+        "📈 설계공간 탐색":   page_sweep,
+        "🧑‍🔬 AI 연구원 평가": page_ai_researcher,
+        "🎨 제품 이미지 생성": page_image,
+        "🔄 역설계":          page_reverse,
+        "📊 시장분석":        page_market,
+        "🎓 교육용 실습":     page_education,
+        "📋 기획서/HACCP":    page_planner,
+        "📑 식품표시사항":    page_labeling,
+        "🧫 시작 레시피":     page_lab_recipe,
+        "📓 배합 히스토리":   page_history,
+        "🛠️ LLM 사용량":     page_llm_metrics,
+    }[page]()
+finally:
+    _prof_row = perf_profile.finish() if PROFILE_MODE else None
+if _prof_row:
+    _profile_panel(_prof_row)
@@ -0,0 +1,427 @@
+"""
+batch_score.py — 배합 라이브러리 일괄 재평가 CLI
+원료DB·규격기준이 바뀌었을 때 저장된 배합 CSV/XLSX 전체를 다시 계산·판정·표시사항 생성.
+
+입력 형식 (파일/폴더/글롭 혼용):
+- 시뮬레이터 CSV 내보내기 그대로 (No, 원료명, 배합비(%), Brix, 산도, 감미도, 단가 …) → 파일 1개 = 배합 1건
+- 라이브러리 형식: 배합ID(또는 recipe_id/제품명) 컬럼이 있으면 ID별로 여러 배합
+- 선택 컬럼: 음료유형, 용량(ml) — 없으면 --bev-type / --volume 값 사용
+- XLSX는 시트마다 위 규칙 적용
+
+예) python batch_score.py recipes/ -o scores.parquet --bev-type 과·채음료 --workers 8
+    python batch_score.py "lib/*.csv" more.xlsx -o scores.csv
+"""
+import argparse
+import csv
+import glob
+import io
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import engine  # noqa: E402
+
+INPUT_EXT = ('.csv', '.xlsx', '.xls')
+ID_COLS = ['배합ID', 'recipe_id', '레시피ID', '레시피', '제품명']
+NAME_COLS = ['원료명', 'ingredient', 'name']
+PCT_COLS = ['배합비(%)', '배합비', 'pct']
+POS_COLS = ['No', '슬롯', 'slot']
+TYPE_COLS = ['음료유형', 'bev_type']
+VOL_COLS = ['용량(ml)', '용량', 'volume_ml']
+PROP_COLS = {'Brix': ['Brix', 'Brix(°)', '당도(Bx)'], '산도': ['산도', '산도(%)'],
+             '감미도': ['감미도', '감미도(설탕대비)'], '단가': ['단가', '단가(원/kg)', '예상단가(원/kg)'],
+             'pH': ['pH']}
+
+
+# ============================================================
+# 1. 입력 읽기 → 긴 형식 (배합 1행 = 원료 1개)
+# ============================================================
+STD_COLS = ['배합ID', 'pos', '원료명', '배합비', 'Brix', '산도', '감미도', '단가', 'pH', '음료유형', '용량']
+
+
+def _read_tables(path):
+    """(시트명, {컬럼명: 값 list}) — CSV는 pandas 없이 읽음 (배합 1건짜리 파일이 수만 개일 때 병목)"""
+    if path.lower().endswith('.csv'):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        try:
+            text = raw.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = raw.decode('cp949')
+        rows = list(csv.reader(io.StringIO(text)))
+        if not rows:
+            raise ValueError("빈 파일")
+        header = [h.strip() for h in rows[0]]
+        body = [r for r in rows[1:] if any(r)]
+        yield '', {h: [r[i] if i < len(r) else '' for r in body] for i, h in enumerate(header)}
+    else:
+        for sheet, df in pd.read_excel(path, sheet_name=None).items():
+            df.columns = [str(c).strip() for c in df.columns]
+            df = df.astype(object).where(df.notna(), '')
+            yield sheet, {c: df[c].tolist() for c in df.columns}
+
+
+def read_recipes(path):
+    """파일 → 긴 형식 {표준컬럼: 값 list}. 숫자 변환은 묶음 단위로 score_files에서 한 번에"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    out = {k: [] for k in STD_COLS}
+    for sheet, cols in _read_tables(path):
+        n = len(next(iter(cols.values()), []))
+
+        def get(cands, fill=''):
+            c = next((c for c in cands if c in cols), None)
+            return cols[c] if c else [fill] * n
+        if not any(c in cols for c in NAME_COLS) or not any(c in cols for c in PCT_COLS):
+            raise ValueError(f"원료명/배합비 컬럼 없음 ({sheet or 'csv'})")
+        out['배합ID'] += [str(v) for v in get(ID_COLS)] if any(c in cols for c in ID_COLS) \
+            else [f"{stem}:{sheet}" if sheet else stem] * n
+        out['pos'] += get(POS_COLS)
+        out['원료명'] += get(NAME_COLS)
+        out['배합비'] += get(PCT_COLS)
+        for k, cands in PROP_COLS.items():
+            out[k] += get(cands)
+        out['음료유형'] += get(TYPE_COLS)
+        out['용량'] += get(VOL_COLS)
+    return out
+
+
+def _to_frame(buf):
+    rows = pd.DataFrame(buf)
+    rows['원료명'] = rows['원료명'].astype(str).str.strip()
+    rows['음료유형'] = rows['음료유형'].astype(str).str.strip()
+    rows['pos'] = pd.to_numeric(rows['pos'], errors='coerce') - 1
+    rows['용량'] = pd.to_numeric(rows['용량'], errors='coerce')
+    for k in ('배합비', 'Brix', '산도', '감미도', '단가', 'pH'):
+        rows[k] = pd.to_numeric(rows[k], errors='coerce').fillna(0)
+    return rows
+
+
+# ============================================================
+# 2. 워커 — DB/계수행렬은 프로세스당 1회 준비
+# ============================================================
+_W = {}
+
+
+def _init_worker(db_path, bev_type, volume, ph_model='linear', sweet_model='linear', subs=None, prices=None,
+                 price_date=None):
+    db = engine.load_db(db_path)
+    df_ing = db['원료DB']
+    ph_col = engine.ph_column(df_ing)
+    props = engine.build_property_matrix(df_ing, ph_col)
+    if price_date:                                   # 기준일 단가 이력 (오버레이가 그 위에 덮음)
+        props['price'] = engine.price_asof(engine.build_price_book(df_ing, db.get('원료단가이력')), price_date).copy()
+    for name, price in (prices or {}).items():      # 단가 오버레이
+        props['price'][props['index'][name]] = price
+    _W.update(df_ing=df_ing, df_spec=db['음료규격기준'], ph_col=ph_col, props=props,
+              nutrients=engine.build_nutrient_matrix(df_ing, db.get('원료영양DB')),
+              bev_type=bev_type, volume=volume, ph_model=ph_model, sweet_model=sweet_model, specs={},
+              subs=subs or {})
+
+
+def _spec_row(bev_type):
+    specs = _W['specs']
+    if bev_type not in specs:
+        sp = engine.get_spec(_W['df_spec'], bev_type) if bev_type else None
+        specs[bev_type] = sp or {k: np.nan for k in
+                                 ['Brix_min', 'Brix_max', 'pH_min', 'pH_max', '산도_min', '산도_max']}
+    return specs[bev_type]
+
+
+def _substitution_map(db, specs):
+    """'원료=대체원료' 목록 → {원료DB 행: (대체 행, 배합비 배율)}. 원료명은 유사매칭 허용, 잘못되면 종료"""
+    df_ing = db['원료DB']
+    sub = engine.build_substitute_index(df_ing, engine.ph_column(df_ing))
+    pairs = []
+    for spec in specs:
+        old, sep, new = spec.partition('=')
+        if not sep:
+            sys.exit(f"--substitute 형식 오류 (원료=대체원료): {spec}")
+        old, new = old.strip(), new.strip()
+        pairs.append((engine.resolve_ingredient(old, df_ing) or old,
+                      new if new == 'auto' else engine.resolve_ingredient(new, df_ing) or new))
+    try:
+        mapping = engine.substitution_map(sub, pairs)
+    except KeyError as e:
+        sys.exit(f"--substitute: {e.args[0]}")
+    for i, (j, r) in mapping.items():
+        print(f"치환: {sub['names'][i]} → {sub['names'][j]} (배합비 ×{r:.4f})")
+    return mapping
+
+
+def _price_overlay(db, path):
+    """단가 오버레이 파일(원료명, 단가) → {원료DB 원료명: 단가}. 원료명은 유사매칭 허용, DB에 없는 원료는 경고 후 무시"""
+    df_ing = db['원료DB']
+    _, cols = next(_read_tables(path))
+    name_col = next((c for c in NAME_COLS if c in cols), None)
+    price_col = next((c for c in PROP_COLS['단가'] if c in cols), None)
+    if not name_col or not price_col:
+        sys.exit(f"--prices: 원료명/단가 컬럼 없음 ({path})")
+    out = {}
+    for name, price in zip(cols[name_col], pd.to_numeric(pd.Series(cols[price_col]), errors='coerce')):
+        r = engine.resolve_ingredient(str(name).strip(), df_ing)
+        if r is None or pd.isna(price):
+            print(f"단가 오버레이 무시: {name}", file=sys.stderr)
+            continue
+        out[r] = float(price)
+    print(f"단가 오버레이 {len(out)}종 적용")
+    return out
+
+
+def _note(failures, m, recs, reason):
+    for r_, why in zip(recs, reason):
+        failures.append({'파일': m.at[r_, '파일'], '배합ID': m.at[r_, '배합ID'], '사유': why})
+
+
+def score_files(paths):
+    """파일 묶음 채점 → (결과 DataFrame, 실패 목록). 배합 단위 처리도 전부 배열 연산"""
+    failures = []
+    buf = {k: [] for k in STD_COLS + ['파일']}
+    for path in paths:
+        try:
+            one = read_recipes(path)
+        except Exception as e:
+            failures.append({'파일': path, '배합ID': '', '사유': f"읽기 실패: {type(e).__name__}: {e}"})
+            continue
+        for k, v in one.items():
+            buf[k] += v
+        buf['파일'] += [path] * len(one['원료명'])
+    if not buf['원료명']:
+        return pd.DataFrame(), failures
+
+    rows = _to_frame(buf)
+    rec_all, keys = pd.factorize(pd.MultiIndex.from_arrays([rows['파일'], rows['배합ID']]))
+    valid = ((rows['배합비'] > 0) & (rows['원료명'] != '') & (rows['원료명'] != '정제수')).to_numpy()
+    for f, rid in keys[np.setdiff1d(np.arange(len(keys)), rec_all[valid])]:
+        failures.append({'파일': f, '배합ID': rid, '사유': '유효한 원료 행 없음'})
+    rows = rows[valid].reset_index(drop=True)
+    if rows.empty:
+        return pd.DataFrame(), failures
+    rec, _ = pd.factorize(rec_all[valid])
+    n = rec.max() + 1
+    g = rows.groupby(rec, sort=True)
+
+    # 배합별 메타: 음료유형·용량은 첫 값, 없으면 CLI 기본값
+    m = g[['파일', '배합ID']].first().reset_index(drop=True)
+    bev = rows['음료유형'].where(rows['음료유형'] != '').groupby(rec).first()
+    vol = g['용량'].first()
+    m['음료유형'] = bev.reindex(range(n)).fillna(_W['bev_type']).to_numpy()
+    m['용량(ml)'] = vol.reindex(range(n)).fillna(_W['volume']).to_numpy(dtype=float)
+
+    # 슬롯번호가 하나라도 비면 그 배합은 행 순서대로 0,1,2…
+    seq = g.cumcount().to_numpy()
+    no_pos = rows['pos'].isna().groupby(rec).transform('any').to_numpy()
+    pos = np.where(no_pos, seq, rows['pos'].fillna(0).to_numpy()).astype(int)
+    bad_pos = (pos < 0) | (pos >= 19)
+    if bad_pos.any():
+        r_bad = np.unique(rec[bad_pos])
+        _note(failures, m, r_bad, ['슬롯번호 범위(1~19) 밖 행 제외'] * len(r_bad))
+        pos = np.where(bad_pos, 19, pos)     # 계산 제외 (pos ≥ 19)
+
+    # 원료명 → 원료DB 행번호 (고유명 단위로 해석, 미매칭은 -1)
+    props, df_ing = _W['props'], _W['df_ing']
+    uniq = rows['원료명'].unique()
+    idx_map = {}
+    for u in uniq:
+        r = engine.resolve_ingredient(u, df_ing)
+        idx_map[u] = props['index'].get(r, -1) if r is not None else -1
+    idx = rows['원료명'].map(idx_map).to_numpy()
+    idx, pct, swapped = engine.substitute_rows(idx, rows['배합비'].to_numpy(dtype=float), _W['subs'])
+    known = idx >= 0
+    safe = np.where(known, idx, 0)
+
+    def coef(key, custom):
+        return np.where(known, props[key][safe], custom)
+
+    # DB 미등록 원료: 입력 파일의 Brix/산도/감미도/단가 사용 (시뮬레이터 직접입력 원료와 같은 환산)
+    bx, ac, sw, pr = (rows[c].to_numpy(dtype=float) for c in ('Brix', '산도', '감미도', '단가'))
+    raw_names = rows['원료명'].to_numpy(dtype=object)
+    db_names = np.where(known, np.asarray(props['names'], dtype=object)[safe], raw_names)
+    juice_of = {u: ('농축' in u or '과즙' in u) for u in set(db_names)}
+    c = {
+        'brix1': coef('brix1', bx / 100), 'acid1': coef('acid1', ac / 100),
+        'sweet1': coef('sweet1', sw / 100), 'dph1': coef('dph1', 0.0),
+        'price': coef('price', pr), 'brix': coef('brix', bx),
+        'juice': np.fromiter((juice_of[u] for u in db_names), bool, len(db_names)),
+    }
+    if _W['ph_model'] == 'equilibrium':   # 산·염기 행: DB 원료는 DB pH·산도, 미등록 원료는 파일 값
+        c['acidbase'] = engine.acid_base_rows(db_names, coef('ph', rows['pH'].to_numpy(dtype=float)),
+                                              coef('acidity', ac))
+    if _W['sweet_model'] == 'beidler':
+        c['sweet_class'] = engine.sweetener_class(db_names)
+    pct = np.where(pos < 19, pct, 0)
+    vol = m['용량(ml)'].to_numpy()
+
+    res = engine.calc_formulation_batch(rec, pos, pct, c, n, vol, _W['ph_model'], _W['sweet_model'])
+    specs = pd.DataFrame([_spec_row(b) for b in m['음료유형']])
+    comp = engine.check_compliance_batch(res, specs)
+
+    water = engine.round_array(np.maximum(0, 100 - np.bincount(rec, pct, minlength=n)), 3)
+    lab = engine.food_label_batch(
+        np.concatenate([rec, np.arange(n)]), np.concatenate([pos, np.full(n, 19)]),
+        np.concatenate([db_names, np.full(n, '정제수', dtype=object)]),
+        np.concatenate([pct, water]), np.concatenate([c['brix'], np.zeros(n)]), n, vol, _W['nutrients'])
+
+    out = pd.concat([m, res, comp, lab], axis=1)
+    if _W['subs']:
+        out['대체원료'] = ''
+        if swapped.any():
+            sw_txt = pd.Series(raw_names[swapped] + '→' + db_names[swapped]).groupby(rec[swapped]).agg(', '.join)
+            out.loc[sw_txt.index, '대체원료'] = sw_txt.to_numpy()
+    out['미매칭원료'] = ''
+    if (~known).any():
+        um = pd.Series(raw_names[~known]).groupby(rec[~known]).agg(', '.join)
+        out.loc[um.index, '미매칭원료'] = um.to_numpy()
+        no_props = ~known & (bx == 0) & (ac == 0) & (sw == 0) & (pr == 0)
+        if no_props.any():
+            np_ = pd.Series(raw_names[no_props]).groupby(rec[no_props]).agg(', '.join)
+            _note(failures, m, np_.index, [f"원료DB 미등록 + 이화학값 없음 (0으로 계산): {s}" for s in np_])
+    over = np.flatnonzero(res['배합비합계(%)'].to_numpy() > 100.0005)
+    _note(failures, m, over, [f"원료합계 {res.at[r_, '배합비합계(%)']:.3f}% > 100%" for r_ in over])
+    return out, failures
+
+
+# ============================================================
+# 3. 입력 스트리밍 / 출력
+# ============================================================
+def iter_inputs(args):
+    for a in args:
+        if os.path.isdir(a):
+            for root, _, files in os.walk(a):
+                for f in sorted(files):
+                    if f.lower().endswith(INPUT_EXT) and not f.startswith('~$'):
+                        yield os.path.join(root, f)
+        elif any(ch in a for ch in '*?['):
+            for f in sorted(glob.glob(a, recursive=True)):
+                if f.lower().endswith(INPUT_EXT):
+                    yield f
+        else:
+            yield a
+
+
+def _chunks(it, size):
+    buf = []
+    for x in it:
+        buf.append(x)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+class _Writer:
+    """CSV(append) / Parquet(ParquetWriter) 스트리밍 출력"""
+
+    def __init__(self, path):
+        self.path, self.parquet = path, path.lower().endswith('.parquet')
+        if self.parquet:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                sys.exit("Parquet 출력에는 pyarrow가 필요합니다: pip install pyarrow  (또는 -o 결과.csv 로 CSV 출력)")
+        self.pq = self.schema = None
+        self.first = True
+
+    def write(self, df):
+        if df.empty:
+            return
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            if self.pq is None:
+                self.schema = table.schema
+                self.pq = pq.ParquetWriter(self.path, self.schema)
+            self.pq.write_table(table)
+        else:
+            df.to_csv(self.path, mode='w' if self.first else 'a', header=self.first,
+                      index=False, encoding='utf-8-sig' if self.first else 'utf-8')
+        self.first = False
+
+    def close(self):
+        if self.pq is not None:
+            self.pq.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="배합 라이브러리 일괄 재평가 (계산·규격판정·표시사항)")
+    ap.add_argument('inputs', nargs='+', help='CSV/XLSX 파일, 폴더, 글롭')
+    ap.add_argument('-o', '--out', required=True, help='결과 경로 (.csv 또는 .parquet)')
+    ap.add_argument('--failures', help='실패 목록 CSV (기본: <out>.failures.csv)')
+    ap.add_argument('--bev-type', default='', help='음료유형 컬럼이 없을 때 사용할 유형 (규격판정 기준)')
+    ap.add_argument('--volume', type=float, default=500, help='용량 컬럼이 없을 때 용량(ml)')
+    ap.add_argument('--db', default=engine.DB_PATH, help='원료/규격 DB 엑셀 경로')
+    ap.add_argument('--ph-model', choices=engine.PH_MODELS, default='linear',
+                    help='pH 계산: linear(ΔpH 합산, 빠름) / equilibrium(전하균형 평형)')
+    ap.add_argument('--sweet-model', choices=engine.SWEET_MODELS, default='linear',
+                    help='감미도 계산: linear(감미기여 합산) / beidler(감미료별 포화곡선 + 상승작용)')
+    ap.add_argument('--substitute', action='append', default=[], metavar='원료=대체원료',
+                    help='원료 일괄 치환 (반복 가능). 대체원료 auto = 같은 분류에서 같은 기여를 더 싸게 내는 원료. '
+                         '배합비는 Brix·산도·감미·pH 기여 합계를 보존하도록 다시 계산')
+    ap.add_argument('--prices', help='단가 오버레이 CSV/XLSX (원료명, 단가) — 원료DB 예상단가 대신 사용')
+    ap.add_argument('--price-date', help='원가를 이 날짜(YYYY-MM-DD)에 유효한 원료 단가 이력으로 계산')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--files-per-task', type=int, default=200)
+    a = ap.parse_args()
+
+    db = engine.load_db(a.db)   # 스냅샷을 미리 만들어 워커 기동을 빠르게
+    subs = _substitution_map(db, a.substitute) if a.substitute else {}
+    prices = _price_overlay(db, a.prices) if a.prices else {}
+    if a.price_date:
+        for name in engine.build_price_book(db['원료DB'], db.get('원료단가이력'))['unmatched']:
+            print(f"단가 이력 무시 (원료DB에 없는 원료명): {name}", file=sys.stderr)
+    writer = _Writer(a.out)
+    failures, n_ok, n_pass, n_files = [], 0, 0, 0
+    t0 = time.perf_counter()
+
+    def consume(result):
+        nonlocal n_ok, n_pass
+        df, fails = result
+        writer.write(df)
+        failures.extend(fails)
+        n_ok += len(df)
+        if len(df):
+            n_pass += int((df['규격있음'] & df['규격적합']).sum())
+
+    chunks = _chunks(iter_inputs(a.inputs), a.files_per_task)
+    if a.workers <= 1:
+        _init_worker(a.db, a.bev_type, a.volume, a.ph_model, a.sweet_model, subs, prices, a.price_date)
+        for paths in chunks:
+            n_files += len(paths)
+            consume(score_files(paths))
+    else:
+        with ProcessPoolExecutor(a.workers, initializer=_init_worker,
+                                 initargs=(a.db, a.bev_type, a.volume, a.ph_model, a.sweet_model, subs,
+                                           prices, a.price_date)) as ex:
+            pending = deque()
+            for paths in chunks:                      # 진행 중 작업 수 제한 → 입력을 흘려보내며 처리
+                n_files += len(paths)
+                pending.append(ex.submit(score_files, paths))
+                if len(pending) >= a.workers * 2:
+                    consume(pending.popleft().result())
+            while pending:
+                consume(pending.popleft().result())
+    writer.close()
+
+    elapsed = time.perf_counter() - t0
+    fpath = a.failures or f"{a.out}.failures.csv"
+    if failures:
+        pd.DataFrame(failures).to_csv(fpath, index=False, encoding='utf-8-sig')
+    print(f"파일 {n_files}개 · 배합 {n_ok}건 채점 · {elapsed:.1f}s "
+          f"({n_ok / elapsed * 60 if elapsed else 0:,.0f}건/분) → {a.out}")
+    print(f"규격적합 {n_pass}건 / {n_ok}건 (규격 없는 음료유형은 판정 제외)")
+    if failures:
+        reasons = pd.DataFrame(failures)['사유'].str.split(':').str[0].value_counts()
+        print(f"실패/경고 {len(failures)}건 → {fpath}")
+        for r, cnt in reasons.items():
+            print(f"  {cnt:>6}  {r}")
+
+
+if __name__ == '__main__':
+    main()
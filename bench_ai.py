@@ -0,0 +1,144 @@
+"""
+bench_ai.py — engine AI 경로 오프라인 부하/지연 벤치마크 (fake_llm_server 사용)
+
+예) python bench_ai.py --concurrency 8 --requests 40 --median-ms 600 --error-rate 0.02
+    python bench_ai.py --url http://127.0.0.1:8765 --flows formulation,gemini --json out.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_llm_server  # noqa: E402
+
+FAKE_KEY = "sk-fake-bench"
+
+
+# ============================================================
+# 1. 시나리오 (engine 함수 그대로 호출 + 결과 스키마 검증)
+# ============================================================
+def _flows(engine):
+    def formulation(tag):
+        out = engine.call_gpt_ai_formulation(FAKE_KEY, "과·채음료", f"사과 {tag}", "사과농축과즙(70Brix)")
+        assert out and all('원료명' in f for f in out), "배합 JSON 파싱 실패"
+
+    def estimate(tag):
+        est = engine.call_gpt_estimate_ingredient(FAKE_KEY, f"테스트원료 {tag}")
+        assert 'Brix' in est, "이화학 추정 JSON 스키마 불일치"
+
+    def marketing(tag):
+        r = engine.call_gpt_marketing_to_rd(FAKE_KEY, f"2030 여성 타겟 상큼 사과 음료 {tag}")
+        assert r.get('formulation'), "컨셉→배합 JSON 파싱 실패"
+
+    def researcher(tag):
+        text = engine.call_gpt(FAKE_KEY, engine.PERSONA_RESEARCHER, f"사과농축과즙 8%\n목표: {tag}")
+        assert engine.parse_modified_formulation(text), "수정배합 JSON 파싱 실패"
+
+    def info(tag):
+        assert engine.call_gpt_ingredient_info(FAKE_KEY, f"구연산 {tag}")
+
+    def dalle(tag):
+        assert engine.call_dalle(FAKE_KEY, f"apple drink {tag}").startswith('http')
+
+    def gemini(tag):
+        contents = [{"role": "user", "parts": [{"text": f"[배합 변경 제안 시 답변 끝에 포함]\n질문: 산미 강화 {tag}"}]}]
+        assert engine.call_gemini_rest("fake-gemini-key", contents)
+
+    return {'formulation': formulation, 'estimate': estimate, 'marketing': marketing,
+            'researcher': researcher, 'info': info, 'dalle': dalle, 'gemini': gemini}
+
+
+# ============================================================
+# 2. 실행/집계
+# ============================================================
+def _run_one(fn, tag):
+    t0 = time.perf_counter()
+    try:
+        fn(tag)
+        return (time.perf_counter() - t0) * 1000, None
+    except Exception as e:
+        return (time.perf_counter() - t0) * 1000, f"{type(e).__name__}: {e}"[:200]
+
+
+def run_flow(name, fn, n, concurrency, identical=False):
+    tags = ['same'] * n if identical else [uuid.uuid4().hex[:8] for _ in range(n)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(lambda t: _run_one(fn, t), tags))
+    elapsed = time.perf_counter() - t0
+    lat = np.array([r[0] for r in results])
+    errors = [r[1] for r in results if r[1]]
+    return {
+        'flow': name, 'requests': n, 'concurrency': concurrency, 'errors': len(errors),
+        'throughput_rps': round(n / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(float(np.percentile(lat, 50)), 1),
+        'p95_ms': round(float(np.percentile(lat, 95)), 1),
+        'p99_ms': round(float(np.percentile(lat, 99)), 1),
+        'max_ms': round(float(lat.max()), 1),
+        'sample_error': errors[0] if errors else '',
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="engine AI 경로 오프라인 벤치마크")
+    ap.add_argument('--url', help='이미 실행 중인 fake_llm_server 주소 (없으면 내장 서버 기동)')
+    ap.add_argument('--flows', default='formulation,estimate,marketing,researcher,info,dalle,gemini')
+    ap.add_argument('--requests', type=int, default=40, help='시나리오별 요청 수')
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--identical', action='store_true', help='동일 요청으로 병합(single-flight) 효과 측정')
+    ap.add_argument('--median-ms', type=float, default=300)
+    ap.add_argument('--sigma', type=float, default=0.5)
+    ap.add_argument('--error-rate', type=float, default=0.0)
+    ap.add_argument('--respect-limits', action='store_true', help='llm_gateway 기본 속도제한 유지')
+    ap.add_argument('--record-metrics', action='store_true', help='llm_metrics 저장소에 기록')
+    ap.add_argument('--json', help='결과 JSON 저장 경로')
+    a = ap.parse_args()
+
+    server = None
+    if a.url:
+        base = a.url.rstrip('/')
+    else:
+        cfg = fake_llm_server.FakeConfig('lognormal', a.median_ms, a.sigma, error_rate=a.error_rate, seed=42)
+        server, base = fake_llm_server.start_server(config=cfg)
+    os.environ['OPENAI_BASE_URL'] = base + '/v1'
+    os.environ['GEMINI_API_BASE'] = base
+
+    import engine
+    import llm_gateway
+    import llm_metrics
+    engine.GEMINI_API_BASE = base
+    llm_metrics.ENABLED = a.record_metrics
+    if not a.respect_limits:
+        for p in list(llm_gateway.RATE_LIMITS):
+            llm_gateway.configure_limits(p, 10**6, 10**9)
+
+    flows = _flows(engine)
+    rows = []
+    print(f"server={base} concurrency={a.concurrency} requests/flow={a.requests}"
+          f"{' (identical)' if a.identical else ''}")
+    print(f"{'flow':<12}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'err':>6}")
+    for name in [f.strip() for f in a.flows.split(',') if f.strip()]:
+        if name not in flows:
+            print(f"  알 수 없는 시나리오: {name}")
+            continue
+        r = run_flow(name, flows[name], a.requests, a.concurrency, a.identical)
+        rows.append(r)
+        print(f"{name:<12}{r['throughput_rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+              f"{r['p99_ms']:>9}{r['max_ms']:>9}{r['errors']:>6}")
+        if r['sample_error']:
+            print(f"  └ {r['sample_error']}")
+    if a.json:
+        with open(a.json, 'w', encoding='utf-8') as f:
+            json.dump({'base_url': base, 'results': rows}, f, ensure_ascii=False, indent=2)
+    if server:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""
+bench_engine.py — engine.py 마이크로 벤치마크 (실제 DB + 합성 확대 DB)
+
+- 배율 1 = 배포 엑셀 그대로, 10·100·1000 = 원료DB/시장제품DB/가이드배합비DB를 결정적으로 복제·변형
+- 케이스별 반복 측정 → 중앙값/p95/처리량, JSON 저장, 기준(baseline) 대비 회귀 판정
+
+예) python bench_engine.py --scales 1,10,100 --json bench.json
+    python bench_engine.py --baseline bench_baseline.json            # 회귀 시 종료코드 1
+    python bench_engine.py --baseline bench_baseline.json --update-baseline
+"""
+import argparse
+import itertools
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import engine  # noqa: E402
+
+HACCP_GENERATORS = ['haccp_ha_worksheet', 'haccp_ccp_decision_tree', 'haccp_ccp_plan',
+                    'haccp_monitoring_log', 'haccp_flow_diagram', 'haccp_sop']
+
+
+# ============================================================
+# 1. 합성 DB (결정적 — 같은 seed·배율이면 항상 같은 데이터)
+# ============================================================
+def _replicate(df, scale):
+    """df를 scale배로 복제. 첫 벌은 원본 그대로, 이후 벌 번호 k(1…) 반환"""
+    big = pd.concat([df] * scale, ignore_index=True)
+    return big, np.repeat(np.arange(scale), len(df))
+
+
+def _suffix(s, k, fmt):
+    s = s.astype(str)
+    tag = pd.Series(np.where(k > 0, [fmt.format(i) for i in k], ''), index=s.index)
+    return s + tag
+
+
+def synth_db(db, scale, seed=0):
+    """원료DB·시장제품DB·가이드배합비DB 확대. 원본 행은 앞쪽에 그대로 남아 조회 결과가 바뀌지 않음"""
+    if scale <= 1:
+        return db
+    rng = np.random.default_rng(seed)
+    out = dict(db)
+
+    ing, k = _replicate(db['원료DB'], scale)
+    ing['원료명'] = _suffix(ing['원료명'], k, ' S{}')
+    ing['No'] = np.arange(1, len(ing) + 1)
+    jitter = np.where(k > 0, rng.uniform(0.9, 1.1, len(ing)), 1.0)
+    for c in engine.ING_NUMERIC_COLS + [engine.ph_column(ing)]:
+        ing[c] = ing[c] * jitter
+    out['원료DB'] = ing
+
+    prod, k = _replicate(db['시장제품DB'], scale)
+    prod['제품명'] = _suffix(prod['제품명'], k, ' #{}')
+    prod['No'] = np.arange(1, len(prod) + 1)
+    out['시장제품DB'] = prod
+
+    guide, k = _replicate(db['가이드배합비DB'], scale)
+    key = guide['키(유형_맛_슬롯)'].astype(str)
+    head, slot = key.str.rsplit('_', n=1).str[0], key.str.rsplit('_', n=1).str[1]
+    # 맛 이름에 번호를 붙여 원본 접두어('유형_맛_')와 겹치지 않는 가짜 맛 생성
+    guide['키(유형_맛_슬롯)'] = np.where(k > 0, head + pd.Series(k).astype(str) + '_' + slot, key)
+    out['가이드배합비DB'] = guide
+    return out
+
+
+# ============================================================
+# 2. 케이스
+# ============================================================
+def _args_cycle(items):
+    it = itertools.cycle(items)
+    return lambda: next(it)
+
+
+def build_cases(db, ph_col, xlsx_path=None):
+    """[(케이스명, 인자 없는 호출)] — 각 호출은 1회 작업"""
+    df_ing, df_prod = db['원료DB'], db['시장제품DB']
+    df_guide, df_spec, df_proc = db['가이드배합비DB'], db['음료규격기준'], db['표준제조공정_HACCP']
+    base_names = db['원료DB']['원료명'].astype(str).head(174).tolist()
+    exact = _args_cycle(base_names)
+    fuzzy_names = [n.split('(')[0][:4] + '원액' for n in base_names if len(n) >= 4][:40]
+    fuzzy = _args_cycle(fuzzy_names)
+
+    # 가이드는 실제 맛만 순환 (합성 맛은 표 크기만 키움)
+    guide_keys = df_guide['키(유형_맛_슬롯)'].dropna().astype(str).str.rsplit('_', n=1).str[0].unique()
+    guide_list = [k.split('_', 1) for k in guide_keys if '_' in k and not k[-1].isdigit()]
+    guide_args = _args_cycle(guide_list)
+    prod_rows = _args_cycle([r for _, r in df_prod.head(200).iterrows()])
+    bev_types = _args_cycle(df_spec['음료유형'].dropna().astype(str).tolist())
+
+    sample = engine.load_guide(df_guide, '과·채음료', '사과', df_ing, ph_col)
+    nutrients = engine.build_nutrient_matrix(df_ing, db.get('원료영양DB'))
+    sample_bump = itertools.count()
+
+    price_book = engine.build_price_book(df_ing, db.get('원료단가이력'))
+    plant_skus = [{'name': f'SKU{i}', 'slots': sample, 'batches': [5_000, 8_000, 10_000, 15_000, 20_000, 30_000]}
+                  for i in range(20)]
+
+    def calc_fresh(ph_model='linear', sweet_model='linear', price_date=None):
+        s = [dict(x) for x in sample]
+        s[0]['배합비(%)'] = 5 + next(sample_bump) % 1000 / 1000   # 매번 다른 배합 → 메모 미적중
+        engine.calc_slot_contributions(s[0])
+        return engine.calc_formulation(s, ph_model=ph_model, sweet_model=sweet_model,
+                                       price_date=price_date, price_book=price_book)
+
+    def label_fresh():
+        engine._MEMO.clear()
+        return engine.generate_food_label(sample, "벤치 사과음료", 500, '과·채음료', nutrients)
+
+    def index_cold():
+        engine._ING_INDEX.pop(id(df_ing), None)
+        return engine.fill_slot_from_db(engine.EMPTY_SLOT.copy(), exact(), df_ing, ph_col)
+
+    # 순환 인자는 한 바퀴 미리 실행 → 유사매칭 캐시가 찬 정상 상태를 측정 (미적중 비용은 별도 케이스)
+    for nm in fuzzy_names:
+        engine.resolve_ingredient(nm, df_ing)
+    for bt, flavor in guide_list:
+        engine.load_guide(df_guide, bt, flavor, df_ing, ph_col)
+
+    sweep_vars = [(i, p * 0.5, p * 1.5) for i, p in
+                  ((i, engine.safe_float(x.get('배합비(%)', 0))) for i, x in enumerate(sample[:19])) if p > 0][:3]
+    sweep_objs = np.random.default_rng(0).random((100_000, 3))
+    sub_index = engine.build_substitute_index(df_ing, ph_col)
+
+    blob = pickle.dumps(db, protocol=pickle.HIGHEST_PROTOCOL)
+    cases = [
+        ('db_load[pickle]', lambda: pickle.loads(blob)),
+        ('fill_slot_from_db[exact]', lambda: engine.fill_slot_from_db(
+            engine.EMPTY_SLOT.copy(), exact(), df_ing, ph_col)),
+        ('fill_slot_from_db[fuzzy]', lambda: engine.fill_slot_from_db(
+            engine.EMPTY_SLOT.copy(), fuzzy(), df_ing, ph_col)),
+        ('resolve_ingredient[uncached]', lambda: engine._match_ingredient(fuzzy(), df_ing)),
+        ('calc_formulation', calc_fresh),
+        ('calc_formulation[memo]', lambda: engine.calc_formulation(sample)),
+        ('calc_formulation[equilibrium]', lambda: calc_fresh('equilibrium')),
+        ('calc_formulation[beidler]', lambda: calc_fresh(sweet_model='beidler')),
+        ('calc_formulation[price_date]', lambda: calc_fresh(price_date='2025-11-01')),
+        ('cost_history', lambda: engine.cost_history(sample, price_book)),
+        ('production_batches[20 SKU×6]', lambda: engine.production_batches(plant_skus, df_ing)),
+        ('load_guide', lambda: engine.load_guide(df_guide, *guide_args(), df_ing, ph_col)),
+        ('reverse_engineer', lambda: engine.reverse_engineer(prod_rows(), df_ing, ph_col)),
+        ('generate_food_label', label_fresh),
+        ('design_sweep[100k]', lambda: engine.design_sweep(sample, sweep_vars, None, 100_000)),
+        ('pareto_front[100k×3]', lambda: engine.pareto_front(sweep_objs)),
+        ('find_substitutes', lambda: engine.find_substitutes(sample[0], sub_index)),
+    ]
+    def haccp_fresh(fn, *args):
+        engine._HACCP_MEMO.clear()      # 공정 매칭 + 렌더링 전체 비용
+        return fn(*args)
+
+    for g in HACCP_GENERATORS:
+        fn = getattr(engine, g)
+        if g == 'haccp_sop':
+            cases.append((g, lambda fn=fn: haccp_fresh(fn, bev_types(), df_proc, "벤치 사과음료", sample)))
+        else:
+            cases.append((g, lambda fn=fn: haccp_fresh(fn, bev_types(), df_proc)))
+    cases.append(('haccp_documents[6종]', lambda: haccp_fresh(
+        engine.haccp_documents, bev_types(), df_proc, "벤치 사과음료", sample)))
+    cases.append(('haccp_documents[cached]', lambda: engine.haccp_documents(
+        bev_types(), df_proc, "벤치 사과음료", sample)))
+    cases.append(('fill_slot_from_db[cold-index]', index_cold))   # 색인·유사매칭 캐시를 비우므로 마지막
+    if xlsx_path:
+        cases.insert(0, ('db_load[xlsx]', lambda: engine.prepare_db(xlsx_path)))
+    return cases
+
+
+# ============================================================
+# 3. 측정
+# ============================================================
+def measure(fn, min_time=0.3, min_reps=5, max_reps=20000):
+    fn()   # 워밍업 (색인·캐시 생성)
+    times = []
+    t_end = time.perf_counter() + min_time
+    while len(times) < min_reps or (time.perf_counter() < t_end and len(times) < max_reps):
+        t0 = time.perf_counter_ns()
+        fn()
+        times.append(time.perf_counter_ns() - t0)
+    us = np.array(times) / 1000
+    med = float(np.median(us))
+    return {
+        'reps': len(us),
+        'median_us': round(med, 2),
+        'p95_us': round(float(np.percentile(us, 95)), 2),
+        'mean_us': round(float(us.mean()), 2),
+        'ops_s': round(1e6 / med, 1) if med else 0.0,
+    }
+
+
+def _meta(scales, seed):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+        'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+        'machine': f"{platform.system()} {platform.machine()} / {os.cpu_count()} cpu",
+        'scales': scales, 'seed': seed,
+    }
+
+
+# ============================================================
+# 4. 기준 대비 비교
+# ============================================================
+def compare(results, baseline, threshold):
+    """(표 행 목록, 회귀 건수). 중앙값이 기준보다 threshold 이상 느리면 회귀"""
+    base = {(r['case'], r['scale']): r for r in baseline.get('results', [])}
+    rows, regressions = [], 0
+    for r in results:
+        b = base.get((r['case'], r['scale']))
+        if not b or not b['median_us']:
+            rows.append((r['case'], r['scale'], None, r['median_us'], None, '신규'))
+            continue
+        ratio = r['median_us'] / b['median_us']
+        if ratio > 1 + threshold:
+            status, regressions = '회귀', regressions + 1
+        elif ratio < 1 / (1 + threshold):
+            status = '개선'
+        else:
+            status = '-'
+        rows.append((r['case'], r['scale'], b['median_us'], r['median_us'], ratio, status))
+    return rows, regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="engine.py 마이크로 벤치마크")
+    ap.add_argument('--db', default=engine.DB_PATH, help='배포 엑셀 DB 경로')
+    ap.add_argument('--scales', default='1,10,100', help='DB 배율 목록 (1 = 원본)')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--filter', default='', help='케이스명에 이 문자열이 포함된 것만')
+    ap.add_argument('--min-time', type=float, default=0.3, help='케이스별 최소 측정 시간(초)')
+    ap.add_argument('--json', help='결과 JSON 저장 경로')
+    ap.add_argument('--baseline', help='비교할 기준 JSON')
+    ap.add_argument('--update-baseline', action='store_true', help='이번 결과로 기준 JSON 덮어쓰기')
+    ap.add_argument('--threshold', type=float, default=0.25, help='회귀 판정 비율 (0.25 = 25%% 느려짐)')
+    a = ap.parse_args()
+
+    warnings.filterwarnings('ignore', category=UserWarning, module='openpyxl')
+    scales = [int(s) for s in a.scales.split(',') if s.strip()]
+    sizes = {}
+    base_db = engine.prepare_db(a.db)
+    ph_col = engine.ph_column(base_db['원료DB'])
+    results = []
+    print(f"{'case':<32}{'scale':>6}{'median_us':>12}{'p95_us':>12}{'ops/s':>11}{'reps':>7}")
+    for scale in scales:
+        db = engine.compact_db(synth_db(base_db, scale, a.seed))   # 앱/API와 같은 압축 DB로 측정
+        sizes[scale] = {k: len(db[k]) for k in ('원료DB', '시장제품DB', '가이드배합비DB')}
+        cases = build_cases(db, ph_col, a.db if scale == 1 else None)
+        for name, fn in cases:
+            if a.filter and a.filter not in name:
+                continue
+            engine._MEMO.clear()
+            r = {'case': name, 'scale': scale, **measure(fn, a.min_time)}
+            results.append(r)
+            print(f"{name:<32}{scale:>6}{r['median_us']:>12,.1f}{r['p95_us']:>12,.1f}"
+                  f"{r['ops_s']:>11,.1f}{r['reps']:>7}")
+        del db, cases
+    engine._ING_INDEX.clear()
+
+    report = {'meta': {**_meta(scales, a.seed), 'sizes': sizes}, 'results': results}
+    if a.json:
+        with open(a.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    regressions = 0
+    if a.baseline and os.path.exists(a.baseline) and not a.update_baseline:
+        with open(a.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressions = compare(results, baseline, a.threshold)
+        print(f"\n기준: {a.baseline} ({baseline.get('meta', {}).get('commit', '?')}, "
+              f"{baseline.get('meta', {}).get('date', '?')}) · 회귀 기준 +{a.threshold:.0%}")
+        print(f"{'case':<32}{'scale':>6}{'base_us':>12}{'now_us':>12}{'ratio':>8}  판정")
+        for case, scale, b, now, ratio, status in rows:
+            print(f"{case:<32}{scale:>6}{(f'{b:,.1f}' if b else '-'):>12}{now:>12,.1f}"
+                  f"{(f'{ratio:.2f}' if ratio else '-'):>8}  {status}")
+        print(f"회귀 {regressions}건")
+    if a.baseline and (a.update_baseline or not os.path.exists(a.baseline)):
+        with open(a.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"기준 저장 → {a.baseline}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+chat_context.py — Gemini 대화 컨텍스트 압축/캐싱
+- 오래된 턴은 한 줄 요약으로 접어 누적 요약(running summary)에 합침
+- 배합 컨텍스트는 고정 프리앰블에 한 번만 싣고, 이후에는 바뀐 줄(diff)만 전송
+- 세션에 저장하는 대화 턴 수 상한 (페이즈/페이지별)
+프리앰블(요약+기준 배합+답변 규칙)이 턴마다 동일하게 유지되므로 Gemini 2.5의
+암묵적 컨텍스트 캐시(prefix cache)에도 그대로 적중함.
+"""
+import hashlib
+import re
+
+MAX_TURNS_SENT = 6        # 원문 그대로 보내는 최근 턴 수
+MAX_STORED_TURNS = 40     # session_state에 보관하는 턴 수 상한
+SUMMARY_MAX_CHARS = 1500  # 누적 요약 길이 상한 (넘으면 오래된 줄부터 버림)
+TURN_SUMMARY_CHARS = 120  # 턴 1개 요약 길이
+REBASE_RATIO = 0.6        # diff가 전체 컨텍스트의 60%를 넘으면 기준 데이터 교체
+
+
+def cap_history(history, limit=MAX_STORED_TURNS):
+    """history(list)를 제자리에서 최근 limit개로 자름"""
+    if len(history) > limit:
+        del history[:len(history) - limit]
+    return history
+
+
+def summarize_turn(text, limit=TURN_SUMMARY_CHARS):
+    """코드블록 제거 후 첫 문장/줄만 남겨 한 줄 요약"""
+    text = re.sub(r'```.*?```', '[JSON]', str(text or ''), flags=re.DOTALL)
+    text = re.sub(r'[#*`>|]+', ' ', text)
+    line = next((ln.strip() for ln in text.splitlines() if ln.strip()), '')
+    m = re.match(r'(.+?[.!?。])(\s|$)', line)
+    if m:
+        line = m.group(1)
+    return line[:limit] + ('…' if len(line) > limit else '')
+
+
+def _turn_text(turn):
+    return turn.get('text', turn.get('content', ''))
+
+
+def _is_model(turn):
+    return turn.get('role') in ('model', 'assistant')
+
+
+def context_diff(old, new):
+    """줄 단위 diff — 사라진 줄은 '-', 새 줄은 '+'"""
+    old_lines, new_lines = old.splitlines(), new.splitlines()
+    old_set, new_set = set(old_lines), set(new_lines)
+    out = [f"- {ln.strip()}" for ln in old_lines if ln not in new_set]
+    out += [f"+ {ln.strip()}" for ln in new_lines if ln not in old_set]
+    return '\n'.join(out)
+
+
+class ChatContext:
+    """대화 1개의 압축 상태. session_state에 그대로 보관 가능한 평범한 객체."""
+
+    def __init__(self, rules=''):
+        self.rules = rules          # 답변 규칙 (프리앰블에 고정)
+        self.summary = []           # 접힌 턴 요약 줄
+        self.base_ctx = ''          # 프리앰블에 실린 기준 배합 데이터
+        self.base_hash = ''
+        self.folded = 0             # 요약에 합친 턴 수
+        self._last_folded = None    # 마지막으로 접은 턴 (history 앞부분이 잘려도 위치를 찾도록)
+
+    def compact(self, history, keep=MAX_TURNS_SENT):
+        """최근 keep개를 제외한 턴 중 아직 접지 않은 것을 요약에 합침 (history의 턴 dict는 건드리지 않음).
+        history는 뒤에 추가 · 앞에서 자르기만 한다고 가정 — 마지막으로 접은 턴 다음부터 접음"""
+        old = history[:-keep] if keep else history
+        start = next((i + 1 for i in range(len(old) - 1, -1, -1) if old[i] is self._last_folded), 0)
+        for turn in old[start:]:
+            who = 'AI' if _is_model(turn) else '사용자'
+            self.summary.append(f"{who}: {summarize_turn(_turn_text(turn))}")
+            self.folded += 1
+            self._last_folded = turn
+        while self.summary and sum(len(s) + 1 for s in self.summary) > SUMMARY_MAX_CHARS:
+            self.summary.pop(0)
+
+    def context_block(self, ctx):
+        """현재 메시지에 붙일 배합 컨텍스트 — 첫 호출/대폭 변경 시 기준 교체, 그 외 diff만"""
+        h = hashlib.sha1(ctx.encode('utf-8')).hexdigest()
+        if h == self.base_hash:
+            return "[현재 배합 데이터] 기준 데이터와 동일 (변경 없음)"
+        diff = context_diff(self.base_ctx, ctx) if self.base_ctx else ''
+        if not self.base_ctx or len(diff) > len(ctx) * REBASE_RATIO:
+            self.base_ctx, self.base_hash = ctx, h
+            return "[현재 배합 데이터] 기준 데이터 갱신됨 (대화 앞부분 참조)"
+        return f"[현재 배합 데이터] 기준 데이터 대비 변경된 줄:\n{diff}"
+
+    def preamble(self):
+        parts = [self.rules.strip()] if self.rules else []
+        if self.summary:
+            parts.append("[이전 대화 요약]\n" + '\n'.join(self.summary))
+        if self.base_ctx:
+            parts.append(f"[기준 배합 데이터]\n{self.base_ctx}")
+        return '\n\n'.join(parts)
+
+    def build_contents(self, history, user_msg, ctx, keep=MAX_TURNS_SENT):
+        """Gemini contents 생성: 프리앰블 → 최근 턴(user↔model 교대 보정) → 새 질문"""
+        self.compact(history, keep)
+        ctx_block = self.context_block(ctx)   # 기준 교체가 프리앰블에 반영되도록 먼저 계산
+
+        contents = [{"role": "user", "parts": [{"text": self.preamble()}]},
+                    {"role": "model", "parts": [{"text": "확인했습니다."}]}]
+        expected = "user"
+        for turn in (history[-keep:] if keep else []):
+            role = "model" if _is_model(turn) else "user"
+            if role != expected:
+                continue   # 순서 어긋나는 턴 스킵
+            contents.append({"role": role, "parts": [{"text": _turn_text(turn)}]})
+            expected = "model" if expected == "user" else "user"
+        if contents[-1]["role"] == "user":
+            contents.append({"role": "model", "parts": [{"text": "확인했습니다."}]})
+        contents.append({"role": "user", "parts": [{"text": f"{ctx_block}\n\n질문: {user_msg}"}]})
+        return contents
@@ -8,6 +8,7 @@ Gemini API (v1 REST) 연동 | Streamlit Cloud 배포 대응
 import streamlit as st
 import requests
 import json
+import os
 import time
 import pandas as pd
 import numpy as np
@@ -15,6 +16,10 @@ import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime
 
+import llm_gateway
+import llm_metrics
+from chat_context import cap_history
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 기본 설정
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -91,6 +96,8 @@ st.markdown("""
 # Gemini API
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+
 GEMINI_MODELS = [
     ("gemini-2.5-pro", "v1"),
     ("gemini-2.5-flash", "v1beta"),
@@ -107,8 +114,8 @@ def get_api_key():
     return None
 
 
-def call_gemini(prompt, system_context="", max_tokens=8192):
-    """Gemini API 호출 (REST direct, fallback chain)"""
+def call_gemini(prompt, system_context="", max_tokens=8192, persona=""):
+    """Gemini API 호출 (REST direct, fallback chain) — 모델별 시도마다 llm_metrics 기록"""
     api_key = get_api_key()
     if not api_key:
         return "⚠️ API 키가 설정되지 않았습니다. 사이드바에서 입력해주세요."
@@ -127,15 +134,28 @@ def call_gemini(prompt, system_context="", max_tokens=8192):
         }
     }
     
+    # 동일 프리셋을 여러 세션이 동시에 누르면 llm_gateway가 한 번만 호출하고 결과를 공유
+    est_tokens = llm_gateway.estimate_tokens(full_prompt, max_tokens)
     for model, api_ver in GEMINI_MODELS:
-        url = f"https://generativelanguage.googleapis.com/{api_ver}/models/{model}:generateContent?key={api_key}"
+        url = f"{GEMINI_API_BASE}/{api_ver}/models/{model}:generateContent?key={api_key}"
         try:
-            resp = requests.post(url, json=payload, timeout=120)
-            if resp.status_code == 200:
-                data = resp.json()
-                text = data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-                if text:
-                    return text
+            with llm_metrics.track('gemini', model, persona) as rec:
+                resp, shared = llm_gateway.call_shared(
+                    'gemini', (api_key, model, api_ver, payload),
+                    lambda: requests.post(url, json=payload, timeout=120,
+                                          hooks={'response': rec.first_byte}),
+                    tokens=est_tokens)
+                rec.cache = 'coalesced' if shared else 'miss'
+                if resp.status_code == 200:
+                    data = resp.json()
+                    if not shared:
+                        um = data.get("usageMetadata", {})
+                        rec.usage(um.get("promptTokenCount", 0), um.get("candidatesTokenCount", 0))
+                    text = data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+                    if text:
+                        return text
+                rec.outcome = 'error'
+                rec.error = f"HTTP {resp.status_code}"
             # 400/429 등은 다음 모델로 fallback
         except requests.exceptions.Timeout:
             continue
@@ -227,8 +247,9 @@ def render_chat_ui(phase_key, system_prompt, placeholder_text, preset_prompts=No
                 if st.button(f"▶ {label}", key=f"preset_{phase_key}_{i}", use_container_width=True):
                     history.append({"role": "user", "content": prompt})
                     with st.spinner("🤖 AI 분석 중..."):
-                        response = call_gemini(prompt, system_context=system_prompt)
+                        response = call_gemini(prompt, system_context=system_prompt, persona=phase_key)
                     history.append({"role": "assistant", "content": response})
+                    cap_history(history)
                     st.rerun()
         st.markdown("---")
     
@@ -248,8 +269,9 @@ def render_chat_ui(phase_key, system_prompt, placeholder_text, preset_prompts=No
     if user_input:
         history.append({"role": "user", "content": user_input})
         with st.spinner("🤖 AI가 분석 중입니다..."):
-            response = call_gemini(user_input, system_context=system_prompt)
+            response = call_gemini(user_input, system_context=system_prompt, persona=phase_key)
         history.append({"role": "assistant", "content": response})
+        cap_history(history)
         st.rerun()
     
     # 초기화 버튼
@@ -954,6 +976,7 @@ page_map = {
 }
 
 current = st.session_state.current_page
+llm_metrics.set_page(current)
 if current in page_map:
     page_map[current]()
 else:
@@ -3,8 +3,171 @@ engine.py v7 — 배합계산 + AI페르소나 + HACCP서류 + 식품표시기
 """
 import pandas as pd
 import numpy as np
-import json, re, math
-from datetime import datetime
+import json, re, math, os, sys, hashlib, pickle, threading, weakref
+from collections import OrderedDict
+from datetime import datetime, date as _date
+from types import MappingProxyType
+import llm_gateway
+import llm_metrics
+from keyword_matcher import KeywordMatcher
+
+try:
+    from scipy.spatial import cKDTree          # 선택: 없으면 numpy 전수 거리 계산 (원료 수백 종이면 충분)
+except ImportError:
+    cKDTree = None
+
+# ============================================================
+# 0. DB 준비 (앱 · API · 배치 공용)
+# ============================================================
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "음료개발_데이터베이스_v4-1.xlsx")
+DB_CACHE_DIR = os.environ.get(
+    'DB_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.db_cache'))
+
+ING_NUMERIC_COLS = ['Brix(°)', 'pH', '산도(%)', '감미도(설탕대비)', '예상단가(원/kg)',
+                    '1%사용시 Brix기여(°)', '1%사용시 산도기여(%)', '1%사용시 감미기여']
+
+# 공유 DB 압축: 반복값 많은 분류 문자열 → category, 표시 전용 실수 → float32 (값이 정확히 보존될 때만)
+# 계산에 쓰는 원료 물성·규격 수치는 float64 유지 (float32 스칼라 연산은 결과 정밀도가 바뀜)
+CATEGORY_COLS = {
+    '시장제품DB': ['대분류', '세부유형', '제조사', '포장용기'],
+    '원료DB': ['원료대분류', '원료소분류', '공급형태', '보관조건'],
+    '표준제조공정_HACCP': ['음료유형', 'CCP여부', '한계기준(CL)'],
+    '가이드배합비DB': ['구분'],
+}
+FLOAT32_COLS = {'시장제품DB': ['용량(ml)', '가격(원)']}
+DB_SNAPSHOT_VERSION = 4
+
+# 원료 영양성분표 (100 g당) — 엑셀 옆 CSV, 시트 '원료영양DB'로 로딩. 없는 원료는 Brix로 추정
+# (이름, 단위, 1일 영양성분 기준치, 표시 반올림 규칙) — 앞 9종이 의무표시
+NUTRIENT_SPEC = [
+    ('열량', 'kcal', None, 'kcal'), ('탄수화물', 'g', 324, 'g1'), ('당류', 'g', 100, 'g1'),
+    ('단백질', 'g', 55, 'g1'), ('지방', 'g', 54, 'fat'), ('포화지방', 'g', 15, 'fat'),
+    ('트랜스지방', 'g', None, 'trans'), ('콜레스테롤', 'mg', 300, 'chol'), ('나트륨', 'mg', 2000, 'sodium'),
+    ('비타민A', 'μg RAE', 700, 'vit'), ('비타민C', 'mg', 100, 'vit'), ('비타민D', 'μg', 10, 'vit'),
+    ('비타민E', 'mg α-TE', 11, 'vit'), ('칼슘', 'mg', 700, 'vit'),
+]
+NUTRIENT_COLS = [f'{n}({u})' for n, u, _, _ in NUTRIENT_SPEC]
+NUTRIENT_MANDATORY = 9
+NUTRIENT_CSV = '원료영양성분.csv'
+
+# 원료 단가 이력 (원료 × 적용일, 공급사) — 엑셀 옆 CSV, 시트 '원료단가이력'으로 로딩. 없으면 원료DB 예상단가만 사용
+PRICE_CSV = '원료단가이력.csv'
+PRICE_COLS = ['원료명', '적용일', '단가(원/kg)', '공급사']
+
+
+def ph_column(df_ing):
+    return [c for c in df_ing.columns if 'pH영향' in str(c) or 'ΔpH' in str(c)][0]
+
+
+def nutrient_path(path=DB_PATH):
+    """영양성분표 CSV 경로 (NUTRIENT_CSV 환경변수 > 엑셀과 같은 폴더)"""
+    return os.environ.get('NUTRIENT_CSV') or os.path.join(os.path.dirname(os.path.abspath(path)), NUTRIENT_CSV)
+
+
+def price_history_path(path=DB_PATH):
+    """단가 이력 CSV 경로 (PRICE_CSV 환경변수 > 엑셀과 같은 폴더)"""
+    return os.environ.get('PRICE_CSV') or os.path.join(os.path.dirname(os.path.abspath(path)), PRICE_CSV)
+
+
+def load_price_history(path):
+    """단가 이력 CSV → DataFrame (PRICE_COLS, 적용일은 datetime64). 날짜·단가가 없는 행은 버림. 파일이 없으면 빈 표"""
+    if not os.path.exists(path):
+        return pd.DataFrame({'원료명': pd.Series(dtype=object), '적용일': pd.Series(dtype='datetime64[ns]'),
+                             '단가(원/kg)': pd.Series(dtype=float), '공급사': pd.Series(dtype=object)})
+    df = pd.read_csv(path, encoding='utf-8-sig')
+    out = pd.DataFrame({
+        '원료명': df['원료명'].astype(str).str.strip(),
+        '적용일': pd.to_datetime(df['적용일'], errors='coerce'),
+        '단가(원/kg)': pd.to_numeric(df['단가(원/kg)'], errors='coerce'),
+        '공급사': df['공급사'].fillna('').astype(str).str.strip() if '공급사' in df else '',
+    })
+    return out.dropna(subset=['적용일', '단가(원/kg)']).reset_index(drop=True)
+
+
+def load_nutrient_table(path):
+    """영양성분표 CSV → DataFrame (원료명 + NUTRIENT_COLS, 빈칸은 NaN). 파일이 없으면 빈 표"""
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['원료명'] + NUTRIENT_COLS)
+    df = pd.read_csv(path, encoding='utf-8-sig')
+    out = pd.DataFrame({'원료명': df['원료명'].astype(str).str.strip()})
+    for c in NUTRIENT_COLS:
+        out[c] = pd.to_numeric(df[c], errors='coerce') if c in df else np.nan
+    return out
+
+
+def prepare_db(path=DB_PATH):
+    """엑셀 전체 시트 로딩 + 원료DB 수치 컬럼 정리 + 영양성분표·단가이력. {시트명: DataFrame}"""
+    data = {n: pd.read_excel(path, sheet_name=n) for n in pd.ExcelFile(path).sheet_names}
+    df_ing = data['원료DB']
+    for c in ING_NUMERIC_COLS + [ph_column(df_ing)]:
+        df_ing[c] = pd.to_numeric(df_ing[c], errors='coerce').fillna(0)
+    data['원료영양DB'] = load_nutrient_table(nutrient_path(path))
+    data['원료단가이력'] = load_price_history(price_history_path(path))
+    return data
+
+
+def _interned(values):
+    return [sys.intern(v) if isinstance(v, str) else v for v in values]
+
+
+def compact_db(data):
+    """category / float32 / 문자열 intern 적용한 새 dict (원본 불변)"""
+    out = {}
+    for name, df in data.items():
+        df = df.copy()
+        for c in CATEGORY_COLS.get(name, []):
+            if c in df:
+                df[c] = df[c].astype('category')
+        for c in FLOAT32_COLS.get(name, []):
+            if c in df:
+                v = df[c].to_numpy(dtype=float)
+                if np.array_equal(v.astype(np.float32).astype(float), v, equal_nan=True):
+                    df[c] = v.astype(np.float32)
+        for c in df.columns[df.dtypes == object]:     # 숫자·문자 혼합 컬럼 (문자열은 Arrow 저장이라 해당 없음)
+            df[c] = pd.Series(_interned(df[c]), index=df.index, dtype=object)
+        out[name] = df
+    return out
+
+
+def _file_tag(path):
+    """스냅샷 키용 부속 파일 수정시각.크기 (없으면 '0')"""
+    try:
+        fst = os.stat(path)
+        return f"{fst.st_mtime_ns}.{fst.st_size}"
+    except OSError:
+        return '0'
+
+
+def load_db(path=DB_PATH, snapshot=True):
+    """prepare_db + compact_db + pickle 스냅샷 (엑셀·영양성분표·단가이력 수정시각 + pandas/numpy 버전 기준 자동 갱신). 워커 기동 시간 단축용.
+    스냅샷을 못 읽으면(다른 버전이 쓴 pickle 등) 엑셀에서 다시 만들고, 새 스냅샷을 쓰면 같은 DB의 이전 스냅샷은 지움.
+    반환값은 읽기 전용 매핑 — 프로세스/세션 간 공유하므로 시트 DataFrame도 수정하지 말 것"""
+    if not snapshot:
+        return MappingProxyType(compact_db(prepare_db(path)))
+    st_ = os.stat(path)
+    nut, prc = _file_tag(nutrient_path(path)), _file_tag(price_history_path(path))
+    snap = os.path.join(DB_CACHE_DIR, f"{os.path.basename(path)}.{st_.st_mtime_ns}.{st_.st_size}"
+                                      f".n{nut}.p{prc}.pd{pd.__version__}.np{np.__version__}.v{DB_SNAPSHOT_VERSION}.pkl")
+    try:
+        with open(snap, 'rb') as f:
+            return MappingProxyType(pickle.load(f))
+    except Exception:
+        pass  # 없음 / 깨짐 / 다른 pandas·numpy가 쓴 pickle (AttributeError, ModuleNotFoundError …) → 다시 생성
+    data = compact_db(prepare_db(path))
+    try:
+        os.makedirs(DB_CACHE_DIR, exist_ok=True)
+        tmp = f"{snap}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, snap)
+        prefix = os.path.basename(path) + '.'
+        for old in os.listdir(DB_CACHE_DIR):
+            if old.startswith(prefix) and old.endswith('.pkl') and old != os.path.basename(snap):
+                os.remove(os.path.join(DB_CACHE_DIR, old))
+    except OSError:
+        pass  # 읽기전용 배포 환경이면 스냅샷 없이 사용
+    return MappingProxyType(data)
+
 
 # ============================================================
 # 1. 슬롯 시스템
@@ -33,31 +196,63 @@ def init_slots():
     return [EMPTY_SLOT.copy() for _ in range(20)]
 
 
+_ING_INDEX = {}   # id(df_ing) → (weakref, 행수, {원료명: 행 dict}, {입력명: 매칭된 원료명|None})
+
+
+def _ing_index(df_ing):
+    """원료명 색인 + 유사매칭 결과 캐시. DataFrame별 1회 생성 (DB는 읽기전용 전제)"""
+    ent = _ING_INDEX.get(id(df_ing))
+    if ent is not None and ent[0]() is df_ing and ent[1] == len(df_ing):
+        return ent[2], ent[3]
+    index = {}
+    for rec in df_ing.to_dict('records'):
+        index.setdefault(rec['원료명'], rec)   # 중복 시 첫 행 (기존 row.iloc[0]과 동일)
+    key = id(df_ing)
+    _ING_INDEX[key] = (weakref.ref(df_ing, lambda _, k=key: _ING_INDEX.pop(k, None)),
+                       len(df_ing), index, {})
+    return index, _ING_INDEX[key][3]
+
+
+def _match_ingredient(name, df_ing):
+    """유사 매칭 → DB 원료명 (없으면 None)"""
+    # ② 유사 매칭: 괄호 앞 부분으로 검색
+    short = re.split(r'[\(\)]', name)[0].strip()
+    if len(short) >= 2:
+        cands = df_ing[df_ing['원료명'].str.contains(short, na=False, regex=False)]
+        if not cands.empty:
+            return cands.iloc[0]['원료명']
+    # ③ 역방향: DB이름의 앞부분이 입력이름에 포함
+    for db_name in df_ing['원료명']:
+        db_short = re.split(r'[\(\)]', str(db_name))[0].strip()
+        if len(db_short) >= 2 and db_short in name:
+            return db_name
+    return None
+
+
+def resolve_ingredient(name, df_ing):
+    """입력 원료명 → 원료DB 원료명 (① 정확 → ②③ 유사 매칭, 입력명별 결과 캐시). 없으면 None"""
+    name = str(name).strip()
+    index, resolved = _ing_index(df_ing)
+    if name in index:
+        return name
+    if name not in resolved:
+        resolved[name] = _match_ingredient(name, df_ing)
+    return resolved[name]
+
+
 def fill_slot_from_db(slot, name, df_ing, ph_col):
     if not name or not str(name).strip():
         return slot
     name = str(name).strip()
-    # ① 정확 매칭
-    row = df_ing[df_ing['원료명'] == name]
-    # ② 유사 매칭: 괄호 앞 부분으로 검색
-    if row.empty:
-        short = re.split(r'[\(\)]', name)[0].strip()
-        if len(short) >= 2:
-            cands = df_ing[df_ing['원료명'].str.contains(short, na=False, regex=False)]
-            if not cands.empty:
-                row = cands.head(1)
-    # ③ 역방향: DB이름의 앞부분이 입력이름에 포함
-    if row.empty:
-        for _, candidate in df_ing.iterrows():
-            db_short = re.split(r'[\(\)]', str(candidate['원료명']))[0].strip()
-            if len(db_short) >= 2 and db_short in name:
-                row = df_ing[df_ing['원료명'] == candidate['원료명']]
-                break
-    if row.empty:
+    r = _ing_index(df_ing)[0].get(resolve_ingredient(name, df_ing))
+    if r is None:
         slot['원료명'] = name
         slot['is_custom'] = True
         return slot
-    r = row.iloc[0]
+    return _fill_slot(slot, r, ph_col)
+
+
+def _fill_slot(slot, r, ph_col):
     slot['원료명'] = str(r['원료명'])
     slot['당도(Bx)'] = safe_float(r.get('Brix(°)', 0))
     slot['산도(%)'] = safe_float(r.get('산도(%)', 0))
@@ -96,19 +291,297 @@ def calc_slot_contributions(slot):
     return slot
 
 
-def calc_formulation(slots, volume_ml=500):
-    total_brix = sum(safe_float(s.get('당기여', 0)) for s in slots)
-    total_acid = sum(safe_float(s.get('산기여', 0)) for s in slots)
-    total_sweet = sum(safe_float(s.get('감미기여', 0)) for s in slots)
-    total_dph = sum(safe_float(s.get('1%pH영향', 0)) * safe_float(s.get('배합비(%)', 0)) for s in slots)
-    total_cost_kg = sum(safe_float(s.get('단가기여(원/kg)', 0)) for s in slots)
+# ── 결과 메모: 같은 배합(슬롯 지문)에 대한 반복 계산 생략 ──
+_FP_FIELDS = ('원료명', '배합비(%)', 'Brix(°)', '당기여', '산기여', '감미기여',
+              '1%pH영향', '단가기여(원/kg)')
+
+
+def slot_key(slots, *extra):
+    """메모 키 — 배합비>0 슬롯의 (위치, 원료명, 배합비, 계산에 쓰이는 이화학값) + 추가 인자 튜플"""
+    key = [extra]
+    for i, s in enumerate(slots):
+        p = s.get('배합비(%)', 0)
+        if p and safe_float(p) > 0:
+            key.append((i, *map(s.get, _FP_FIELDS)))
+    return tuple(key)
+
+
+def fingerprint(slots, *extra):
+    """slot_key의 안정적 해시(hex) — 프로세스/세션 간 비교·저장용"""
+    return hashlib.blake2b(repr(slot_key(slots, *extra)).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _copy(v):
+    """결과(dict/list 중첩, 값은 불변) 전용 빠른 사본"""
+    if isinstance(v, dict):
+        return {k: _copy(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_copy(x) for x in v]
+    return v
+
+
+def _deep_size(v, seen=None):
+    """값의 메모리 크기 추정 — dict/list는 내용까지 재귀 (sys.getsizeof는 얕은 크기라 행 목록을 과소평가).
+    같은 객체(공유되는 컬럼명 키 등)는 한 번만 셈"""
+    if seen is None:
+        seen = set()
+    if id(v) in seen:
+        return 0
+    seen.add(id(v))
+    n = sys.getsizeof(v)
+    if isinstance(v, dict):
+        n += sum(_deep_size(k, seen) + _deep_size(x, seen) for k, x in v.items())
+    elif isinstance(v, (list, tuple)):
+        n += sum(_deep_size(x, seen) for x in v)
+    return n
+
+
+class _Memo:
+    """스레드 안전 LRU (세션 간 공유 — 키가 내용 기반이라 안전). 반환값은 항상 사본.
+    max_bytes > 0 이면 값 크기(_deep_size) 합계도 상한으로 관리"""
+
+    def __init__(self, maxsize=256, max_bytes=0):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.sizes = {}   # 키 → put 시점 크기 (축출 때 재계산 없이 차감)
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return _copy(self.data[key])
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            if self.max_bytes:
+                size = _deep_size(value)
+                self.nbytes += size - self.sizes.get(key, 0)
+                self.sizes[key] = size
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize or (self.max_bytes and self.nbytes > self.max_bytes
+                                                    and len(self.data) > 1):
+                old, _ = self.data.popitem(last=False)
+                if self.max_bytes:
+                    self.nbytes -= self.sizes.pop(old)
+        return _copy(value)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.sizes.clear()
+            self.nbytes = 0
+            self.hits = self.misses = 0
+
+
+_MEMO = _Memo(int(os.environ.get('FORMULATION_MEMO_SIZE', 256)))
+
+
+# ── 평형 pH: 다가산 완충계 전하균형 (ph_model='equilibrium'). 기본 'linear'는 ΔpH 합산 빠른 추정 ──
+PH_MODELS = ('linear', 'equilibrium')
+PH_ACIDS = {        # 산 → pKa (25°C, 이상용액)
+    '구연산': (3.13, 4.76, 6.40), '사과산': (3.40, 5.20), '주석산': (2.98, 4.34), '젖산': (3.86,),
+    '호박산': (4.21, 5.64), '푸마르산': (3.03, 4.44), '아디프산': (4.43, 5.41), '글루콘산': (3.86,),
+    '초산': (4.76,), '인산': (2.15, 7.20, 12.35), '아스코르빈산': (4.17, 11.6), '탄산': (6.35, 10.33),
+    '안식향산': (4.20,),
+}
+PH_SPECIES = {      # 원료명 키워드 → (산, 분자량, 산 mol/mol, 양이온 당량/mol, 순도). 표 순서 = 매칭 우선순위 (염 먼저)
+    '구연산삼칼륨': ('구연산', 324.41, 1, 3, 1.0), '구연산칼륨': ('구연산', 324.41, 1, 3, 1.0),     # 1수화물
+    '구연산삼나트륨': ('구연산', 294.10, 1, 3, 1.0), '구연산나트륨': ('구연산', 294.10, 1, 3, 1.0),  # 2수화물
+    '구연산(수화물)': ('구연산', 210.14, 1, 0, 1.0), '구연산': ('구연산', 192.12, 1, 0, 1.0),
+    '사과산': ('사과산', 134.09, 1, 0, 1.0), '말산': ('사과산', 134.09, 1, 0, 1.0),
+    '주석산': ('주석산', 150.09, 1, 0, 1.0), '젖산': ('젖산', 90.08, 1, 0, 0.85),
+    '호박산': ('호박산', 118.09, 1, 0, 1.0), '푸마르산': ('푸마르산', 116.07, 1, 0, 1.0),
+    '아디프산': ('아디프산', 146.14, 1, 0, 1.0), '글루콘산': ('글루콘산', 196.16, 1, 0, 0.5),
+    '초산': ('초산', 60.05, 1, 0, 1.0),
+    '제3인산칼슘': ('인산', 310.18, 2, 6, 1.0), '인산나트륨': ('인산', 141.96, 1, 2, 1.0),   # 인산이나트륨
+    '인산': ('인산', 98.00, 1, 0, 0.75),
+    '아스코르빈산': ('아스코르빈산', 176.12, 1, 0, 1.0), '에리소르빈산': ('아스코르빈산', 176.12, 1, 0, 1.0),
+    '탄산수소나트륨': ('탄산', 84.01, 1, 1, 1.0), '탄산칼슘': ('탄산', 100.09, 1, 2, 1.0),
+    '탄산가스': ('탄산', 44.01, 1, 0, 1.0), 'CO2': ('탄산', 44.01, 1, 0, 1.0),
+    '안식향산나트륨': ('안식향산', 144.10, 1, 1, 1.0),
+}
+PH_KW = 1e-14
+_PH_ACID_IDX = {a: j for j, a in enumerate(PH_ACIDS)}
+_PH_BETA = np.zeros((len(PH_ACIDS), 4))     # 누적 해리상수 Ka1…Kai — 해리단계 i의 상대 존재비 = β_i / h^i
+_PH_BETA[:, 0] = 1
+for _j, _pk in enumerate(PH_ACIDS.values()):
+    _PH_BETA[_j, 1:len(_pk) + 1] = 10.0 ** -np.cumsum(_pk)
+_PH_I = np.arange(4.0)
+
+
+def _charge_moments(x, beta=_PH_BETA):
+    """ln[H+] 배열(N) → 산별 평균 음전하(N × 산), 그 분산 (= −d평균/d ln h)"""
+    hp = np.exp(-np.asarray(x, dtype=float))[:, None] ** _PH_I
+    w = beta[None] * hp[:, None, :]
+    tot = w.sum(-1)
+    m1 = (w @ _PH_I) / tot
+    return m1, (w @ (_PH_I ** 2)) / tot - m1 ** 2
+
+
+def acid_base_rows(names, ph, acidity):
+    """원료별 산·염기 행 (len × (PH_ACIDS + 1)): 원료 1 kg당 산 mol, 마지막 열 = 강염기 양이온 당량.
+    산미료·염류는 원료명 키워드로 분자량·순도 환산. 그 밖에 산도·pH가 있는 원료(과즙 등)는 산도를 구연산으로 보고
+    원료 자체 pH가 재현되도록 양이온(칼륨 등)을 역산 → 과즙 완충능 반영"""
+    ph, acidity = np.asarray(ph, dtype=float), np.asarray(acidity, dtype=float)
+    out = np.zeros((len(ph), len(PH_ACIDS) + 1))
+    species = {}
+    for i, nm in enumerate(names):
+        nm = str(nm)
+        if nm not in species:
+            species[nm] = KEYWORDS.first(nm, 'ph_species')
+        sp = species[nm]
+        if sp is not None:
+            acid, mw, n_acid, n_cat, purity = PH_SPECIES[sp]
+            mol = 1000 / mw * purity
+            out[i, _PH_ACID_IDX[acid]] = mol * n_acid
+            out[i, -1] = mol * n_cat
+    juice = (out == 0).all(1) & (acidity > 0) & (ph > 0)
+    if juice.any():
+        c = acidity[juice] * 10 / 192.12
+        h0 = 10.0 ** -ph[juice]
+        m1 = _charge_moments(np.log(h0))[0][:, _PH_ACID_IDX['구연산']]
+        out[juice, _PH_ACID_IDX['구연산']] = c
+        out[juice, -1] = np.maximum(c * m1 + PH_KW / h0 - h0, 0)
+    return out
+
+
+def solve_ph(totals, tol=1e-10, max_iter=60):
+    """전하균형 [H+] + 양이온 = [OH-] + Σ 산 농도 × 평균 음전하 → pH 배열.
+    totals: (N × (PH_ACIDS + 1)) mol/L. N개를 한 번에 ln[H+]에 대한 뉴턴법으로 풂
+    (단조 증가 함수, 한 스텝 |Δ| ≤ 1). 쓰이지 않는 산 열과 수렴한 행은 반복에서 제외"""
+    T = np.atleast_2d(np.asarray(totals, dtype=float))
+    used = T[:, :-1].any(0)
+    conc, cat, beta = T[:, :-1][:, used], T[:, -1], _PH_BETA[used]
+    x = np.full(len(T), np.log(1e-4))
+    act = np.arange(len(T))
+    for _ in range(max_iter):
+        if not len(act):
+            break
+        xa, ca = x[act], conc[act]
+        h = np.exp(xa)
+        m1, var = _charge_moments(xa, beta)
+        f = h + cat[act] - PH_KW / h - (ca * m1).sum(1)
+        dx = np.clip(-f / (h + PH_KW / h + (ca * var).sum(1)), -1, 1)
+        x[act] = np.clip(xa + dx, -40, 3)
+        act = act[np.abs(dx) >= tol]
+    return -x / np.log(10)
+
+
+def formulation_ph(slots):
+    """슬롯 배합의 평형 pH (원료 산·염기 행렬과 배합비 벡터의 곱 → 전하균형)"""
+    used = [s for s in slots if safe_float(s.get('배합비(%)', 0)) > 0]
+    pct = np.array([safe_float(s.get('배합비(%)', 0)) for s in used])
+    rows = acid_base_rows([s.get('원료명', '') for s in used], [safe_float(s.get('pH', 0)) for s in used],
+                          [safe_float(s.get('산도(%)', 0)) for s in used])
+    return float(solve_ph(pct / 100 @ rows)[0])
+
+
+# ── 비선형 감미: 감미료별 Beidler 용량-반응 곡선 + 쌍별 상승작용 (sweet_model='beidler') ──
+# 선형 감미 u(설탕환산 %) = 감미도 × 배합비. 곡선: SE = Rmax·u / (Rmax − SE_REF + u)
+# → 원료DB 감미도가 측정된 기준 농도(설탕 5% 상당)에서 선형 모델과 일치, 그 이상은 포화
+SWEET_MODELS = ('linear', 'beidler')
+SWEET_SE_REF = 5.0
+SWEETENER_CURVES = {    # 원료명 키워드 → (곡선군, Rmax 설탕환산 %). None = 선형 (상승작용 표에만 쓰임). 표 순서 = 매칭 우선순위
+    '아스파탐+Ace-K': ('아스파탐+아세설팜칼륨', 16.0),
+    '아스파탐': ('아스파탐', 15.9), '네오탐': ('네오탐', 15.0), '어드밴탐': ('어드밴탐', 15.0),
+    '아세설팜': ('아세설팜칼륨', 11.6), 'Ace-K': ('아세설팜칼륨', 11.6),
+    '수크랄로스': ('수크랄로스', 12.5), '사카린': ('사카린', 9.0), '시클라메이트': ('시클라메이트', 11.6),
+    'Reb-M': ('레바우디오사이드M', 14.0), '스테비아': ('스테비아', 10.1),
+    '나한과': ('나한과', 9.0), '모그로사이드': ('나한과', 9.0),
+    '타우마틴': ('타우마틴', 10.0), '네오헤스피리딘': ('네오헤스피리딘', 8.6),
+    '에리스리톨': ('에리스리톨', None), '알룰로스': ('알룰로스', None),
+}
+SWEET_SYNERGY = {       # (곡선군, 곡선군) → γ: 상승분 = γ·√(SE_a·SE_b). 관능 패널 결과로 보정
+    ('아스파탐', '아세설팜칼륨'): 0.30, ('수크랄로스', '아세설팜칼륨'): 0.15, ('아스파탐', '사카린'): 0.15,
+    ('사카린', '시클라메이트'): 0.25, ('스테비아', '에리스리톨'): 0.10, ('레바우디오사이드M', '에리스리톨'): 0.10,
+    ('스테비아', '나한과'): 0.05,
+}
+SWEET_CLASSES = list(dict.fromkeys(g for g, _ in SWEETENER_CURVES.values()))
+_SWEET_IDX = {g: i for i, g in enumerate(SWEET_CLASSES)}
+_SWEET_RMAX = np.array([np.nan if r is None else r
+                        for r in dict((g, r) for g, r in SWEETENER_CURVES.values()).values()])
+_SWEET_GAMMA = np.zeros((len(SWEET_CLASSES), len(SWEET_CLASSES)))
+for (_a, _b), _g in SWEET_SYNERGY.items():
+    _SWEET_GAMMA[_SWEET_IDX[_a], _SWEET_IDX[_b]] = _g
+
+
+def sweetener_class(names):
+    """원료명 → 곡선군 번호 배열 (곡선 없는 원료는 -1 → 선형 합산)"""
+    cache = {}
+    out = np.empty(len(names), dtype=np.int64)
+    for i, nm in enumerate(names):
+        nm = str(nm)
+        if nm not in cache:
+            g = KEYWORDS.first(nm, 'sweetener')
+            cache[nm] = _SWEET_IDX[SWEETENER_CURVES[g][0]] if g else -1
+        out[i] = cache[nm]
+    return out
+
+
+def sweetness_se(U):
+    """곡선군별 선형 감미 합 U (N × (SWEET_CLASSES + 1, 마지막 열 = 곡선 없는 원료)) → 설탕환산 감미(%) 배열"""
+    U = np.atleast_2d(np.asarray(U, dtype=float))
+    u = np.maximum(U[:, :-1], 0)
+    f = np.where(np.isnan(_SWEET_RMAX), u, _SWEET_RMAX * u / (_SWEET_RMAX - SWEET_SE_REF + u))
+    root = np.sqrt(f)
+    return f.sum(1) + U[:, -1] + ((root @ _SWEET_GAMMA) * root).sum(1)
+
+
+def _sweet_vector(names, sweet):
+    """행별 (원료명, 선형 감미 u) → 곡선군별 합 벡터 (SWEET_CLASSES + 1)"""
+    cls = sweetener_class(names)
+    return np.bincount(np.where(cls < 0, len(SWEET_CLASSES), cls), weights=np.asarray(sweet, dtype=float),
+                       minlength=len(SWEET_CLASSES) + 1)
+
+
+def formulation_sweetness(slots):
+    """슬롯 배합의 비선형 감미 (설탕환산 %) — 슬롯 감미기여(반올림값) 기준"""
+    used = [s for s in slots if safe_float(s.get('배합비(%)', 0)) > 0]
+    U = _sweet_vector([s.get('원료명', '') for s in used], [safe_float(s.get('감미기여', 0)) * 100 for s in used])
+    return float(sweetness_se(U)[0])
+
+
+def calc_formulation(slots, volume_ml=500, ph_model='linear', sweet_model='linear', price_date=None, price_book=None):
+    # 정제수 보정(slots[19] 갱신)은 캐시 적중 여부와 무관하게 항상 수행
+    # price_date: 원가를 그날 유효한 단가 이력으로 계산 (price_book 생략 시 default_price_book). 슬롯 단가는 그대로
     ing_pct = sum(safe_float(s.get('배합비(%)', 0)) for s in slots[:19])
     water_pct = round(max(0, 100 - ing_pct), 3)
-
     slots[19]['원료명'] = '정제수'
     slots[19]['배합비(%)'] = water_pct
     slots[19]['배합량(g/kg)'] = round(water_pct * 10, 1)
 
+    if ph_model not in PH_MODELS:
+        raise ValueError(f"ph_model은 {PH_MODELS} 중 하나: {ph_model!r}")
+    if sweet_model not in SWEET_MODELS:
+        raise ValueError(f"sweet_model은 {SWEET_MODELS} 중 하나: {sweet_model!r}")
+    key = ('calc', slot_key(slots, volume_ml), ph_model, sweet_model)
+    if ph_model == 'equilibrium':     # 직접입력 원료의 pH·산도도 결과에 영향
+        key += (tuple((s.get('pH'), s.get('산도(%)')) for s in slots if safe_float(s.get('배합비(%)', 0)) > 0),)
+    if price_date is not None:
+        book = price_book if price_book is not None else default_price_book()
+        version = int(price_version(book, price_date))
+        key += ('price', book['version'], version)    # 같은 버전 안의 날짜는 결과 공유
+    hit = _MEMO.get(key)
+    if hit is not None:
+        return hit
+
+    total_brix = sum(safe_float(s.get('당기여', 0)) for s in slots)
+    total_acid = sum(safe_float(s.get('산기여', 0)) for s in slots)
+    total_sweet = sum(safe_float(s.get('감미기여', 0)) for s in slots)
+    total_dph = sum(safe_float(s.get('1%pH영향', 0)) * safe_float(s.get('배합비(%)', 0)) for s in slots)
+    if price_date is None:
+        total_cost_kg = sum(safe_float(s.get('단가기여(원/kg)', 0)) for s in slots)
+    else:
+        total_cost_kg = sum(slot_costs_asof(slots, book, version)[0].tolist())
+
     juice_pct = 0
     for s in slots[:4]:
         p = safe_float(s.get('배합비(%)', 0))
@@ -116,19 +589,127 @@ def calc_formulation(slots, volume_ml=500):
             bx = safe_float(s.get('Brix(°)', 0))
             juice_pct += p * (bx / 11.5 if bx >= 40 else 1)
 
-    return {
+    return _MEMO.put(key, {
         '배합비합계(%)': round(ing_pct + water_pct, 3),
         '예상당도(Bx)': round(total_brix, 2),
-        '예상pH': round(3.5 + total_dph, 2),
+        '예상pH': round(3.5 + total_dph if ph_model == 'linear' else formulation_ph(slots), 2),
         '예상산도(%)': round(total_acid, 4),
-        '예상감미도': round(total_sweet, 4),
+        '예상감미도': round(total_sweet if sweet_model == 'linear' else formulation_sweetness(slots) / 100, 4),
         '당산비': round(total_brix / total_acid, 1) if total_acid > 0 else 0,
         '원재료비(원/kg)': round(total_cost_kg, 1),
         '원재료비(원/병)': round(total_cost_kg * volume_ml / 1000, 1),
         '원료종류(개)': sum(1 for s in slots[:19] if safe_float(s.get('배합비(%)', 0)) > 0),
         '정제수비율(%)': round(water_pct, 1),
         '과즙함량(%)': round(juice_pct, 1),
-    }
+    })
+
+
+def fit_sweetener_curve(u, se):
+    """관능 패널 결과로 Rmax 보정 — u: 선형 감미(감미도×배합비, %), se: 패널 설탕환산 감미(%)
+    SE·(Rmax − SE_REF + u) = Rmax·u 를 Rmax에 대해 정리한 선형 최소제곱 (닫힌 해)"""
+    u, se = np.asarray(u, dtype=float), np.asarray(se, dtype=float)
+    a, b = u - se, se * (u - SWEET_SE_REF)
+    return float((a @ b) / (a @ a)) if (a @ a) > 0 else float('inf')
+
+
+# ── 당류 대체 탐색 (제로슈거): 당류 제거 후 같은 비선형 감미를 내는 감미료 단일·2종 블렌드 ──
+ZERO_SUGAR_EXCLUDE = ('둘신', '시클라메이트', '미라쿨린')   # 국내 미허용 / 맛 변형 물질
+
+
+def _sugar_rows(slots, df_ing):
+    """제거 대상 당류 슬롯 번호 — 원료DB 대분류 '당류' 중 Brix > 0"""
+    index = _ing_index(df_ing)[0]
+    out = []
+    for i, s in enumerate(slots[:19]):
+        r = index.get(str(s.get('원료명', '')))
+        if safe_float(s.get('배합비(%)', 0)) > 0 and r is not None \
+                and r.get('원료대분류') == '당류' and safe_float(s.get('Brix(°)', 0)) > 0:
+            out.append(i)
+    return out
+
+
+def zero_sugar_search(slots, df_ing, top=20, ratios=(0.25, 0.5, 0.75), max_bulk_pct=8.0, tol=0.02):
+    """당류를 빼고 원래 배합의 비선형 감미(beidler)를 맞추는 감미료 조합 — 후보 전체를 벡터 이분법으로 한 번에 풂
+    블렌드 비율(ratios)은 선형 감미 기준 원료1 몫. 당알코올 등 벌크 감미료(감미도 < 5)는 합계 max_bulk_pct% 이하
+    배합비는 소수 4자리로 반올림 — 반올림 후 감미가 목표 ±tol(상대) 밖이면 불가"""
+    cols = ['조합', '원료1', '배합비1(%)', '원료2', '배합비2(%)', '감미(SE%)', '목표(SE%)',
+            '원가변화(원/kg)', '당도변화(Bx)', '가능']
+    sugar = _sugar_rows(slots, df_ing)
+    target = formulation_sweetness(slots)
+    rest = [s for i, s in enumerate(slots) if i not in sugar and safe_float(s.get('배합비(%)', 0)) > 0]
+    u_rest = _sweet_vector([s.get('원료명', '') for s in rest], [safe_float(s.get('감미기여', 0)) * 100 for s in rest])
+    cand = df_ing[(df_ing['Brix(°)'].fillna(0) == 0) & (df_ing['감미도(설탕대비)'].fillna(0) > 0)
+                  & ~df_ing['원료명'].astype(str).str.contains('|'.join(ZERO_SUGAR_EXCLUDE))]
+    cand = cand.drop_duplicates('원료명')
+    if not sugar or target <= 0 or cand.empty:
+        return pd.DataFrame(columns=cols)
+
+    names = cand['원료명'].astype(str).to_numpy()
+    potency = cand['1%사용시 감미기여'].fillna(0).to_numpy(dtype=float) * 100     # 1% 사용 시 선형 감미(%)
+    price = cand['예상단가(원/kg)'].fillna(0).to_numpy(dtype=float)
+    bulk = cand['감미도(설탕대비)'].to_numpy(dtype=float) < 5
+    keep = potency > 0
+    names, potency, price, bulk = names[keep], potency[keep], price[keep], bulk[keep]
+    k = len(SWEET_CLASSES) + 1
+    cls = sweetener_class(names)
+    onehot = np.eye(k)[np.where(cls < 0, k - 1, cls)]
+
+    # 블렌드 목록: 단일 (a, a, 1) + 2종 (a, b, r)
+    m = len(names)
+    ia, ib = np.triu_indices(m, 1)
+    r = np.asarray(ratios, dtype=float)
+    A = np.concatenate([np.arange(m), np.repeat(ia, len(r))])
+    B = np.concatenate([np.arange(m), np.repeat(ib, len(r))])
+    R = np.concatenate([np.ones(m), np.tile(r, len(ia))])
+    share = R[:, None] * onehot[A] + (1 - R)[:, None] * onehot[B]      # 선형 감미 1%당 곡선군 배분
+
+    def se(t):
+        return sweetness_se(u_rest + t[:, None] * share)
+
+    lo, hi = np.zeros(len(A)), np.full(len(A), 100.0)
+    ok = se(hi) >= target - 1e-6
+    for _ in range(50):
+        mid = (lo + hi) / 2
+        up = se(mid) >= target
+        hi = np.where(up, mid, hi)
+        lo = np.where(up, lo, mid)
+    t = np.where(ok, hi, 100.0)
+    pa = np.round(R * t / potency[A], 4)
+    pb = np.where(A != B, np.round((1 - R) * t / potency[B], 4), 0.0)
+    got = sweetness_se(u_rest + pa[:, None] * potency[A, None] * onehot[A] + pb[:, None] * potency[B, None] * onehot[B])
+    bulk_pct = np.where(bulk[A], pa, 0) + np.where(bulk[B], pb, 0)
+    ing_pct = sum(safe_float(s.get('배합비(%)', 0)) for i, s in enumerate(slots[:19]) if i not in sugar)
+    ok &= (np.abs(got - target) <= tol * target) & (bulk_pct <= max_bulk_pct) & (ing_pct + pa + pb <= 100)
+
+    removed_cost = sum(safe_float(slots[i].get('단가기여(원/kg)', 0)) for i in sugar)
+    removed_brix = sum(safe_float(slots[i].get('당기여', 0)) for i in sugar)
+    label = [a if a_ == b_ else f"{a} {r_:.0%} + {names[b_]}" for a, a_, b_, r_ in zip(names[A], A, B, R)]
+    out = pd.DataFrame({
+        '조합': label, '원료1': names[A], '배합비1(%)': pa,
+        '원료2': np.where(A == B, '', names[B]), '배합비2(%)': pb,
+        '감미(SE%)': np.round(got, 2), '목표(SE%)': round(target, 2),
+        '원가변화(원/kg)': np.round(price[A] * pa / 100 + np.where(A != B, price[B] * pb / 100, 0) - removed_cost, 1),
+        '당도변화(Bx)': round(-removed_brix, 2), '가능': ok,
+    })
+    return out.sort_values(['가능', '원가변화(원/kg)'], ascending=[False, True]).head(top).reset_index(drop=True)
+
+
+def apply_sweetener_blend(slots, row, df_ing, ph_col):
+    """zero_sugar_search 결과 1행을 배합에 적용 — 당류 슬롯 비우고 감미료는 빈 당류/감미료 슬롯(없으면 빈 슬롯)에"""
+    sugar = _sugar_rows(slots, df_ing)
+    for i in sugar:
+        slots[i] = EMPTY_SLOT.copy()
+    group = [i - 1 for i in dict(SLOT_GROUPS)['당류/감미료']]
+    free = [i for i in group + list(range(19)) if not str(slots[i].get('원료명', '')).strip()]
+    free = list(dict.fromkeys(free))
+    for name, pct in ((row['원료1'], row['배합비1(%)']), (row['원료2'], row['배합비2(%)'])):
+        if not name or pct <= 0 or not free:
+            continue
+        i = free.pop(0)
+        fill_slot_from_db(slots[i], name, df_ing, ph_col)
+        slots[i]['배합비(%)'] = float(pct)
+        calc_slot_contributions(slots[i])
+    return slots
 
 
 # ============================================================
@@ -145,6 +726,11 @@ def get_spec(df_spec, bev_type):
 def check_compliance(result, spec):
     if not spec:
         return {}
+    key = ('comp', result['예상당도(Bx)'], result['예상산도(%)'], result['정제수비율(%)'],
+           *spec.items())   # 판정에 쓰이는 값만
+    hit = _MEMO.get(key)
+    if hit is not None:
+        return hit
     checks = {}
     bx = result['예상당도(Bx)']
     bmin, bmax = spec.get('Brix_min', 0), spec.get('Brix_max', 99)
@@ -168,7 +754,7 @@ def check_compliance(result, spec):
     phmin, phmax = spec.get('pH_min', 0), spec.get('pH_max', 0)
     if phmin > 0:
         checks['pH'] = (f'ℹ️ pH규격: {phmin}~{phmax} → 실측 필요', None)
-    return checks
+    return _MEMO.put(key, checks)
 
 
 # ============================================================
@@ -243,8 +829,112 @@ ALLERGEN_KEYWORDS = {
 }
 
 
-def generate_food_label(slots, product_name="", volume_ml=500, bev_type=""):
-    """식품등의 표시기준에 따른 전체 표시사항 생성"""
+# ── 영양성분 행렬: 원료 × 영양성분 (100 g당). 배합 1건 = 행렬-벡터 곱 1회 ──
+_NUT = {n: k for k, (n, _, _, _) in enumerate(NUTRIENT_SPEC)}
+
+
+def brix_nutrients(brix):
+    """영양성분표에 없는 원료의 추정치: 당류 = 탄수화물 = Brix(g/100g), 열량 4 kcal/g"""
+    brix = np.maximum(np.asarray(brix, dtype=float), 0)
+    out = np.zeros((len(brix), len(NUTRIENT_SPEC)))
+    out[:, _NUT['탄수화물']] = out[:, _NUT['당류']] = brix
+    out[:, _NUT['열량']] = brix * 4
+    return out
+
+
+def build_nutrient_matrix(df_ing, df_nut=None):
+    """원료DB + 영양성분표 → {'names', 'index'(원료명 → 행), 'M'(원료 × NUTRIENT_COLS), 'measured', 'version'}.
+    행 = 원료DB 원료 + 영양성분표에만 있는 원료. 표의 열량이 비면 4/4/9 kcal/g로 계산"""
+    names = df_ing['원료명'].astype(str).str.strip().tolist()
+    brix = pd.to_numeric(df_ing['Brix(°)'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    if df_nut is None or df_nut.empty:
+        df_nut = pd.DataFrame(columns=['원료명'] + NUTRIENT_COLS)
+    df_nut = df_nut.dropna(subset=['원료명']).drop_duplicates('원료명')
+    index = {}
+    for i, n in enumerate(names):
+        index.setdefault(n, i)
+    extra = [n for n in df_nut['원료명'] if n not in index]
+    for n in extra:
+        index[n] = len(names)
+        names.append(n)
+    M = brix_nutrients(np.concatenate([brix, np.zeros(len(extra))]))
+    measured = np.zeros(len(names), dtype=bool)
+    if len(df_nut):
+        v = df_nut[NUTRIENT_COLS].to_numpy(dtype=float)
+        atwater = 4 * v[:, _NUT['탄수화물']] + 4 * v[:, _NUT['단백질']] + 9 * v[:, _NUT['지방']]
+        v[:, _NUT['열량']] = np.where(np.isnan(v[:, _NUT['열량']]), np.nan_to_num(atwater), v[:, _NUT['열량']])
+        rows = [index[n] for n in df_nut['원료명']]
+        M[rows] = np.nan_to_num(v)
+        measured[rows] = True
+    h = hashlib.blake2b(M.tobytes(), digest_size=16)
+    h.update('\0'.join(names).encode('utf-8'))
+    return {'names': names, 'index': index, 'M': M, 'measured': measured, 'version': h.hexdigest()}
+
+
+def nutrient_rows(nutrients, names, brix):
+    """원료명별 영양성분 행 (len × NUTRIENT_COLS). 행렬에 없는 원료(직접입력 등)는 Brix 추정"""
+    out = brix_nutrients(brix)
+    if nutrients is not None and len(out):
+        index = nutrients['index']
+        idx = np.fromiter((index.get(str(n).strip(), -1) for n in names), dtype=np.int64, count=len(out))
+        hit = idx >= 0
+        out[hit] = nutrients['M'][idx[hit]]
+    return out
+
+
+def _nearest(x, unit):
+    # 표시 단위 반올림 (사사오입) — 부동소수 오차로 …5 경계가 내려가지 않게 보정
+    return np.floor(x / unit + 0.5 + 1e-9) * unit
+
+
+_RULE = np.array([r for _, _, _, r in NUTRIENT_SPEC])
+_UNIT = np.array([u for _, u, _, _ in NUTRIENT_SPEC])
+_FATLIKE = np.isin(_RULE, ['fat', 'trans'])
+_FAT_LOW = np.where(_RULE == 'trans', 0.2, 0.5)       # 이 값 미만은 '0' 표시
+
+
+def label_nutrition(values):
+    """1회 제공량당 함량 (n × NUTRIENT_COLS) → (표시값, 표시문자열) 배열. 식품등의 표시기준 단위·반올림:
+    열량 5kcal 단위(5 미만 0) / 나트륨 120mg 이하 5mg·초과 10mg 단위(5 미만 0) /
+    탄수화물·당류·단백질 1g 단위(0.5 미만 0, 1 미만 '1g 미만') / 지방·포화지방 5g 이하 0.1g·초과 1g 단위(0.5 미만 0) /
+    트랜스지방 0.2 미만 0, 0.5 미만 '0.5g 미만' / 콜레스테롤 5mg 단위(2 미만 0, 5 미만 '5mg 미만').
+    '미만' 표시 항목의 표시값은 실제 함량 (기준치 % 계산용). 비타민·무기질(임의표시)은 0.1 단위"""
+    v = np.maximum(np.atleast_2d(np.asarray(values, dtype=float)), 0)
+    n1, n5, n01 = _nearest(v, 1), _nearest(v, 5), _nearest(v, 0.1)
+    fat = np.where(v <= 5, n01, n1)
+    shown = np.select(
+        [_RULE == 'kcal', _RULE == 'sodium', _RULE == 'g1', _FATLIKE, _RULE == 'chol'],
+        [np.where(v < 5, 0, n5),
+         np.where(v < 5, 0, np.where(v <= 120, n5, _nearest(v, 10))),
+         np.where(v < 0.5, 0, np.where(v < 1, v, n1)),
+         np.where(v < _FAT_LOW, 0, np.where(v < 0.5, v, fat)),
+         np.where(v < 2, 0, np.where(v < 5, v, n5))],
+        n01)
+    s1 = np.char.mod('%.1f', shown)
+    num = np.select([_RULE == 'vit', _FATLIKE & (v <= 5)],
+                    [np.char.rstrip(np.char.rstrip(s1, '0'), '.'), s1], np.char.mod('%.0f', shown))
+    text = np.char.add(num, _UNIT)
+    text = np.where((_RULE == 'g1') & (v >= 0.5) & (v < 1), '1g 미만', text)
+    text = np.where(_FATLIKE & (v >= _FAT_LOW) & (v < 0.5), '0.5g 미만', text)
+    text = np.where((_RULE == 'chol') & (v >= 2) & (v < 5), '5mg 미만', text)
+    text = np.where(shown == 0, np.char.add('0', _UNIT), text)
+    return shown, text.astype(object)
+
+
+def daily_value_pct(shown):
+    """표시값 → 1일 영양성분 기준치 대비(%) 정수 배열 (기준치 없는 항목은 NaN)"""
+    dv = np.array([d if d else np.nan for _, _, d, _ in NUTRIENT_SPEC])
+    return _nearest(np.atleast_2d(shown) / dv * 100, 1)
+
+
+def generate_food_label(slots, product_name="", volume_ml=500, bev_type="", nutrients=None):
+    """식품등의 표시기준에 따른 전체 표시사항 생성.
+    nutrients: build_nutrient_matrix 결과 (None이면 전 원료를 Brix로 추정)"""
+    key = ('label', slot_key(slots, product_name, volume_ml, bev_type),
+           nutrients['version'] if nutrients is not None else None)
+    hit = _MEMO.get(key)
+    if hit is not None:
+        return hit
     active = [(s['원료명'], s['배합비(%)']) for s in slots
               if safe_float(s.get('배합비(%)', 0)) > 0 and s.get('원료명')]
     active.sort(key=lambda x: x[1], reverse=True)
@@ -254,43 +944,33 @@ def generate_food_label(slots, product_name="", volume_ml=500, bev_type=""):
     under_2 = [(n, p) for n, p in active if p < 2]
 
     # 2. 알레르기 유발물질 검출
-    detected_allergens = []
     all_names = ' '.join([n for n, _ in active]).lower()
-    for allergen, keywords in ALLERGEN_KEYWORDS.items():
-        for kw in keywords:
-            if kw in all_names:
-                detected_allergens.append(allergen)
-                break
-
-    # 3. 영양성분 (1회 제공량 + 100ml 기준, 9종 의무표시)
-    total_sugar_g = 0
-    for s in slots:
-        p = safe_float(s.get('배합비(%)', 0))
-        bx = safe_float(s.get('Brix(°)', 0))
-        if p > 0 and bx > 0:
-            total_sugar_g += bx * p / 100 / 100 * 1000
-    cal = total_sugar_g * 4
+    detected_allergens = KEYWORDS.matches(all_names, 'allergen')
+
+    # 3. 영양성분 (1회 제공량 + 100ml 기준, 9종 의무표시) — 배합비 벡터 × 원료 영양성분 행렬
+    used = [s for s in slots if safe_float(s.get('배합비(%)', 0)) > 0]
+    pct = np.array([safe_float(s.get('배합비(%)', 0)) for s in used])
+    rows = nutrient_rows(nutrients, [s.get('원료명', '') for s in used],
+                         [safe_float(s.get('Brix(°)', 0)) for s in used])
+    per100 = pct / 100 @ rows                 # 제품 100 g(≈100 ml)당
     serving = volume_ml  # 1회 제공량 = 총용량
-
-    nutrition = {
-        '1회 제공량': f'{serving}ml',
-        '열량': f'{cal/10*serving/100:.0f}kcal',
-        '탄수화물': f'{total_sugar_g/10*serving/100:.1f}g',
-        '당류': f'{total_sugar_g/10*serving/100:.1f}g',
-        '단백질': '0g',
-        '지방': '0g',
-        '포화지방': '0g',
-        '트랜스지방': '0g',
-        '콜레스테롤': '0mg',
-        '나트륨': '5mg',  # 추정
-    }
+    shown, text = label_nutrition(per100 * serving / 100)
+    dv = daily_value_pct(shown)[0]
+
+    nutrition = {'1회 제공량': f'{serving}ml'}
+    daily = {}
+    for k, (nm, _, d, _) in enumerate(NUTRIENT_SPEC):
+        if k < NUTRIENT_MANDATORY or shown[0, k] > 0:     # 비타민·무기질은 함유 시에만
+            nutrition[nm] = text[0, k]
+            if d:
+                daily[nm] = f'{dv[k]:.0f}%'
     nutrition_100ml = {
-        '열량(100ml)': f'{cal/10:.1f}kcal',
-        '당류(100ml)': f'{total_sugar_g/10:.1f}g',
+        '열량(100ml)': f"{per100[_NUT['열량']]:.1f}kcal",
+        '당류(100ml)': f"{per100[_NUT['당류']]:.1f}g",
     }
 
     # 4. 기타 표시사항
-    return {
+    return _MEMO.put(key, {
         '① 제품명': product_name,
         '② 식품유형': bev_type,
         '③ 업소명 및 소재지': '(제조사 정보 기입)',
@@ -301,18 +981,23 @@ def generate_food_label(slots, product_name="", volume_ml=500, bev_type=""):
         '⑥-2 2%미만 원재료': ', '.join([n for n, _ in under_2]) if under_2 else '해당없음',
         '⑦ 영양성분': nutrition,
         '⑦-1 100ml기준': nutrition_100ml,
+        '⑦-2 1일 영양성분 기준치 대비': daily,
         '⑧ 알레르기 유발물질': ', '.join(detected_allergens) + ' 함유' if detected_allergens else '해당없음',
         '⑨ 보관방법': '직사광선을 피해 상온보관',
         '⑩ 주의사항': '개봉 후 냉장보관하고 빠른 시일 내 드시기 바랍니다.',
         '⑪ 품목보고번호': '(식약처 품목제조보고 후 기입)',
         '⑫ 반품/교환': '공정거래위원회 고시 소비자분쟁해결기준에 의거 교환 또는 보상',
-    }
+    })
 
 
 # ============================================================
-# 6. 시작레시피
+# 6. 시작레시피 · 생산 배치 지시서
 # ============================================================
 def generate_lab_recipe(slots, scales=[1, 5, 20]):
+    key = ('recipe', slot_key(slots, tuple(scales)))
+    hit = _MEMO.get(key)
+    if hit is not None:
+        return hit
     recipes = {}
     for sc in scales:
         total = sc * 1000
@@ -323,7 +1008,225 @@ def generate_lab_recipe(slots, scales=[1, 5, 20]):
                 continue
             items.append({'원료명': s['원료명'], '배합비(%)': p, f'칭량({sc}L)_g': round(p / 100 * total, 2)})
         recipes[f'{sc}L'] = items
-    return recipes
+    return _MEMO.put(key, recipes)
+
+
+# ── 생산 배치 지시서 (5,000~30,000 L 배치 · 탱크 분할 · 원액/프리믹스 · 투입 순서) ──
+BRIX_DENSITY = np.array([       # (Brix, 20℃ 밀도 kg/L) 자당 수용액 — 사이는 선형보간
+    (0, 0.9982), (5, 1.0179), (10, 1.0381), (15, 1.0591), (20, 1.0810), (25, 1.1034), (30, 1.1270),
+    (35, 1.1515), (40, 1.1766), (45, 1.2025), (50, 1.2296), (55, 1.2575), (60, 1.2865), (65, 1.3163),
+    (70, 1.3472), (75, 1.3790), (80, 1.4117)])
+BATCH_SIZES_L = (5_000, 10_000, 30_000)
+TANK_CAPACITY_L = 10_000
+BATCH_STEP_CATEGORY = {         # 원료대분류 → 투입 단계 (EDUCATION_STEPS 키). 나머지는 5단계
+    '과즙농축액': '1단계_원재료', '유제품원료': '1단계_원재료', '추출물': '1단계_원재료', '기타원료': '1단계_원재료',
+    '당류': '2단계_당류', '감미료': '2단계_당류', '산미료': '3단계_산미료', '안정제/증점제': '4단계_안정제',
+}
+_SLOT_STEP = ['1단계_원재료'] * 4 + ['2단계_당류'] * 4 + ['4단계_안정제'] * 4 + ['5단계_기타'] * 7   # 직접입력 원료: 슬롯 그룹
+STOCK_SOLUTIONS = {             # 분말 산미료 키워드 → 원액 농도(% w/w, 20℃ 용해도 이하). None = 난용성 → 분산 직투입. 표 순서 = 매칭 우선순위 (염 먼저)
+    '구연산삼나트륨': 30.0, '구연산나트륨': 30.0, '구연산삼칼륨': 40.0, '인산나트륨': 10.0,
+    '탄산수소나트륨': 8.0, '탄산칼슘': None, '푸마르산': None, '아디프산': None, '호박산': None,
+    '아스코르빈산': 20.0, '에리소르빈산': 20.0, '주석산': 50.0, '사과산': 50.0, '구연산': 50.0,
+}
+STOCK_DEFAULT_PCT = 25.0        # 표에 없는 분말 산미료
+SWEETENER_STOCK_PCT = 10.0      # 고감미료(배합비 SWEETENER_STOCK_MAX 이하 분말) 원액
+SWEETENER_STOCK_MAX = 0.1
+PREMIX_CARRIER_RATIO = 5.0      # 안정제 1 : 분말 당류 5 건식 혼합 (뭉침 방지)
+TOPUP_WATER_RATIO = 0.1         # 정제수 중 마지막 정량 보정분
+
+
+def brix_density(brix):
+    """Brix → 20℃ 밀도(kg/L). 배열 가능"""
+    return np.interp(brix, BRIX_DENSITY[:, 0], BRIX_DENSITY[:, 1])
+
+
+def _component_rows(slots, df_ing):
+    """batch_components의 행 dict 목록 (투입 순서대로) — 여러 SKU를 DataFrame 한 번으로 모으기 위해 분리"""
+    index = _ing_index(df_ing)[0]
+    rows, carrier = [], None
+    for k, s in enumerate(slots[:19]):
+        p = safe_float(s.get('배합비(%)', 0))
+        if p <= 0 or not s.get('원료명'):
+            continue
+        name = str(s['원료명'])
+        rec = None if s.get('is_custom') else index.get(name)
+        cat = str(rec.get('원료대분류', '')) if rec else ''
+        step = BATCH_STEP_CATEGORY.get(cat, '5단계_기타') if rec else _SLOT_STEP[k]
+        form = str(rec.get('공급형태', '') or '') if rec else ''
+        powder, liquid = form.startswith('분말'), form.startswith(('액상', '퓨레', '페이스트'))
+        row = {'단계': step, '슬롯': k, '원료명': name, '투입방식': '직투입', '배합비(%)': p,
+               '원료량': p / 100, '용해수': 0.0, '투입량': p / 100, '농도(%)': np.nan,
+               '밀도(kg/L)': brix_density(safe_float(s.get('Brix(°)', 0))) if liquid else np.nan, '비고': ''}
+        conc = 0
+        if '가스' in form:
+            row.update(투입방식='충전공정', 비고='카보네이션/충전 시 주입')
+        elif step == '3단계_산미료' and powder:
+            kw = KEYWORDS.first(name, 'stock')
+            conc = STOCK_SOLUTIONS[kw] if kw else STOCK_DEFAULT_PCT
+            if conc is None:
+                row.update(투입방식='분산투입', 비고='난용성 — 교반 중 분산')
+        elif cat == '감미료' and powder and p <= SWEETENER_STOCK_MAX:
+            conc = SWEETENER_STOCK_PCT
+        if conc:
+            w = row['원료량'] * (100 / conc - 1)
+            row.update({'투입방식': '원액', '용해수': w, '투입량': row['원료량'] + w, '농도(%)': conc})
+        if cat == '당류' and powder and carrier is None:
+            carrier = row
+        rows.append(row)
+    for row in rows:                                  # 안정제 → 분말 당류와 건식 프리믹스
+        if row['단계'] != '4단계_안정제' or row['투입방식'] != '직투입' or not np.isnan(row['밀도(kg/L)']):
+            continue
+        if carrier is None or carrier['투입량'] <= 0:
+            row.update(투입방식='분산투입', 비고='분말 당류 없음 — 고속 교반 중 천천히 분산')
+            continue
+        take = min(row['원료량'] * PREMIX_CARRIER_RATIO, carrier['투입량'])
+        carrier['투입량'] -= take
+        carrier['비고'] = '일부 안정제 프리믹스용'
+        row.update(투입방식='프리믹스', 투입량=row['투입량'] + take,
+                   비고=f"{carrier['원료명']} {take / row['원료량']:.1f}배와 건식 혼합")
+    water = round(max(0, 100 - sum(safe_float(s.get('배합비(%)', 0)) for s in slots[:19])), 3) / 100   # calc_formulation과 같은 정제수
+    stock_water = sum(r['용해수'] for r in rows)
+    topup = min(TOPUP_WATER_RATIO * water, max(water - stock_water, 0.0))
+    first = water - stock_water - topup
+    base = {'투입방식': '직투입', '용해수': 0.0, '농도(%)': np.nan, '밀도(kg/L)': brix_density(0), '비고': ''}
+    rows.insert(0, {**base, '단계': '0단계_정제수', '슬롯': 19, '원료명': '정제수(초기)', '배합비(%)': water * 100,
+                    '원료량': water, '투입량': max(first, 0.0),
+                    '비고': '원액 용해수 포함 정제수 초과 — 원액 농도 상향 필요' if first < 0 else '원액 용해수·정량 보정분 제외'})
+    rows.append({**base, '단계': '6단계_정량', '슬롯': 19, '원료명': '정제수(정량보정)', '배합비(%)': 0.0,
+                 '원료량': 0.0, '투입량': topup, '비고': 'Brix·중량 확인 후 투입'})
+    return sorted(rows, key=lambda r: (_BATCH_ORDER[r['단계']], r['슬롯']))
+
+
+def batch_components(slots, df_ing):
+    """배합 → 제품 1 kg당 투입 항목표 (투입 순서대로, 탱크 크기와 무관한 계수).
+    원료량 = 배합 전체량, 투입량 = 그 순서에 실제 넣는 양 (원액은 용해수 포함, 프리믹스는 부형 당류 포함·당류 직투입분에서 차감).
+    원액 용해수는 정제수에서 빼므로 투입량 합계 = 1"""
+    cols = ['단계', '원료명', '투입방식', '배합비(%)', '원료량', '용해수', '투입량', '농도(%)', '밀도(kg/L)', '비고']
+    return pd.DataFrame(_component_rows(slots, df_ing), columns=cols).rename(
+        columns={'원료량': '원료량(kg/kg)', '용해수': '용해수(kg/kg)', '투입량': '투입량(kg/kg)'})
+
+
+def tank_plan(batches_l, tank_capacity_l=TANK_CAPACITY_L):
+    """배치량(L) 배열 → 탱크 분할 (탱크 수 = 올림(배치량/용량), 균등 분할). (배치 번호, 탱크 번호, 탱크 수, 탱크량 L)"""
+    b = np.asarray(batches_l, dtype=float)
+    n = np.maximum(np.ceil(b / tank_capacity_l), 1).astype(np.int64)
+    bi = np.repeat(np.arange(len(b)), n)
+    ti = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + 1
+    return bi, ti, n[bi], b[bi] / n[bi]
+
+
+def production_batches(skus, df_ing, tank_capacity_l=TANK_CAPACITY_L, batches_l=BATCH_SIZES_L):
+    """여러 SKU × 배치량 × 탱크 생산 지시 (한 번의 배열 연산으로 스케일링).
+    skus: [{'name', 'slots', 'batches'?(L 목록)}] → 행 = (SKU, 배치, 탱크, 투입 항목) DataFrame, 투입 순서대로"""
+    comp, cnt, names, brix, batches = [], [], [], [], []
+    for i, sku in enumerate(skus):
+        slots = [s.copy() for s in sku['slots']]
+        brix.append(calc_formulation(slots)['예상당도(Bx)'])     # 정제수 보정 포함
+        rows = _component_rows(slots, df_ing)
+        comp += rows
+        cnt.append(len(rows))
+        name = base = sku.get('name') or f'SKU{i + 1}'
+        while name in names:                        # 같은 이름이면 번호 붙임 (지시서·그룹이 섞이지 않도록)
+            name = f"{base}_{sum(n.startswith(base) for n in names) + 1}"
+        names.append(name)
+        batches.append(np.asarray(sku.get('batches') or batches_l, dtype=float))
+    if not comp:
+        return pd.DataFrame()
+    C = pd.DataFrame(comp)
+    nb = np.array([len(b) for b in batches])
+    bi, ti, nt, vol = tank_plan(np.concatenate(batches), tank_capacity_l)
+    owner = np.repeat(np.arange(len(skus)), nb)[bi]                  # 탱크 → SKU 번호
+    # 탱크 t × (그 SKU의 투입 항목 전체) — SKU별 항목 수가 달라 오프셋으로 펼침
+    cnt = np.array(cnt)
+    per = cnt[owner]
+    t_idx = np.repeat(np.arange(len(bi)), per)
+    pos = np.arange(per.sum()) - np.repeat(np.cumsum(per) - per, per)
+    c_idx = np.repeat((np.cumsum(cnt) - cnt)[owner], per) + pos
+    bx = np.array(brix)[owner]
+    rho = np.round(brix_density(bx), 4)
+    mass = (vol * rho)[t_idx]
+    col = lambda c: C[c].to_numpy()[c_idx]
+    out = pd.DataFrame({
+        'SKU': np.array(names, dtype=object)[owner][t_idx], '배치(L)': np.concatenate(batches)[bi][t_idx],
+        '탱크': ti[t_idx], '탱크수': nt[t_idx], '탱크량(L)': vol[t_idx], '제품Brix': bx[t_idx],
+        '밀도(kg/L)': rho[t_idx], '탱크중량(kg)': np.round(mass, 2), '순서': pos + 1,
+        '단계': col('단계'), '원료명': col('원료명'), '투입방식': col('투입방식'), '배합비(%)': col('배합비(%)'),
+        '원료량(kg)': np.round(mass * col('원료량'), 3), '용해수(kg)': np.round(mass * col('용해수'), 3),
+        '투입량(kg)': np.round(mass * col('투입량'), 3),
+    })
+    out['투입부피(L)'] = np.round(out['투입량(kg)'].to_numpy() / col('밀도(kg/L)'), 2)
+    out['농도(%)'], out['비고'] = col('농도(%)'), col('비고')
+    return out
+
+
+def _weigh(kg):
+    return f"{kg:,.2f} kg" if kg >= 1 else f"{kg * 1000:,.1f} g"
+
+
+def _batch_step_title(step):
+    info = EDUCATION_STEPS.get(step)
+    return f"{info['icon']} {info['title']}" if info else {'0단계_정제수': '💧 정제수 투입', '6단계_정량': '⚖️ 정량 보정'}[step]
+
+
+def render_batch_sheet(rows, today=None):
+    """production_batches 결과 중 한 SKU·배치량 행 → 칭량·투입순서 지시서 텍스트 (탱크는 균등 분할이라 1기 기준 + 배치 합계)"""
+    rows = rows[rows['탱크'] == 1]
+    r0 = rows.iloc[0]
+    n = int(r0['탱크수'])
+    lines = [
+        "=" * 78,
+        f"  생산 배치 지시서 — {r0['SKU']}",
+        f"  배치량: {r0['배치(L)']:,.0f} L (탱크 {n}기 × {r0['탱크량(L)']:,.0f} L)  |  "
+        f"제품 {r0['제품Brix']:.2f} °Bx · 밀도 {r0['밀도(kg/L)']:.4f} kg/L",
+        f"  작성일: {today or _today()}  |  탱크 1기 중량: {r0['탱크중량(kg)']:,.1f} kg",
+        "=" * 78]
+    prep = rows[rows['투입방식'].isin(['원액', '프리믹스'])]
+    if len(prep):
+        lines.append("\n■ 사전 조제 (탱크 1기당)")
+        lines.append(f"  {'원료명':<22} {'방식':<6} {'원료':>12} {'용해수/부형제':>14} {'조제량':>12}")
+        lines.append("  " + "-" * 72)
+        for _, r in prep.iterrows():
+            extra = r['투입량(kg)'] - r['원료량(kg)']
+            how = f"{r['투입방식']} {r['농도(%)']:.0f}%" if r['투입방식'] == '원액' else r['투입방식']
+            lines.append(f"  {r['원료명']:<22} {how:<6} {_weigh(r['원료량(kg)']):>12} {_weigh(extra):>14} "
+                         f"{_weigh(r['투입량(kg)']):>12}")
+    lines.append("\n■ 투입 순서 (탱크 1기당)")
+    lines.append(f"  {'No':<3} {'원료명':<22} {'방식':<6} {'투입량':>12} {'부피(L)':>10} {'배치합계':>14}  확인")
+    step = None
+    for _, r in rows.iterrows():
+        if r['단계'] != step:
+            step = r['단계']
+            lines.append(f"  {'─' * 72}\n  {_batch_step_title(step)}")
+        vol = f"{r['투입부피(L)']:,.1f}" if pd.notna(r['투입부피(L)']) else '-'
+        lines.append(f"  {r['순서']:<3} {r['원료명']:<22} {r['투입방식']:<6} {_weigh(r['투입량(kg)']):>12} {vol:>10} "
+                     f"{_weigh(r['투입량(kg)'] * n):>14}  □" + (f"  ※ {r['비고']}" if r['비고'] else ''))
+    lines.append(f"  {'─' * 72}\n  합계 {_weigh(rows['투입량(kg)'].sum())} (탱크 1기) · {_weigh(rows['투입량(kg)'].sum() * n)} (배치)")
+    lines.append("\n■ 단계별 주의사항")
+    for k in dict.fromkeys(rows['단계']):
+        if k in EDUCATION_STEPS:
+            lines.append(f"  {_batch_step_title(k)} — {EDUCATION_STEPS[k]['guide']}")
+            lines.append(f"      {EDUCATION_STEPS[k]['warning']}")
+    lines.extend(["", "=" * 78, "  칭량:________  투입:________  확인(QC):________  승인:________"])
+    return '\n'.join(lines)
+
+
+def iter_batch_sheets(df):
+    """production_batches 결과 → (파일명, 지시서 텍스트) SKU·배치량별로 하나씩"""
+    today = _today()
+    for (sku, b), rows in df.groupby(['SKU', '배치(L)'], sort=False):
+        yield f"{_zip_name(sku)}/배치지시서_{b:.0f}L.txt", render_batch_sheet(rows, today)
+
+
+def write_batch_sheet_zip(fileobj, df):
+    """지시서 전체 + 칭량표 CSV를 fileobj에 ZIP으로 기록. 지시서 수 반환"""
+    import zipfile
+    n = 0
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path, text in iter_batch_sheets(df):
+            zf.writestr(path, text.encode('utf-8'))
+            n += 1
+        zf.writestr('칭량표.csv', df.to_csv(index=False).encode('utf-8-sig'))
+    return n
 
 
 # ============================================================
@@ -393,19 +1296,21 @@ PERSONA_MARKETING_RD = """당신은 대형 음료회사 R&D센터 15년차 음
 ```
 한국어. 원재료(1-4), 당류(5-8), 안정제(9-12), 기타(13-19) 순서. 정제수 제외."""
 
+# 계측용 페르소나 이름 (llm_metrics)
+_PERSONA_NAMES = {
+    PERSONA_RESEARCHER: 'PERSONA_RESEARCHER', PERSONA_PLANNER: 'PERSONA_PLANNER',
+    PERSONA_PRODUCTION: 'PERSONA_PRODUCTION', PERSONA_QA: 'PERSONA_QA',
+    PERSONA_FORMULATOR: 'PERSONA_FORMULATOR', PERSONA_MARKETING_RD: 'PERSONA_MARKETING_RD',
+}
+
 
 def call_gpt_ingredient_info(api_key, ingredient_name):
     """[개선2] AI가 원료의 용도/특성을 한줄로 설명"""
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key)
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini", temperature=0.3, max_tokens=60,
-        messages=[
-            {"role": "system", "content": "식품원료 전문가. 원료의 음료에서의 사용용도와 특성을 15자 이내 한줄로만 답변."},
-            {"role": "user", "content": f"원료: {ingredient_name}"}
-        ],
-    )
-    return resp.choices[0].message.content.strip()[:20]
+    text = _chat_completion(api_key, [
+        {"role": "system", "content": "식품원료 전문가. 원료의 음료에서의 사용용도와 특성을 15자 이내 한줄로만 답변."},
+        {"role": "user", "content": f"원료: {ingredient_name}"}
+    ], model="gpt-4o-mini", temp=0.3, max_tok=60, persona='INGREDIENT_INFO')
+    return text.strip()[:20]
 
 
 def call_gpt_marketing_to_rd(api_key, concept_text, ing_sample=""):
@@ -462,26 +1367,48 @@ EDUCATION_STEPS = {
     },
 }
 
-# HACCP 공정별 아이콘 매핑
-HACCP_ICONS = {
-    '입고': '📦', '검수': '🔍', '저장': '🏪', '보관': '🏪',
-    '칭량': '⚖️', '배합': '🔬', '혼합': '🌀', '교반': '🌀',
-    '용해': '💧', '여과': '🔲', '탈기': '💨', '균질': '🔧',
-    '살균': '🔥', 'UHT': '🔥', '냉각': '❄️',
-    '충전': '🏭', '밀봉': '🔒', '검사': '🔎', '금속': '🧲',
-    '포장': '📦', '출하': '🚛', '라벨': '🏷️',
-    '발효': '🦠', '숙성': '⏳', '탄산': '🫧', '카보': '🫧',
-}
+# 생산 배치 지시서 투입 순서 (정제수 → 교육 5단계 → 정량 보정)
+_BATCH_ORDER = {k: i for i, k in enumerate(['0단계_정제수', *EDUCATION_STEPS, '6단계_정량'])}
 
 
-def call_gpt(api_key, system_prompt, user_content, model="gpt-4o", temp=0.7, max_tok=3000):
+def _openai_client(api_key, rec=None):
+    """rec가 있으면 응답 헤더 수신 훅으로 TTFB 기록"""
     from openai import OpenAI
-    client = OpenAI(api_key=api_key)
-    resp = client.chat.completions.create(
-        model=model, temperature=temp, max_tokens=max_tok,
-        messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_content}],
-    )
-    return resp.choices[0].message.content
+    if rec is not None:
+        try:
+            from openai import DefaultHttpxClient
+            return OpenAI(api_key=api_key,
+                          http_client=DefaultHttpxClient(event_hooks={'response': [rec.first_byte]}))
+        except ImportError:
+            pass
+    return OpenAI(api_key=api_key)
+
+
+def _chat_completion(api_key, messages, model="gpt-4o", temp=0.7, max_tok=3000, persona='custom'):
+    """OpenAI chat 호출 — llm_gateway 경유 (동시 동일요청 병합 + 공용 속도제한) + llm_metrics 계측"""
+    with llm_metrics.track('openai', model, persona) as rec:
+        def _do():
+            client = _openai_client(api_key, rec)
+            resp = client.chat.completions.create(
+                model=model, temperature=temp, max_tokens=max_tok, messages=messages)
+            u = getattr(resp, 'usage', None)
+            usage = (u.prompt_tokens, u.completion_tokens) if u else (0, 0)
+            return resp.choices[0].message.content, usage
+
+        prompt = ''.join(m.get('content', '') for m in messages)
+        (text, usage), shared = llm_gateway.call_shared(
+            'openai', (api_key, model, temp, max_tok, messages), _do,
+            tokens=llm_gateway.estimate_tokens(prompt, max_tok))
+        rec.cache = 'coalesced' if shared else 'miss'
+        if not shared:
+            rec.usage(*usage)
+        return text
+
+
+def call_gpt(api_key, system_prompt, user_content, model="gpt-4o", temp=0.7, max_tok=3000):
+    return _chat_completion(
+        api_key, [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_content}],
+        model=model, temp=temp, max_tok=max_tok, persona=_PERSONA_NAMES.get(system_prompt, 'custom'))
 
 
 def call_gpt_ai_formulation(api_key, bev_type, flavor, ing_names_sample=""):
@@ -525,16 +1452,10 @@ def call_gpt_estimate_ingredient(api_key, ingredient_name, category=""):
 JSON만 응답:
 {{"Brix": 0, "pH": 0, "산도_pct": 0, "감미도_설탕대비": 0, "예상단가_원kg": 0, "1pct_Brix기여": 0, "1pct_pH영향": 0, "1pct_산도기여": 0, "1pct_감미기여": 0}}"""
 
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key)
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini", temperature=0.3, max_tokens=300,
-        messages=[
-            {"role": "system", "content": "식품원료 이화학 데이터 전문가. JSON만 응답."},
-            {"role": "user", "content": prompt}
-        ],
-    )
-    text = resp.choices[0].message.content.strip()
+    text = _chat_completion(api_key, [
+        {"role": "system", "content": "식품원료 이화학 데이터 전문가. JSON만 응답."},
+        {"role": "user", "content": prompt}
+    ], model="gpt-4o-mini", temp=0.3, max_tok=300, persona='ESTIMATOR').strip()
     text = re.sub(r'```json\s*', '', text)
     text = re.sub(r'```', '', text)
     return json.loads(text)
@@ -543,7 +1464,7 @@ JSON만 응답:
 def apply_estimation_to_slot(slot, est):
     """AI 추정결과 dict → 슬롯에 자동반영"""
     mapping = [
-        ('Brix', '당도(Bx)'), ('Brix', 'Brix(°)'),
+        ('Brix', '당도(Bx)'), ('Brix', 'Brix(°)'), ('pH', 'pH'),
         ('산도_pct', '산도(%)'), ('감미도_설탕대비', '감미도'),
         ('감미도_설탕대비', '감미도(설탕대비)'), ('예상단가_원kg', '단가(원/kg)'),
         ('1pct_Brix기여', '1%Brix기여'), ('1pct_pH영향', '1%pH영향'),
@@ -557,6 +1478,41 @@ def apply_estimation_to_slot(slot, est):
     return slot
 
 
+def slots_from_formulation(items, df_ing, ph_col):
+    """[{"슬롯"?, "원료명", "배합비"|"배합비(%)", (이화학값…)}] → 20슬롯.
+    슬롯 번호가 있는 원료를 먼저 놓고, 없는 원료는 빈 슬롯에 앞에서부터 채움. DB에 없는 원료는 AI추정 키(Brix, 산도_pct …)로 이화학값 지정 가능.
+    슬롯 번호 중복·범위(1~19) 밖, 원료 19종 초과, 배합비가 숫자가 아니거나 음수면 ValueError (빈 값·0%는 건너뜀)"""
+    placed, auto = {}, []
+    for n, item in enumerate(items, 1):
+        nm = str(item.get('원료명', '')).strip()
+        raw = item.get('배합비', item.get('배합비(%)'))
+        pct = 0.0 if raw in (None, '') else safe_float(raw, None)
+        if pct is None or pct < 0 or not np.isfinite(pct):
+            raise ValueError(f"{n}번째 원료 배합비는 0 이상 숫자: {raw!r}")
+        if not nm or pct <= 0:
+            continue
+        no = item.get('슬롯')
+        if no in (None, ''):
+            auto.append((nm, pct, item))
+            continue
+        i = safe_float(no, None)
+        if i is None or i != int(i) or not 1 <= i <= 19:
+            raise ValueError(f"{n}번째 원료({nm}) 슬롯은 1~19 정수: {no!r}")
+        if int(i) in placed:
+            raise ValueError(f"슬롯 {int(i)} 중복: {placed[int(i)][0]}, {nm}")
+        placed[int(i)] = (nm, pct, item)
+    free = [i for i in range(1, 20) if i not in placed]
+    if len(auto) > len(free):
+        raise ValueError(f"원료는 최대 19종 (정제수 제외): {len(placed) + len(auto)}종")
+    placed.update(zip(free, auto))
+    slots = init_slots()
+    for i, (nm, pct, item) in placed.items():
+        s = fill_slot_from_db(EMPTY_SLOT.copy(), nm, df_ing, ph_col)
+        s['배합비(%)'] = pct
+        slots[i - 1] = apply_estimation_to_slot(s, item)
+    return slots
+
+
 def batch_estimate_slots(api_key, slots):
     """이화학=0인 is_custom 원료를 일괄 AI추정. 결과 리스트 반환."""
     results = []
@@ -577,26 +1533,132 @@ def batch_estimate_slots(api_key, slots):
     return slots, results
 
 
-def call_dalle(api_key, prompt):
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key)
-    resp = client.images.generate(model="dall-e-3", prompt=prompt, size="1024x1024", quality="standard", n=1)
-    return resp.data[0].url
+def call_dalle(api_key, prompt, size="1024x1024", quality="standard"):
+    """DALL-E 3 이미지 생성 — 임시 URL 반환 (보관은 image_store)"""
+    with llm_metrics.track('openai', 'dall-e-3', 'DALLE') as rec:
+        rec.image = (size, quality)
+
+        def _do():
+            client = _openai_client(api_key, rec)
+            resp = client.images.generate(model="dall-e-3", prompt=prompt, size=size, quality=quality, n=1)
+            return resp.data[0].url
+
+        url, shared = llm_gateway.call_shared('openai', (api_key, 'dall-e-3', prompt, size, quality), _do)
+        rec.cache = 'coalesced' if shared else 'miss'
+        return url
+
+
+# 오프라인 벤치마크 시 fake_llm_server 주소로 교체 (OpenAI SDK는 OPENAI_BASE_URL을 자동 인식)
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+
+
+def call_gemini_rest(api_key, contents, model="gemini-2.5-pro", api_ver="v1",
+                     max_tok=8192, temp=0.4, timeout=60, persona='GEMINI_AGENT'):
+    """Gemini generateContent REST 호출 (llm_gateway 경유 + llm_metrics 계측).
+    응답 텍스트 반환, 실패 시 RuntimeError"""
+    payload = {
+        "contents": contents,
+        "generationConfig": {"maxOutputTokens": max_tok, "temperature": temp},
+    }
+    with llm_metrics.track('gemini', model, persona) as rec:
+        def _do():
+            import requests as _req
+            url = f"{GEMINI_API_BASE}/{api_ver}/models/{model}:generateContent?key={api_key}"
+            resp = _req.post(url, headers={"Content-Type": "application/json"}, json=payload,
+                             timeout=timeout, hooks={'response': rec.first_byte})
+            if not resp.ok:
+                try:
+                    err = resp.json().get("error", {}).get("message", resp.text[:300])
+                except Exception:
+                    err = resp.text[:300]
+                raise RuntimeError(f"HTTP {resp.status_code}: {err}")
+            data = resp.json()
+            um = data.get("usageMetadata", {})
+            usage = (um.get("promptTokenCount", 0), um.get("candidatesTokenCount", 0))
+            try:
+                return data["candidates"][0]["content"]["parts"][0]["text"], usage
+            except (KeyError, IndexError):
+                # MAX_TOKENS 등으로 parts 없을 때
+                finish = data.get("candidates", [{}])[0].get("finishReason", "UNKNOWN")
+                if finish == "MAX_TOKENS":
+                    raise RuntimeError("응답이 너무 길어 잘렸습니다. 질문을 더 짧게 해보세요.")
+                raise RuntimeError(f"응답 파싱 실패 ({finish}): {json.dumps(data, ensure_ascii=False)[:400]}")
+
+        (text, usage), shared = llm_gateway.call_shared(
+            'gemini', (api_key, model, api_ver, payload), _do,
+            tokens=llm_gateway.estimate_tokens(json.dumps(contents, ensure_ascii=False), max_tok))
+        rec.cache = 'coalesced' if shared else 'miss'
+        if not shared:
+            rec.usage(*usage)
+        return text
+
+
+DALLE_COLORS = {'오렌지': '오렌지색', '자몽': '핑크색', '레몬': '노란색', '라임': '연두색',
+                '망고': '황금색', '사과': '붉은+연두', '복숭아': '분홍색', '포도': '보라색',
+                '블루베리': '남보라', '딸기': '빨간색', '석류': '루비색', '커피': '갈색'}
 
 
 def build_dalle_prompt(product_name, bev_type, slots, container="PET", volume=500):
-    color_map = {'오렌지': '오렌지색', '자몽': '핑크색', '레몬': '노란색', '라임': '연두색',
-                 '망고': '황금색', '사과': '붉은+연두', '복숭아': '분홍색', '포도': '보라색',
-                 '블루베리': '남보라', '딸기': '빨간색', '석류': '루비색', '커피': '갈색'}
     color = '투명'
-    for s in slots:
-        for k, c in color_map.items():
-            if k in str(s.get('원료명', '')):
-                color = c; break
+    for s in slots:     # 매칭되는 마지막 원료의 색 (원료 안에서는 표 순서 우선)
+        k = KEYWORDS.first(s.get('원료명', ''), 'dalle_color')
+        if k:
+            color = DALLE_COLORS[k]
     mains = [s['원료명'].split('(')[0] for s in slots if safe_float(s.get('배합비(%)', 0)) > 0 and s['원료명'] != '정제수'][:3]
     return f"한국 편의점 음료 패키지 디자인. 제품명:{product_name}, {bev_type}, 주재료:{','.join(mains)}, 색상:{color}, {container} {volume}ml, 포토리얼리스틱"
 
 
+# RTD 제품사진 프롬프트(app.build_rtd_prompt)용 매핑표
+RTD_FLAVORS = {     # 원료명 키워드 → (영문 플레이버, 색상, 가니쉬)
+    '자몽':    ('grapefruit',    '#FF6B4A', 'fresh grapefruit halves with zest'),
+    '레몬':    ('lemon',         '#FFF176', 'bright lemon slices and zest ribbons'),
+    '라임':    ('lime',          '#A5D6A7', 'lime wedges with crushed mint'),
+    '오렌지':  ('orange',        '#FF9800', 'orange slices with peel curl'),
+    '사과':    ('apple',         '#C8E6C9', 'crisp green apple slices'),
+    '복숭아':  ('peach',         '#FFCCBC', 'ripe peach slices showing texture'),
+    '딸기':    ('strawberry',    '#EF9A9A', 'halved fresh strawberries with seeds'),
+    '포도':    ('grape',         '#CE93D8', 'purple grape clusters glistening'),
+    '망고':    ('mango',         '#FFE082', 'tropical mango cubes with leaf'),
+    '유자':    ('yuzu',          '#FFF9C4', 'yuzu citrus with white blossom'),
+    '키위':    ('kiwi',          '#DCEDC8', 'kiwi cross-section showing seeds'),
+    '파인애플':('pineapple',     '#FFF176', 'golden pineapple chunks with core'),
+    '블루베리':('blueberry',     '#9FA8DA', 'plump fresh blueberries'),
+    '석류':    ('pomegranate',   '#EF9A9A', 'pomegranate seeds glistening red'),
+    '매실':    ('plum',          '#B39DDB', 'green-tinted plum halved'),
+    '녹차':    ('green tea',     '#C8E6C9', 'unfurled green tea leaves'),
+    '홍차':    ('black tea',     '#D7CCC8', 'rolled black tea leaves with steam'),
+    '커피':    ('coffee',        '#8D6E63', 'roasted coffee beans and crema'),
+    '아사이':  ('acai',          '#7B1FA2', 'dark acai berries'),
+    '히비스커스':('hibiscus',    '#E91E63', 'dried hibiscus petals'),
+}
+RTD_BEV_LIQUID = {  # 음료유형 키워드 → 액체 묘사
+    '탄산': ('sparkling carbonated liquid with rising micro-bubbles, '
+             'effervescent surface, CO2 streams clearly visible'),
+    '과즙': ('slightly cloudy fruit juice, natural pulp opacity, '
+             'rich layered fruit pigmentation'),
+    '차':   ('translucent amber tea liquid, delicate tannin golden hue, '
+             'clean bright appearance'),
+    '기능': ('crystal-clear functional beverage, '
+             'clean transparent appearance with slight tint'),
+}
+RTD_CARBONATED = ['탄산', 'soda']   # 원료명에 있으면 유형과 무관하게 탄산 묘사
+RTD_FUNCTIONAL = {  # 기능성 포지셔닝 ← 원료명 키워드
+    'zero sugar clean-label positioning': ['제로', '에리스', '수크랄', '스테비'],
+    'vitamin-enriched wellness': ['비타민', '아스코르'],
+    'beauty collagen drink': ['콜라겐', 'collagen'],
+    'probiotic health drink': ['유산균', '프로바이'],
+    'Korean red ginseng health drink': ['홍삼', '인삼'],
+}
+RTD_MOOD = {        # 분위기 ← 마케팅 컨셉 키워드 (소문자)
+    'luxury premium feel': ['프리미엄', 'premium', '고급'],
+    'feminine elegant aesthetic, soft pastel tones': ['여성', '우먼', 'woman', '2030'],
+    'healthy clean wellness vibe': ['건강', 'health', '웰니스', 'wellness'],
+    'ultra-refreshing cool atmosphere': ['청량', '상큼', 'refresh', '시원'],
+    'playful colorful fun design': ['어린이', '키즈', 'kids', '아동'],
+    'dynamic energetic sporty mood': ['스포츠', 'sport', '에너지', 'energy'],
+}
+
+
 def parse_modified_formulation(text):
     try:
         m = re.search(r'```json\s*(\{.*?\})\s*```', text, re.DOTALL)
@@ -625,11 +1687,25 @@ _STEP_ICONS = {
 }
 
 
+# 키워드 표 전체 → 오토마톤 1개 (표시사항 알레르기 · 프롬프트 빌더 · 공정 아이콘 공용)
+KEYWORDS = KeywordMatcher({
+    'ph_species': {k: [k] for k in PH_SPECIES},
+    'sweetener': {k: [k] for k in SWEETENER_CURVES},
+    'stock': {k: [k] for k in STOCK_SOLUTIONS},
+    'allergen': ALLERGEN_KEYWORDS,
+    'step_icon': {k: [k] for k in _STEP_ICONS},
+    'dalle_color': {k: [k] for k in DALLE_COLORS},
+    'rtd_flavor': {k: [k] for k in RTD_FLAVORS},
+    'rtd_liquid': {k: [k] for k in RTD_BEV_LIQUID},
+    'rtd_carbonated': {'탄산': RTD_CARBONATED},
+    'rtd_functional': RTD_FUNCTIONAL,
+    'rtd_mood': RTD_MOOD,
+})
+
+
 def get_step_icon(step_name):
-    for keyword, icon in _STEP_ICONS.items():
-        if keyword in str(step_name):
-            return icon
-    return '⚙️'
+    k = KEYWORDS.first(step_name, 'step_icon')
+    return _STEP_ICONS[k] if k else '⚙️'
 _PROCESS_MAP = {
     '과·채음료': '과·채주스', '과·채주스(100%)': '과·채주스', '과·채주스': '과·채주스',
     '탄산수': '탄산음료', '탄산음료': '탄산음료',
@@ -657,46 +1733,97 @@ def match_process(bev_type, df_proc):
             return m
     # 3차: 과·채주스 폴백 (가장 범용적)
     return df_proc[df_proc['음료유형'].str.contains('과·채주스', na=False)]
-def haccp_ha_worksheet(bev_type, df_proc):
-    """위해분석표"""
-    m = match_process(bev_type, df_proc)
-    if m.empty:
+
+
+HACCP_DOC_TITLES = {
+    'ha_worksheet': '① 위해분석표',
+    'ccp_decision_tree': '② CCP결정도',
+    'ccp_plan': '③ CCP관리계획서',
+    'monitoring_log': '④ 모니터링일지',
+    'flow_diagram': '⑤ 공정흐름도',
+    'sop': '⑥ SOP',
+}
+
+
+# 렌더링 캐시 — 키: (문서, 음료유형, 공정시트 버전, 날짜) (+SOP는 제품명·배합). 공정시트가 바뀌면 버전이 달라져 자동 무효화
+_HACCP_MEMO = _Memo(int(os.environ.get('HACCP_CACHE_SIZE', 512)),
+                    int(float(os.environ.get('HACCP_CACHE_MB', 16)) * 1024 * 1024))
+_PROC_VERSION = {}   # id(df_proc) → (weakref, 행수, 내용 해시)
+
+
+def process_version(df_proc):
+    """공정시트 내용 해시 (DataFrame별 1회 계산)"""
+    ent = _PROC_VERSION.get(id(df_proc))
+    if ent is not None and ent[0]() is df_proc and ent[1] == len(df_proc):
+        return ent[2]
+    h = hashlib.blake2b(repr(list(df_proc.columns)).encode('utf-8'), digest_size=8)
+    h.update(pd.util.hash_pandas_object(df_proc, index=False).to_numpy().tobytes())
+    key = id(df_proc)
+    _PROC_VERSION[key] = (weakref.ref(df_proc, lambda _, k=key: _PROC_VERSION.pop(k, None)),
+                          len(df_proc), h.hexdigest())
+    return _PROC_VERSION[key][2]
+
+
+def process_rows(bev_type, df_proc):
+    """match_process 결과 → 서류 렌더링용 dict 목록 (행 순회·공정 아이콘·CCP 판정 1회, 캐시)"""
+    key = ('rows', bev_type, process_version(df_proc))
+    hit = _HACCP_MEMO.get(key)
+    if hit is not None:
+        return hit
+    rows = match_process(bev_type, df_proc).to_dict('records')
+    for r in rows:
+        ccp = str(r.get('CCP여부', ''))
+        r['_ccp'] = ccp if ccp.startswith('CCP') else ''
+        r['_icon'] = get_step_icon(str(r.get('세부공정', '')))
+    return _HACCP_MEMO.put(key, rows)
+
+
+def _today():
+    return datetime.now().strftime('%Y.%m.%d')
+
+
+def _sop_key(product_name, slots):
+    """SOP에 쓰이는 값만: 제품명 + 배합비>0 슬롯의 (위치, 원료명, 배합비, 배합량)"""
+    return (product_name, tuple((i, s.get('원료명'), s.get('배합비(%)'), s.get('배합량(g/kg)'))
+                                for i, s in enumerate(slots or [])
+                                if safe_float(s.get('배합비(%)', 0)) > 0 and s.get('원료명')))
+
+
+# ── 서류 렌더러: process_rows 결과 → 텍스트 (DB 조회 없음) ──
+def _render_ha_worksheet(bev_type, rows, today):
+    if not rows:
         return "해당 음료유형의 공정 데이터가 없습니다."
     lines = [
         "┌─────────────────────────────────────────────────────────────────────────┐",
         "│                    위해분석 작업장 (HA Worksheet)                        │",
-        f"│  제품유형: {bev_type:<30}  작성일: {datetime.now().strftime('%Y.%m.%d')}       │",
+        f"│  제품유형: {bev_type:<30}  작성일: {today}       │",
         "├────┬────────────┬─────────────────┬──────────────┬────────┬─────────────┤",
         "│ No │   공정단계   │    위해요소      │   발생원인    │ 심각성 │  예방조치    │",
         "├────┼────────────┼─────────────────┼──────────────┼────────┼─────────────┤"]
-    for i, (_, p) in enumerate(m.iterrows(), 1):
+    for i, p in enumerate(rows, 1):
         step = str(p.get('세부공정', '-'))[:12]
         hazard = str(p.get('HACCP 위해요소', '-')).replace('\n', ',')[:17]
         cause = str(p.get('품질관리포인트', '-'))[:14]
-        ccp_raw = str(p.get('CCP여부', ''))
-        ccp = f'★{ccp_raw}' if ccp_raw.startswith('CCP') else '  -  '
+        ccp = f"★{p['_ccp']}" if p['_ccp'] else '  -  '
         prev = str(p.get('모니터링방법', '-'))[:13]
         lines.append(f"│ {i:2d} │ {step:<12}│ {hazard:<17}│ {cause:<14}│ {ccp:^8}│ {prev:<13}│")
     lines.append("└────┴────────────┴─────────────────┴──────────────┴────────┴─────────────┘")
     return '\n'.join(lines)
 
 
-def haccp_ccp_decision_tree(bev_type, df_proc):
-    """CCP 결정도"""
-    m = match_process(bev_type, df_proc)
-    if m.empty:
+def _render_ccp_decision_tree(bev_type, rows, today):
+    if not rows:
         return "해당 음료유형의 공정 데이터가 없습니다."
     lines = [
         "┌──────────────────────────────────────────────────────────────────────┐",
         "│                  CCP 결정도 (Decision Tree)                          │",
-        f"│  제품유형: {bev_type:<30}  작성일: {datetime.now().strftime('%Y.%m.%d')}    │",
+        f"│  제품유형: {bev_type:<30}  작성일: {today}    │",
         "├────────────┬──────────┬──────────┬──────────┬──────────┬────────────┤",
         "│  공정단계   │Q1:예방조치│Q2:제거/저감│Q3:오염증가│Q4:후속제거│  CCP판정   │",
         "├────────────┼──────────┼──────────┼──────────┼──────────┼────────────┤"]
-    for _, p in m.iterrows():
+    for p in rows:
         step = str(p.get('세부공정', '-'))[:12]
-        is_ccp = str(p.get('CCP여부', '')).startswith('CCP')
-        if is_ccp:
+        if p['_ccp']:
             lines.append(f"│ {step:<12}│   예     │   예     │    -     │    -     │  ★ {p.get('CCP여부','')}   │")
         else:
             lines.append(f"│ {step:<12}│   예     │  아니오  │  아니오  │    -     │   비CCP    │")
@@ -704,18 +1831,16 @@ def haccp_ccp_decision_tree(bev_type, df_proc):
     return '\n'.join(lines)
 
 
-def haccp_ccp_plan(bev_type, df_proc):
-    """CCP 관리계획서"""
-    m = match_process(bev_type, df_proc)
-    ccp_rows = m[m['CCP여부'].astype(str).str.startswith('CCP')]
-    if ccp_rows.empty:
+def _render_ccp_plan(bev_type, rows, today):
+    ccp_rows = [p for p in rows if p['_ccp']]
+    if not ccp_rows:
         return "CCP 공정이 없습니다."
     lines = [
         "┌──────────────────────────────────────────────────────────────────────┐",
         "│                   HACCP 관리계획서 (HACCP Plan)                       │",
-        f"│  제품유형: {bev_type:<30}  작성일: {datetime.now().strftime('%Y.%m.%d')}    │",
+        f"│  제품유형: {bev_type:<30}  작성일: {today}    │",
         "└──────────────────────────────────────────────────────────────────────┘"]
-    for _, p in ccp_rows.iterrows():
+    for p in ccp_rows:
         ccp_no = p.get('CCP여부', '')
         lines.extend([
             f"\n■ {ccp_no} — {p.get('세부공정', '')}",
@@ -732,18 +1857,16 @@ def haccp_ccp_plan(bev_type, df_proc):
     return '\n'.join(lines)
 
 
-def haccp_monitoring_log(bev_type, df_proc):
-    """CCP 모니터링 일지 (빈 양식)"""
-    m = match_process(bev_type, df_proc)
-    ccp_rows = m[m['CCP여부'].astype(str).str.startswith('CCP')]
-    if ccp_rows.empty:
+def _render_monitoring_log(bev_type, rows, today):
+    ccp_rows = [p for p in rows if p['_ccp']]
+    if not ccp_rows:
         return "CCP 공정이 없습니다."
     lines = [
         "┌──────────────────────────────────────────────────────────────────────┐",
         "│                    CCP 모니터링 일지                                  │",
         f"│  제품유형: {bev_type:<30}  작성일자: ____년 ____월 ____일       │",
         "└──────────────────────────────────────────────────────────────────────┘"]
-    for _, p in ccp_rows.iterrows():
+    for p in ccp_rows:
         lines.extend([
             f"\n■ {p.get('CCP여부', '')} — {p.get('세부공정', '')}",
             f"  한계기준: {p.get('한계기준(CL)', '')}",
@@ -759,40 +1882,34 @@ def haccp_monitoring_log(bev_type, df_proc):
     return '\n'.join(lines)
 
 
-def haccp_flow_diagram(bev_type, df_proc):
-    """공정흐름도"""
-    m = match_process(bev_type, df_proc)
-    if m.empty:
+def _render_flow_diagram(bev_type, rows, today):
+    if not rows:
         return "해당 음료유형의 공정 데이터가 없습니다."
     lines = [f"공정흐름도 — {bev_type}", "=" * 50]
     prev = False
-    for _, p in m.iterrows():
+    for p in rows:
         step = p.get('세부공정', '')
-        icon = get_step_icon(step)
-        ccp_raw = str(p.get('CCP여부', ''))
-        ccp = f" ★{ccp_raw}" if ccp_raw.startswith('CCP') else ""
+        ccp = f" ★{p['_ccp']}" if p['_ccp'] else ""
         cond = str(p.get('주요조건/파라미터', ''))[:35]
         if prev:
             lines.extend(["        │", "        ▼"])
         lines.extend([
             "  ┌────────────────────────────────┐",
-            f"  │ {icon} {step}{ccp:<25}│",
+            f"  │ {p['_icon']} {step}{ccp:<25}│",
             f"  │    {cond:<29}│",
             "  └────────────────────────────────┘"])
         prev = True
     return '\n'.join(lines)
 
 
-def haccp_sop(bev_type, df_proc, product_name="", slots=None):
-    """작업표준서 (SOP)"""
-    m = match_process(bev_type, df_proc)
-    if m.empty:
+def _render_sop(bev_type, rows, today, product_name="", slots=None):
+    if not rows:
         return "해당 음료유형의 공정 데이터가 없습니다."
     lines = [
         "=" * 70,
         f"  작업표준서 (Standard Operating Procedure)",
         f"  제품명: {product_name}  |  유형: {bev_type}",
-        f"  작성일: {datetime.now().strftime('%Y.%m.%d')}  |  개정: Rev.01",
+        f"  작성일: {today}  |  개정: Rev.01",
         "=" * 70]
     if slots:
         lines.append("\n■ 배합표")
@@ -801,13 +1918,11 @@ def haccp_sop(bev_type, df_proc, product_name="", slots=None):
         for i, s in enumerate(slots):
             if safe_float(s.get('배합비(%)', 0)) > 0 and s.get('원료명'):
                 lines.append(f"  {i+1:<4} {s['원료명']:<25} {s['배합비(%)']:<10.3f} {safe_float(s.get('배합량(g/kg)', 0)):<12.1f}")
-    for _, p in m.iterrows():
-        ccp_raw = str(p.get('CCP여부', ''))
-        ccp = f" [{ccp_raw}]" if ccp_raw.startswith('CCP') else ""
-        icon = get_step_icon(str(p.get('세부공정', '')))
+    for p in rows:
+        ccp = f" [{p['_ccp']}]" if p['_ccp'] else ""
         lines.extend([
             f"\n{'─'*70}",
-            f"■ {icon} {p.get('공정단계', '')} — {p.get('세부공정', '')}{ccp}",
+            f"■ {p['_icon']} {p.get('공정단계', '')} — {p.get('세부공정', '')}{ccp}",
             f"{'─'*70}",
             f"  【작업방법】 {p.get('작업방법(구체적)', '-')}",
             f"  【조건/파라미터】 {p.get('주요조건/파라미터', '-')}",
@@ -820,3 +1935,753 @@ def haccp_sop(bev_type, df_proc, product_name="", slots=None):
                 f"            개선조치: {p.get('개선조치', '-')}"])
     lines.extend(["", "=" * 70, "  작성:________  검토:________  승인:________"])
     return '\n'.join(lines)
+
+
+_HACCP_RENDER = {
+    'ha_worksheet': _render_ha_worksheet,
+    'ccp_decision_tree': _render_ccp_decision_tree,
+    'ccp_plan': _render_ccp_plan,
+    'monitoring_log': _render_monitoring_log,
+    'flow_diagram': _render_flow_diagram,
+    'sop': _render_sop,
+}
+
+
+def _render_doc(doc, bev_type, rows, today, product_name="", slots=None):
+    if doc == 'sop':
+        return _render_sop(bev_type, rows, today, product_name, slots)
+    return _HACCP_RENDER[doc](bev_type, rows, today)
+
+
+def _cached_docs(docs, bev_type, df_proc, product_name="", slots=None, rows=None):
+    """캐시 적중 서류는 그대로, 미적중만 렌더링 (공정 매칭도 미적중이 있을 때만)"""
+    ver, today, out = process_version(df_proc), _today(), {}
+    for d in docs:
+        key = ('doc', d, bev_type, ver, today) + (_sop_key(product_name, slots) if d == 'sop' else ())
+        text = _HACCP_MEMO.get(key)
+        if text is None:
+            if rows is None:
+                rows = process_rows(bev_type, df_proc)
+            text = _HACCP_MEMO.put(key, _render_doc(d, bev_type, rows, today, product_name, slots))
+        out[d] = text
+    return out
+
+
+# ── 단건 서류 (기존 호출 형식 유지) ──
+def haccp_ha_worksheet(bev_type, df_proc):
+    """위해분석표"""
+    return _cached_docs(['ha_worksheet'], bev_type, df_proc)['ha_worksheet']
+
+
+def haccp_ccp_decision_tree(bev_type, df_proc):
+    """CCP 결정도"""
+    return _cached_docs(['ccp_decision_tree'], bev_type, df_proc)['ccp_decision_tree']
+
+
+def haccp_ccp_plan(bev_type, df_proc):
+    """CCP 관리계획서"""
+    return _cached_docs(['ccp_plan'], bev_type, df_proc)['ccp_plan']
+
+
+def haccp_monitoring_log(bev_type, df_proc):
+    """CCP 모니터링 일지 (빈 양식)"""
+    return _cached_docs(['monitoring_log'], bev_type, df_proc)['monitoring_log']
+
+
+def haccp_flow_diagram(bev_type, df_proc):
+    """공정흐름도"""
+    return _cached_docs(['flow_diagram'], bev_type, df_proc)['flow_diagram']
+
+
+def haccp_sop(bev_type, df_proc, product_name="", slots=None):
+    """작업표준서 (SOP)"""
+    return _cached_docs(['sop'], bev_type, df_proc, product_name, slots)['sop']
+
+
+# ── 서류 묶음 / 일괄 생성 ──
+def haccp_documents(bev_type, df_proc, product_name="", slots=None, docs=None, rows=None):
+    """여러 서류를 한 번에 (렌더링 캐시 공유). {문서키: 텍스트} (docs 생략 시 6종, HACCP_DOC_TITLES 순서)
+    rows: 이미 구한 process_rows 결과 재사용"""
+    return _cached_docs(docs or list(HACCP_DOC_TITLES), bev_type, df_proc, product_name, slots, rows)
+
+
+def iter_haccp_bundle(jobs, df_proc, docs=None):
+    """jobs: [{'bev_type', 'product_name'?, 'slots'?}] → (zip 내 경로, 텍스트) 를 하나씩 생성.
+    공정 매칭은 음료유형별 1회, 서류는 필요할 때 1건씩만 메모리에 있음.
+    서류 렌더링 캐시는 거치지 않음 (일회성 대량 생성이 화면용 캐시를 밀어내지 않도록)"""
+    resolved, used, today = {}, set(), _today()
+    for job in jobs:
+        bt = job['bev_type']
+        if bt not in resolved:
+            resolved[bt] = process_rows(bt, df_proc)
+        folder = _zip_name(job.get('product_name') or bt)
+        base, k = folder, 1
+        while folder in used:            # 같은 제품명/유형이 여러 번이면 번호 붙임
+            k += 1
+            folder = f"{base}_{k}"
+        used.add(folder)
+        for d in (docs or HACCP_DOC_TITLES):
+            text = _render_doc(d, bt, resolved[bt], today, job.get('product_name', ''), job.get('slots'))
+            yield f"{folder}/{HACCP_DOC_TITLES[d]}.txt", text
+
+
+def _zip_name(text):
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', str(text)).strip('_') or 'doc'
+
+
+def write_haccp_zip(fileobj, jobs, df_proc, docs=None):
+    """서류 묶음을 fileobj에 ZIP으로 순차 기록 (seek 불가 스트림도 가능). 기록한 서류 수 반환"""
+    import zipfile
+    n = 0
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path, text in iter_haccp_bundle(jobs, df_proc, docs):
+            with zf.open(path, 'w') as f:
+                f.write(text.encode('utf-8'))
+            n += 1
+    return n
+
+
+# ============================================================
+# 9. 배치 계산 (벡터화 — 레시피 라이브러리 대량 재평가)
+# ============================================================
+# 입력은 "긴 형식" 배열: 행 = (레시피번호 rec, 슬롯위치 pos(0~18), 배합비 pct, 원료 계수)
+# 결과는 calc_formulation / check_compliance / generate_food_label 과 같은 규칙·반올림
+def build_property_matrix(df_ing, ph_col):
+    """원료DB → 원료별 계산계수 배열 (행 순서 = 원료DB). 'index'로 원료명 → 행번호"""
+    def col(c):
+        return pd.to_numeric(df_ing[c], errors='coerce').fillna(0).to_numpy(dtype=float)
+    names = df_ing['원료명'].astype(str).tolist()
+    index = {}
+    for i, n in enumerate(names):
+        index.setdefault(n, i)
+    return {
+        'names': names, 'index': index,
+        'brix1': col('1%사용시 Brix기여(°)'), 'acid1': col('1%사용시 산도기여(%)'),
+        'sweet1': col('1%사용시 감미기여'), 'dph1': col(ph_col),
+        'price': col('예상단가(원/kg)'), 'brix': col('Brix(°)'),
+        'ph': col('pH'), 'acidity': col('산도(%)'),
+    }
+
+
+def round_array(x, n):
+    """배열 반올림 — 단건 계산(Python round())과 같은 결과 (배치 결과를 calc_formulation과 맞출 때)"""
+    # np.round는 반올림 경계(…5)에서 Python round()와 최하위 자리가 달라질 수 있음
+    # → 경계 근처 값만 round()로 다시 계산해 단건 계산과 맞춤
+    x = np.asarray(x, dtype=float)
+    out = np.round(x, n)
+    scaled = x * 10.0 ** n
+    near = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    if len(near):
+        out[near] = [round(v, n) for v in x[near].tolist()]
+    return out
+
+
+def calc_formulation_batch(rec, pos, pct, coef, n, volume_ml=500, ph_model='linear', sweet_model='linear'):
+    """레시피 n개 일괄 계산 → DataFrame (열 = calc_formulation 결과 키).
+    coef: 행별 배열 dict — brix1, acid1, sweet1, dph1, price, brix, juice(bool: 이름에 농축/과즙)
+    ph_model='equilibrium'이면 coef['acidbase'](행 × 산·염기, acid_base_rows) 필요 — n개 pH를 한 번에 풂
+    sweet_model='beidler'면 coef['sweet_class'](행별 곡선군, sweetener_class) 필요"""
+    if ph_model not in PH_MODELS:
+        raise ValueError(f"ph_model은 {PH_MODELS} 중 하나: {ph_model!r}")
+    if sweet_model not in SWEET_MODELS:
+        raise ValueError(f"sweet_model은 {SWEET_MODELS} 중 하나: {sweet_model!r}")
+    rec, pos, pct = np.asarray(rec), np.asarray(pos), np.asarray(pct, dtype=float)
+    use = (pct > 0) & (pos < 19)
+    r, p = rec[use], pct[use]
+    c = {k: np.asarray(v)[use] for k, v in coef.items()}
+
+    def total(w):
+        return np.bincount(r, weights=w, minlength=n)[:n]
+
+    # 슬롯별 기여값은 calc_slot_contributions와 같이 행 단위로 먼저 반올림
+    brix = total(round_array(c['brix1'] * p, 2))
+    acid = total(round_array(c['acid1'] * p, 4))
+    sweet_row = round_array(c['sweet1'] * p, 4)
+    if sweet_model == 'linear':
+        sweet = total(sweet_row)
+    else:
+        k = len(SWEET_CLASSES) + 1
+        cls = np.where(c['sweet_class'] < 0, k - 1, c['sweet_class'])
+        U = np.bincount(r * k + cls, weights=sweet_row * 100, minlength=n * k)[:n * k].reshape(n, k)
+        sweet = sweetness_se(U) / 100
+    cost = total(round_array(c['price'] * p / 100, 1))
+    if ph_model == 'linear':
+        ph = 3.5 + total(c['dph1'] * p)
+    else:
+        w = c['acidbase'] * (p / 100)[:, None]
+        ph = solve_ph(np.column_stack([total(w[:, k]) for k in range(w.shape[1])]))
+    ing = total(p)
+    kinds = total(np.ones_like(p))
+    jmask = c['juice'] & (pos[use] < 4)
+    juice = total(np.where(jmask, p * np.where(c['brix'] >= 40, c['brix'] / 11.5, 1.0), 0.0))
+
+    water = round_array(np.maximum(0, 100 - ing), 3)
+    vol = np.broadcast_to(np.asarray(volume_ml, dtype=float), (n,))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(acid > 0, round_array(brix / np.where(acid > 0, acid, 1), 1), 0)
+    return pd.DataFrame({
+        '배합비합계(%)': round_array(ing + water, 3),
+        '예상당도(Bx)': round_array(brix, 2),
+        '예상pH': round_array(ph, 2),
+        '예상산도(%)': round_array(acid, 4),
+        '예상감미도': round_array(sweet, 4),
+        '당산비': ratio,
+        '원재료비(원/kg)': round_array(cost, 1),
+        '원재료비(원/병)': round_array(cost * vol / 1000, 1),
+        '원료종류(개)': kinds.astype(int),
+        '정제수비율(%)': round_array(water, 1),
+        '과즙함량(%)': round_array(juice, 1),
+    })
+
+
+def check_compliance_batch(results, specs):
+    """results(calc_formulation_batch) × specs(행별 Brix_min…산도_max, 규격 없으면 NaN) → 판정 DataFrame"""
+    bx, ac = results['예상당도(Bx)'].to_numpy(), results['예상산도(%)'].to_numpy()
+    has = specs['Brix_min'].notna().to_numpy()
+    s = specs.fillna(0)
+    bmin, bmax = s['Brix_min'].to_numpy(), s['Brix_max'].to_numpy()
+    amin, amax = s['산도_min'].to_numpy(), s['산도_max'].to_numpy()
+    brix_ok = (bmin <= bx) & (bx <= bmax)
+    acid_checked = (amin > 0) | (amax > 0)
+    acid_ok = ~acid_checked | ((amin <= ac) & (ac <= amax))
+    water_ok = results['정제수비율(%)'].to_numpy() >= 50
+    out = pd.DataFrame({
+        '규격있음': has,
+        '당도적합': np.where(has, brix_ok, True),
+        '산도적합': np.where(has, acid_ok, True),
+        '정제수적합': np.where(has, water_ok, True),
+    })
+    out['규격적합'] = out['당도적합'] & out['산도적합'] & out['정제수적합']
+    fails = np.where(~out['당도적합'], '당도 ', '').astype(object) \
+        + np.where(~out['산도적합'], '산도 ', '') + np.where(~out['정제수적합'], '정제수비율', '')
+    out['이탈항목'] = pd.Series(fails).str.strip().to_numpy()
+    return out
+
+
+def _allergens_of(name):
+    return KEYWORDS.matches(str(name).lower(), 'allergen')
+
+
+def food_label_batch(rec, pos, names, pct, brix, n, volume_ml=500, nutrients=None):
+    """식품표시사항 핵심 항목 일괄 생성 (원재료명 순서·알레르기·영양성분).
+    정제수는 호출 측에서 pos=19 행으로 포함 (calc_formulation_batch의 정제수비율 기준)
+    nutrients: build_nutrient_matrix 결과 — 레시피 × 영양성분 = 배합비 가중합 (None이면 Brix 추정)"""
+    rec, pos, pct = np.asarray(rec), np.asarray(pos), np.asarray(pct, dtype=float)
+    names, brix = np.asarray(names, dtype=object), np.asarray(brix, dtype=float)
+    use = pct > 0
+    rec, pos, pct, names, brix = rec[use], pos[use], pct[use], names[use], brix[use]
+    w = pct[:, None] / 100 * nutrient_rows(nutrients, names, brix)
+    per100 = np.column_stack([np.bincount(rec, weights=w[:, k], minlength=n)[:n]
+                              for k in range(len(NUTRIENT_SPEC))]).reshape(n, len(NUTRIENT_SPEC))
+    vol = np.broadcast_to(np.asarray(volume_ml, dtype=float), (n,))
+    _, text = label_nutrition(per100 * vol[:, None] / 100)
+
+    order = np.lexsort((pos, -pct, rec))          # 레시피별 배합비 내림차순 (동률은 슬롯순)
+    rec_o, names_o = rec[order], names[order]
+    cut = np.flatnonzero(np.diff(rec_o)) + 1
+    ingr = [''] * n
+    allergen = [''] * n
+    cache = {}
+    for grp_rec, grp in zip(np.split(rec_o, cut), np.split(names_o, cut)):
+        if not len(grp):
+            continue
+        i = int(grp_rec[0])
+        ingr[i] = ', '.join(grp)
+        found = set()
+        for nm in grp:
+            if nm not in cache:
+                cache[nm] = _allergens_of(nm)
+            found.update(cache[nm])
+        allergen[i] = ', '.join(a for a in ALLERGEN_KEYWORDS if a in found)
+    energy, sugar = per100[:, _NUT['열량']], per100[:, _NUT['당류']]
+    out = pd.DataFrame({
+        '원재료명': ingr,
+        '알레르기': [f'{a} 함유' if a else '해당없음' for a in allergen],
+        '열량(kcal)': round_array(energy * vol / 100, 0),
+        '당류(g)': round_array(sugar * vol / 100, 1),
+        '열량(kcal/100ml)': round_array(energy, 1),
+        '당류(g/100ml)': round_array(sugar, 1),
+    })
+    for k, (nm, _, _, _) in enumerate(NUTRIENT_SPEC[:NUTRIENT_MANDATORY]):   # 표시사항 ⑦과 같은 문자열
+        out[f'{nm}(표시)'] = text[:, k]
+    return out
+
+
+# ============================================================
+# 10. 설계공간 탐색 (원료 2~4종 배합비 스윕 → 파레토 전선)
+# ============================================================
+SWEEP_METHODS = ('lhs', 'grid')
+
+
+def slot_coef(slots, ph_model='linear', sweet_model='linear'):
+    """슬롯 1~19 → calc_formulation_batch 계수 dict (행 = 슬롯 번호). 직접입력 원료도 슬롯 값 그대로"""
+    s19 = slots[:19]
+    names = [str(s.get('원료명', '')) for s in s19]
+
+    def col(k):
+        return np.array([safe_float(s.get(k, 0)) for s in s19])
+    c = {
+        'brix1': col('1%Brix기여'), 'acid1': col('1%산도기여'), 'sweet1': col('1%감미기여'),
+        'dph1': col('1%pH영향'), 'price': col('단가(원/kg)'), 'brix': col('Brix(°)'),
+        'juice': np.array(['농축' in n or '과즙' in n for n in names]),
+    }
+    if ph_model == 'equilibrium':
+        c['acidbase'] = acid_base_rows(names, col('pH'), col('산도(%)'))
+    if sweet_model == 'beidler':
+        c['sweet_class'] = sweetener_class(names)
+    return c
+
+
+def sweep_points(bounds, n=100_000, method='lhs', seed=0):
+    """변수별 (하한, 상한) → 배합비 표본 (m × 변수). grid는 변수당 ⌊n^(1/d)⌋점 격자, lhs는 라틴 하이퍼큐브"""
+    if method not in SWEEP_METHODS:
+        raise ValueError(f"method는 {SWEEP_METHODS} 중 하나: {method!r}")
+    lo, hi = np.asarray(bounds, dtype=float).T
+    d = len(lo)
+    if method == 'grid':
+        k = max(2, int(np.floor(n ** (1 / d) + 1e-9)))
+        axes = np.meshgrid(*[np.linspace(a, b, k) for a, b in zip(lo, hi)], indexing='ij')
+        return np.column_stack([a.ravel() for a in axes])
+    rng = np.random.default_rng(seed)
+    u = (rng.permuted(np.tile(np.arange(n), (d, 1)), axis=1).T + rng.random((n, d))) / n
+    return lo + u * (hi - lo)
+
+
+def pareto_front(objs, block=2048):
+    """목적값 (m × 2~3, 모두 최소화) → 비지배 점 bool 마스크 (같은 점은 첫 점만).
+    1번째 목적으로 사전식 정렬하면 i를 지배하는 점은 i보다 앞에 있고 (2·3번째 목적) 모두 ≤ 인 점 →
+    블록마다 '앞 블록 점들의 2번째 목적 순위별 3번째 목적 최솟값' 누적최소 배열로 조회, 블록 안은 생존 점만 쌍 비교"""
+    objs = np.asarray(objs, dtype=float)
+    if objs.shape[1] == 2:
+        objs = np.column_stack([objs, np.zeros(len(objs))])
+    if objs.shape[1] != 3:
+        raise ValueError("목적은 2~3개")
+    order = np.lexsort(objs.T[::-1])
+    rank = np.unique(objs[order, 1], return_inverse=True)[1]
+    z = objs[order, 2]
+    best = np.full(rank.max() + 1 if len(rank) else 0, np.inf)     # 순위별 3번째 목적 최솟값 (앞 블록까지)
+    keep = np.zeros(len(order), dtype=bool)
+    for s in range(0, len(order), block):
+        r, zz = rank[s:s + block], z[s:s + block]
+        alive = np.minimum.accumulate(best)[r] > zz
+        cand = np.flatnonzero(alive)
+        if len(cand):
+            j = np.arange(len(r))
+            dom = (j[None] < cand[:, None]) & (r[None] <= r[cand, None]) & (zz[None] <= zz[cand, None])
+            keep[s + cand[~dom.any(1)]] = True
+        np.minimum.at(best, r, zz)
+    out = np.zeros(len(order), dtype=bool)
+    out[order] = keep
+    return out
+
+
+def design_sweep(slots, variables, spec=None, n=100_000, method='lhs', volume_ml=500,
+                 ph_model='linear', sweet_model='linear', seed=0):
+    """슬롯 배합비 2~4개를 표본화해 전부 일괄 계산 → (점 DataFrame, 파레토 마스크).
+    variables: [(슬롯번호 0~18, 하한%, 상한%), ...]. 나머지 슬롯은 현재 배합비 고정.
+    목적: 원재료비 ↓, 규격편차 ↓ (Brix·산도 중 큰 값, 규격창 중심 0 · 경계 1), 과즙함량 ↑.
+    spec 없으면 현재 배합의 Brix·산도 ±10%를 창으로 사용. 원료합계 100% 초과 점은 전선에서 제외"""
+    if not 1 <= len(variables) <= 4:
+        raise ValueError("변수는 1~4개")
+    idx = [int(v[0]) for v in variables]
+    pts = sweep_points([(v[1], v[2]) for v in variables], n, method, seed)
+    m = len(pts)
+    base = np.array([safe_float(s.get('배합비(%)', 0)) for s in slots[:19]])
+    rows = np.flatnonzero((base > 0) | np.isin(np.arange(19), idx))   # 레시피 1개의 행 = 슬롯 순서 (단건과 같은 합산 순서)
+    k = len(rows)
+    pct = np.tile(base[rows], (m, 1))
+    pct[:, np.searchsorted(rows, idx)] = pts
+    coef = {key: np.tile(v[rows], (m,) + (1,) * (v.ndim - 1)) for key, v in
+            slot_coef(slots, ph_model, sweet_model).items()}
+    res = calc_formulation_batch(np.repeat(np.arange(m), k), np.tile(rows, m), pct.ravel(), coef, m,
+                                 volume_ml, ph_model, sweet_model)
+
+    if spec is None:
+        cur = calc_formulation(slots, volume_ml)
+        bx, ac = cur['예상당도(Bx)'], cur['예상산도(%)']
+        spec = {'Brix_min': bx * 0.9, 'Brix_max': bx * 1.1, '산도_min': ac * 0.9, '산도_max': ac * 1.1}
+    comp = check_compliance_batch(res, pd.DataFrame({c: np.full(m, spec[c]) for c in spec}))
+
+    def dev(x, lo_, hi_):
+        half = (hi_ - lo_) / 2
+        return np.abs(x - (lo_ + hi_) / 2) / half if half > 0 else np.zeros_like(x)
+    deviation = np.maximum(dev(res['예상당도(Bx)'].to_numpy(), spec['Brix_min'], spec['Brix_max']),
+                           dev(res['예상산도(%)'].to_numpy(), spec['산도_min'], spec['산도_max']))
+    names = [str(slots[i].get('원료명', '')) or f'슬롯{i + 1}' for i in idx]
+    out = pd.concat([pd.DataFrame(pts, columns=[f'{nm}(%)' for nm in names]), res,
+                     comp[['규격적합', '이탈항목']]], axis=1)
+    out['규격편차'] = np.round(deviation, 4)
+    valid = res['배합비합계(%)'].to_numpy() <= 100.0005
+    front = np.zeros(m, dtype=bool)
+    if valid.any():
+        objs = np.column_stack([res['원재료비(원/kg)'].to_numpy(), out['규격편차'].to_numpy(),
+                                -res['과즙함량(%)'].to_numpy()])[valid]
+        front[np.flatnonzero(valid)[pareto_front(objs)]] = True
+    return out, front
+
+
+# ============================================================
+# 11. 대체 원료 탐색 (원료 1%당 이화학 기여 벡터 색인)
+# ============================================================
+SUB_PROPS = [('brix1', '당도(Bx)'), ('acid1', '산도(%)'), ('sweet1', '감미도'), ('dph1', 'pH')]
+SUB_MIN_EXPLICIT = 0.7    # 직접 지정 치환의 최소 유사도 (기여 방향이 반대·무관한 원료 차단)
+_SUB_SLOT = {'brix1': '1%Brix기여', 'acid1': '1%산도기여', 'sweet1': '1%감미기여', 'dph1': '1%pH영향'}
+
+
+class _VectorIndex:
+    """단위벡터 최근접 검색 — cKDTree(있으면) / numpy 전수. 단위구 위 유클리드 거리 순 = 코사인 유사도 순"""
+
+    def __init__(self, X):
+        self.X = X
+        self.tree = cKDTree(X) if cKDTree is not None and len(X) else None
+
+    def query(self, q, k):
+        k = min(k, len(self.X))
+        if k == 0:
+            return np.empty(0, dtype=int)
+        if self.tree is not None:
+            return np.atleast_1d(self.tree.query(q, k)[1])
+        d = ((self.X - q) ** 2).sum(1)
+        part = np.argpartition(d, k - 1)[:k]
+        return part[np.argsort(d[part], kind='stable')]
+
+
+def build_substitute_index(df_ing, ph_col):
+    """원료DB → 대체 원료 색인. 열(1%당 Brix·산도·감미·ΔpH 기여)은 0 아닌 값의 중앙값으로 나눠 척도를 맞추고
+    방향(단위벡터)만 색인 — 배합비는 치환 후 다시 풀기 때문에 크기가 아닌 기여 비율이 같아야 대체 가능.
+    원료대분류별 색인을 따로 둠 (같은 분류 안 검색)"""
+    props = build_property_matrix(df_ing, ph_col)
+    V = np.column_stack([props[k] for k, _ in SUB_PROPS])
+    scale = np.array([np.median(np.abs(c[c != 0])) if (c != 0).any() else 1.0 for c in V.T])
+    W = V / scale
+    norm = np.linalg.norm(W, axis=1)
+    U = np.divide(W, norm[:, None], out=np.zeros_like(W), where=norm[:, None] > 0)
+    cat = df_ing['원료대분류'].fillna('').astype(str).to_numpy()
+    groups = {'': np.flatnonzero(norm > 0)}
+    for c in np.unique(cat):
+        groups[c] = np.flatnonzero((cat == c) & (norm > 0))
+    return {
+        'names': props['names'], 'index': props['index'], 'V': V, 'scale': scale, 'U': U, 'norm': norm,
+        'cat': cat, 'price': props['price'],
+        'groups': {c: (rows, _VectorIndex(U[rows])) for c, rows in groups.items()},
+    }
+
+
+def _substitutes(sub, v, cat, exclude=(), k=10, same_category=True, cheaper_than=None):
+    """1%당 기여 벡터 v → (후보 행, 코사인 유사도, 배합비 배율). 배율 = 가중 최소제곱으로 기여 합계 보존.
+    기여가 모두 0인 원료(향료·색소 등)는 같은 분류의 기여 0 원료를 배율 1로"""
+    w = np.asarray(v, dtype=float) / sub['scale']
+    nv = np.linalg.norm(w)
+    key = cat if same_category else ''
+    if nv == 0:
+        rows = np.flatnonzero((sub['norm'] == 0) & ((sub['cat'] == cat) if same_category else True))
+        cos, ratio = np.full(len(rows), np.nan), np.ones(len(rows))
+    else:
+        rows, vi = sub['groups'].get(key, (np.empty(0, dtype=int), _VectorIndex(np.empty((0, 4)))))
+        pick = vi.query(w / nv, k + len(exclude) + (len(rows) if cheaper_than is not None else 0))
+        rows = rows[pick]
+        cos = sub['U'][rows] @ (w / nv)
+        ratio = nv * cos / sub['norm'][rows]          # (a·b)/(b·b), a = 원래, b = 후보 (가중 공간)
+    keep = ~np.isin(rows, list(exclude)) & (ratio > 0)
+    if cheaper_than is not None:
+        keep &= sub['price'][rows] * ratio < cheaper_than
+    rows, cos, ratio = rows[keep], cos[keep], ratio[keep]
+    if nv == 0:
+        order = np.argsort(sub['price'][rows], kind='stable')
+        rows, cos, ratio = rows[order], cos[order], ratio[order]
+    return rows[:k], cos[:k], ratio[:k]
+
+
+def find_substitutes(slot, sub, k=10, same_category=True, cheaper_only=False):
+    """슬롯 원료의 대체 후보 → DataFrame (유사도 순, 같으면 원가 순). 배합비(%)는 배합 Brix·산도·감미·pH 기여 합계를 보존하도록 다시 푼 값,
+    Δ 열은 치환 후 남는 기여 차이 (배합 합계 기준). 직접입력 원료도 슬롯의 1%당 값으로 검색"""
+    cols = ['원료명', '원료대분류', '유사도', '배합비(%)', '단가(원/kg)', '원가변화(원/kg)'] + [f'Δ{c}' for _, c in SUB_PROPS]
+    name = str(slot.get('원료명', ''))
+    pct = safe_float(slot.get('배합비(%)', 0))
+    row = sub['index'].get(name)
+    v = np.array([safe_float(slot.get(_SUB_SLOT[p], 0)) for p, _ in SUB_PROPS])
+    cat = sub['cat'][row] if row is not None else ''
+    price = safe_float(slot.get('단가(원/kg)', 0))
+    rows, cos, ratio = _substitutes(sub, v, cat, () if row is None else (row,), k,
+                                    same_category and row is not None, price if cheaper_only else None)
+    if not len(rows):
+        return pd.DataFrame(columns=cols)
+    new_pct = np.round(pct * ratio, 4)
+    delta = sub['V'][rows] * new_pct[:, None] - v * pct
+    out = pd.DataFrame({
+        '원료명': np.asarray(sub['names'], dtype=object)[rows], '원료대분류': sub['cat'][rows],
+        '유사도': np.round(cos, 4), '배합비(%)': new_pct, '단가(원/kg)': sub['price'][rows],
+        '원가변화(원/kg)': np.round((sub['price'][rows] * new_pct - price * pct) / 100, 1),
+    })
+    for j, (_, c) in enumerate(SUB_PROPS):
+        out[f'Δ{c}'] = np.round(delta[:, j], 4)
+    return out.sort_values(['유사도', '원가변화(원/kg)'], ascending=[False, True], key=lambda c: c.round(3),
+                           na_position='last').reset_index(drop=True)
+
+
+def substitution_map(sub, pairs, min_similarity=0.995, min_explicit=SUB_MIN_EXPLICIT):
+    """[(원료명, 대체원료명 | 'auto'), …] → {원료DB 행: (대체 행, 배합비 배율)}.
+    'auto' = 같은 분류 · 유사도 ≥ min_similarity 후보 중 같은 기여를 더 싸게 내는 가장 싼 원료. 없으면 KeyError
+    (기여가 모두 0인 원료는 'auto' 불가 — 대체원료를 직접 지정).
+    직접 지정은 유사도 ≥ min_explicit이고 배율 > 0일 때만 (둘 다 기여 0이면 배율 1), 아니면 KeyError"""
+    out = {}
+    for old, new in pairs:
+        i = sub['index'].get(old)
+        if i is None:
+            raise KeyError(f"원료DB에 없는 원료: {old}")
+        if new == 'auto':
+            rows, cos, ratio = _substitutes(sub, sub['V'][i], sub['cat'][i], (i,), len(sub['names']),
+                                            cheaper_than=sub['price'][i])
+            ok = cos >= min_similarity          # 기여 0 원료(향료·안정제)는 기능 비교 불가 → 자동 대상 아님
+            if not ok.any():
+                raise KeyError(f"자동 대체 후보 없음 (더 싸고 유사도 ≥ {min_similarity}): {old}")
+            rows, ratio = rows[ok], ratio[ok]
+            best = np.argmin(sub['price'][rows] * ratio)
+            out[i] = (int(rows[best]), float(ratio[best]))
+            continue
+        j = sub['index'].get(new)
+        if j is None:
+            raise KeyError(f"원료DB에 없는 원료: {new}")
+        a, b = sub['V'][i] / sub['scale'], sub['V'][j] / sub['scale']
+        if (a @ a) == 0 and (b @ b) == 0:          # 향료·안정제끼리 — 같은 배합비로 교체
+            out[i] = (j, 1.0)
+            continue
+        cos = a @ b / np.sqrt((a @ a) * (b @ b)) if (a @ a) > 0 and (b @ b) > 0 else 0.0
+        if a @ b <= 0 or cos < min_explicit:
+            raise KeyError(f"대체 불가 (기여 유사도 {cos:.3f} < {min_explicit}): {old} → {new}")
+        out[i] = (j, float(a @ b / (b @ b)))
+    return out
+
+
+def substitute_rows(idx, pct, mapping):
+    """라이브러리 원료 행(원료DB 행번호, 미등록 -1) 일괄 치환 → (새 행번호, 새 배합비, 치환 여부). 배합비는 소수 4자리.
+    배율이 양수가 아니면 ValueError"""
+    idx, pct = np.asarray(idx), np.asarray(pct, dtype=float)
+    if not mapping:
+        return idx, pct, np.zeros(len(idx), dtype=bool)
+    n = max(int(idx.max(initial=0)), max(mapping)) + 1
+    to, scale = np.arange(n), np.ones(n)
+    for i, (j, r) in mapping.items():
+        if not r > 0:   # NaN 포함 — python -O에서도 검사되도록 assert 대신 예외
+            raise ValueError(f"배합비 배율은 양수: {i} → {j} ×{r}")
+        to[i], scale[i] = j, r
+    known = idx >= 0
+    safe = np.where(known, idx, 0)
+    hit = known & np.isin(idx, list(mapping))
+    return (np.where(known, to[safe], idx), np.where(hit, round_array(pct * scale[safe], 4), pct), hit)
+
+
+# ============================================================
+# 12. 단가 변경 재평가 (저장 배합 ↔ 원료 의존 색인)
+# ============================================================
+PACKAGING_COST = {'PET': 120, '캔': 90, '유리병': 200, '종이팩': 80, '파우치': 60}   # 원/병
+MFG_COST_RATIO = 0.4                                                                # 제조비 = 원재료비 × 0.4
+
+
+def bottle_margin(raw_per_bottle, sale_price, container='PET'):
+    """원재료비(원/병) → (총원가, 마진) 원/병. 총원가 = 원재료비 + 포장재비 + 제조비"""
+    total = raw_per_bottle * (1 + MFG_COST_RATIO) + PACKAGING_COST.get(container, 100)
+    return total, sale_price - total
+
+
+def current_prices(df_ing, overlay=None):
+    """원료명 → 적용 단가 (원료DB 예상단가 위에 overlay {원료명: 단가} 덮어씀)"""
+    prices = dict(zip(df_ing['원료명'].astype(str),
+                      pd.to_numeric(df_ing['예상단가(원/kg)'], errors='coerce').fillna(0).astype(float)))
+    prices.update({k: float(v) for k, v in (overlay or {}).items()})
+    return prices
+
+
+def index_history(history, deps=None):
+    """저장 배합 → 원료 의존 색인 {원료명: {저장 당시 단가: {배합 id}}} (증분 — 새 항목만 색인).
+    배합 항목에 'id'가 없으면 부여. 직접입력 원료는 DB 단가와 무관하므로 제외"""
+    deps = deps if deps is not None else {'uses': {}, 'seen': set()}
+    for h in history:
+        hid = h.setdefault('id', os.urandom(6).hex())
+        if hid in deps['seen']:
+            continue
+        deps['seen'].add(hid)
+        for s in h.get('slots', [])[:19]:
+            if s.get('원료명') and not s.get('is_custom') and safe_float(s.get('배합비(%)', 0)) > 0:
+                deps['uses'].setdefault(str(s['원료명']), {}).setdefault(
+                    safe_float(s.get('단가(원/kg)', 0)), set()).add(hid)
+    return deps
+
+
+def stale_entries(deps, prices):
+    """단가가 바뀐 원료를 쓰는 배합만 → {배합 id: {원료명: (이전, 현재)}}. 비용은 원료 × 단가 종류 수에 비례 (배합 수 무관)"""
+    out = {}
+    for name, by_price in deps['uses'].items():
+        new = prices.get(name)
+        if new is None:
+            continue
+        for old, hids in by_price.items():
+            if old != new:
+                for hid in hids:
+                    out.setdefault(hid, {})[name] = (old, new)
+    return out
+
+
+def reprice_history(history, deps, prices, sale_price=None, container='PET', apply=False):
+    """바뀐 단가를 영향받는 저장 배합에만 반영 → 변경 보고서 DataFrame (나머지 배합은 계산하지 않음).
+    apply=True면 배합 슬롯 단가·결과의 원가 항목과 의존 색인을 갱신. 마진은 현재 판매가·용기 기준"""
+    cols = ['배합명', '저장시각', '변경원료', '원재료비(원/kg) 이전', '원재료비(원/kg) 이후',
+            '원재료비(원/병) 이전', '원재료비(원/병) 이후', '마진(원/병) 이전', '마진(원/병) 이후', '마진변화(원/병)']
+    index_history(history, deps)
+    stale = stale_entries(deps, prices)
+    by_id = {h['id']: h for h in history}
+    rows = []
+    for hid, changed in stale.items():
+        h = by_id.get(hid)
+        if h is None:                       # 삭제된 배합 → 색인에서 정리
+            for name, (old, _) in changed.items():
+                deps['uses'][name][old].discard(hid)
+            deps['seen'].discard(hid)
+            continue
+        slots = [s.copy() for s in h['slots']]
+        for s in slots:
+            if s.get('원료명') in changed and not s.get('is_custom'):
+                s['단가(원/kg)'] = changed[s['원료명']][1]
+                calc_slot_contributions(s)
+        old = h.get('result', {})
+        kg, bottle = safe_float(old.get('원재료비(원/kg)', 0)), safe_float(old.get('원재료비(원/병)', 0))
+        volume = h.get('volume') or (round(bottle / kg * 100) * 10 if kg > 0 else 500)   # 예전 항목: 원가 비로 추정 (10 ml 단위)
+        new = calc_formulation(slots, volume)
+        row = {
+            '배합명': h.get('name', ''), '저장시각': h.get('timestamp', ''),
+            '변경원료': ', '.join(f"{n} {o:,.0f}→{p:,.0f}" for n, (o, p) in changed.items()),
+            '원재료비(원/kg) 이전': kg, '원재료비(원/kg) 이후': new['원재료비(원/kg)'],
+            '원재료비(원/병) 이전': bottle, '원재료비(원/병) 이후': new['원재료비(원/병)'],
+        }
+        if sale_price is not None:
+            row['마진(원/병) 이전'] = round(bottle_margin(bottle, sale_price, container)[1], 1)
+            row['마진(원/병) 이후'] = round(bottle_margin(new['원재료비(원/병)'], sale_price, container)[1], 1)
+            row['마진변화(원/병)'] = round(row['마진(원/병) 이후'] - row['마진(원/병) 이전'], 1)
+        rows.append(row)
+        if apply:
+            h['slots'] = slots
+            h['result'] = {**old, **{k: new[k] for k in ('원재료비(원/kg)', '원재료비(원/병)')}}
+            for name, (o, p) in changed.items():
+                deps['uses'][name][o].discard(hid)
+                deps['uses'][name].setdefault(p, set()).add(hid)
+    out = pd.DataFrame(rows, columns=cols if sale_price is not None else cols[:7])
+    worst = (out['원재료비(원/병) 이전'] - out['원재료비(원/병) 이후']).argsort(kind='stable')   # 원가 상승 큰 순
+    return out.iloc[worst].reset_index(drop=True)
+
+
+# ============================================================
+# 13. 원료 단가 이력 (적용일별 단가 버전 · 기준일 조회)
+# ============================================================
+PRICE_BASE_DATE = np.datetime64('1900-01-01', 'D')     # 버전 0 = 원료DB 예상단가 (이력 첫 적용일 이전 기준)
+_PRICE_BOOKS = {}                                       # DB 경로 → 기본 단가장 (프로세스당 1회)
+
+
+def _days(d):
+    """날짜(문자열·date·Timestamp) 또는 그 배열 → datetime64[D]. 스칼라는 numpy로 바로 (pd.to_datetime은 건당 수백 μs)"""
+    if isinstance(d, (str, _date, np.datetime64)):
+        return np.datetime64(d, 'D')
+    return np.asarray(pd.to_datetime(d)).astype('datetime64[D]')
+
+
+def build_price_book(df_ing, df_price=None):
+    """원료DB 예상단가 + 단가 이력 → 적용일별 단가장 {'names', 'index', 'dates', 'price', 'supplier', 'version', 'unmatched'}.
+    price[v] (열 = 원료DB 행 순서)는 dates[v]부터 다음 적용일 전까지 유효 — 버전마다 바뀐 원료만 덮고 나머지는 직전 값.
+    이력 원료명은 앞뒤 공백만 지우고 정확히 일치해야 함 (유사매칭 금지 — 비슷한 이름의 다른 원료 단가를 덮지 않도록).
+    DB에 없는 원료명은 반영하지 않고 unmatched에 남김. 같은 원료·적용일이 겹치면 뒤 행 우선"""
+    names = df_ing['원료명'].astype(str).tolist()
+    index, exact = {}, {}
+    for i, n in enumerate(names):
+        index.setdefault(n, i)
+        exact.setdefault(n.strip(), i)
+    base = pd.to_numeric(df_ing['예상단가(원/kg)'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    h = df_price if df_price is not None and len(df_price) else pd.DataFrame(columns=PRICE_COLS)
+    h_names = h['원료명'].astype(str).str.strip()
+    h = pd.DataFrame({
+        'col': [exact.get(n, -1) for n in h_names],
+        'day': _days(h['적용일']) if len(h) else np.array([], dtype='datetime64[D]'),
+        'price': pd.to_numeric(h['단가(원/kg)'], errors='coerce'),
+        'supplier': h['공급사'] if '공급사' in h else '',
+    })
+    unmatched = sorted(set(h_names[(h['col'] < 0).to_numpy()]))
+    h = h[(h['col'] >= 0) & h['price'].notna()].drop_duplicates(['col', 'day'], keep='last')
+    dates = np.unique(h['day'].to_numpy())
+    row = np.searchsorted(dates, h['day'].to_numpy()) + 1
+    price = np.full((len(dates) + 1, len(names)), np.nan)
+    supplier = np.full(price.shape, None, dtype=object)
+    price[0], supplier[0] = base, ''
+    price[row, h['col'].to_numpy()] = h['price'].to_numpy(dtype=float)
+    supplier[row, h['col'].to_numpy()] = h['supplier'].to_numpy(dtype=object)
+    price = pd.DataFrame(price).ffill().to_numpy()
+    supplier = pd.DataFrame(supplier).ffill().to_numpy()
+    dates = np.concatenate([[PRICE_BASE_DATE], dates]).astype('datetime64[D]')
+    return {'names': names, 'index': index, 'dates': dates, 'price': price, 'supplier': supplier,
+            'version': hashlib.sha1(dates.tobytes() + price.tobytes()).hexdigest()[:12], 'unmatched': unmatched}
+
+
+def default_price_book(path=DB_PATH):
+    """DB 경로의 원료DB + 단가 이력으로 만든 단가장 (프로세스당 1회 — 파일을 바꾸면 재시작)"""
+    book = _PRICE_BOOKS.get(path)
+    if book is None:
+        db = load_db(path)
+        book = _PRICE_BOOKS.setdefault(path, build_price_book(db['원료DB'], db.get('원료단가이력')))
+    return book
+
+
+def price_version(book, dates):
+    """기준일(스칼라 또는 배열) → 그날 유효한 단가 버전 번호 (이분 탐색). 이력 첫 적용일 이전은 0"""
+    return np.maximum(np.searchsorted(book['dates'], _days(dates), side='right') - 1, 0)
+
+
+def price_asof(book, date):
+    """기준일의 원료별 단가 배열 (원료DB 행 순서)"""
+    return book['price'][int(price_version(book, date))]
+
+
+def _slot_price_cols(slots, book):
+    """slots[:19] 중 단가장으로 다시 값을 매길 슬롯 → [(슬롯 번호, 단가장 열)]. 직접입력·DB 밖 원료는 슬롯 단가 유지"""
+    return [(k, book['index'][s['원료명']]) for k, s in enumerate(slots[:19])
+            if not s.get('is_custom') and s.get('원료명') in book['index']
+            and safe_float(s.get('배합비(%)', 0)) > 0]
+
+
+def slot_costs_asof(slots, book, versions):
+    """버전별 슬롯 단가기여(원/kg) 행렬 (버전 × 슬롯) — calc_slot_contributions와 같은 반올림"""
+    versions = np.atleast_1d(versions)
+    out = np.tile([safe_float(s.get('단가기여(원/kg)', 0)) for s in slots], (len(versions), 1))
+    cols = _slot_price_cols(slots, book)
+    if cols:
+        k, j = map(list, zip(*cols))
+        pct = np.array([safe_float(slots[i].get('배합비(%)', 0)) for i in k])
+        c = book['price'][np.ix_(versions, j)] * pct / 100
+        out[:, k] = round_array(c.ravel(), 1).reshape(c.shape)
+    return out
+
+
+def cost_history(slots, book, volume_ml=500):
+    """배합 원가 추이 — 단가장 전 버전을 한 번에 계산, 배합 원료 단가가 바뀐 버전만 남김.
+    → DataFrame (적용일, 원재료비(원/kg), 원재료비(원/병), 변경원료). 첫 행 적용일 NaT = 원료DB 기준"""
+    versions = np.arange(len(book['dates']))
+    costs = slot_costs_asof(slots, book, versions)
+    total = np.zeros(len(versions))
+    for k in range(costs.shape[1]):                  # 슬롯 순서대로 합산 (단건 calc_formulation과 동일)
+        total = total + costs[:, k]
+    cols = _slot_price_cols(slots, book)
+    j = [c for _, c in cols]
+    p = book['price'][:, j]
+    moved = np.ones(len(versions), dtype=bool)
+    moved[1:] = (p[1:] != p[:-1]).any(axis=1) if j else False
+    changes = []
+    for v in np.flatnonzero(moved):
+        if v == 0:
+            changes.append('원료DB 기준')
+            continue
+        diff = np.flatnonzero(p[v] != p[v - 1])
+        changes.append(', '.join(f"{book['names'][j[d]]} {p[v - 1, d]:,.0f}→{p[v, d]:,.0f}" for d in diff))
+    dates = book['dates'][moved].astype('datetime64[ns]')
+    dates[:1 if moved[0] else 0] = np.datetime64('NaT')
+    return pd.DataFrame({
+        '적용일': dates,
+        '원재료비(원/kg)': round_array(total[moved], 1),
+        '원재료비(원/병)': round_array(total[moved] * volume_ml / 1000, 1),
+        '변경원료': changes,
+    })
@@ -0,0 +1,459 @@
+"""
+engine_api.py — engine 헤드리스 HTTP API (ASGI, 외부 프레임워크 없음)
+MES/PLM 등 외부 시스템에서 배합 계산·규격판정·표시사항·HACCP 서류를 호출.
+
+단건:  POST /v1/<op>         JSON 본문 1건 → JSON 응답
+대량:  POST /v1/<op>/bulk    NDJSON(한 줄 1건) 또는 JSON 배열/{"items":[...]} → NDJSON 스트리밍 응답
+       각 줄: {"i": 순번, "ok": true, ...결과} / {"i": 순번, "ok": false, "error": "..."}
+HACCP: POST /v1/haccp/zip    제품 목록(bulk와 같은 형식, 비우면 전 음료유형) → 서류 ZIP 스트리밍
+op: calc, guide, reverse, label, recipe, batch, haccp      (GET /health, GET /v1/ops)
+
+배합 입력(formulation): [{"슬롯"?: 1, "원료명": "...", "배합비": 8.0, (DB에 없으면 "Brix", "산도_pct" …)}]
+선택: "price_date": "YYYY-MM-DD" — 원가를 그날 유효한 원료 단가 이력으로 계산
+
+실행 (DB는 마스터에서 한 번 로딩 → fork 후 워커들이 copy-on-write로 공유):
+    gunicorn engine_api:app -k uvicorn.workers.UvicornWorker -w 4 --preload -b 0.0.0.0:8600
+    python engine_api.py --port 8600          # 단일 프로세스 (uvicorn 필요)
+"""
+import asyncio
+import gc
+import json
+import os
+import sys
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import engine  # noqa: E402
+
+MAX_BODY = int(float(os.environ.get('ENGINE_API_MAX_BODY_MB', 64)) * 1024 * 1024)
+BULK_CHUNK = 200          # 대량 요청 시 스레드에서 한 번에 처리하는 건수 (처리 후 바로 스트리밍)
+
+# ============================================================
+# 1. 공유 DB (임포트 시 1회 — --preload면 마스터에서 로딩 후 fork)
+# ============================================================
+DB = engine.load_db(os.environ.get('ENGINE_DB_PATH', engine.DB_PATH))
+DF_ING = DB['원료DB']
+DF_SPEC = DB['음료규격기준']
+DF_GUIDE = DB['가이드배합비DB']
+DF_PRODUCT = DB['시장제품DB']
+DF_PROCESS = DB['표준제조공정_HACCP']
+PH_COL = engine.ph_column(DF_ING)
+NUTRIENTS = engine.build_nutrient_matrix(DF_ING, DB.get('원료영양DB'))
+PRICES = engine.build_price_book(DF_ING, DB.get('원료단가이력'))
+gc.freeze()   # 로딩된 DB 객체를 GC 추적에서 제외 → fork 후 페이지 복사 최소화
+
+HACCP_DOCS = list(engine.HACCP_DOC_TITLES)
+ZIP_CHUNK = 20            # HACCP ZIP: 스레드에서 한 번에 렌더링하는 제품 수 (처리 후 바로 스트리밍)
+
+
+@lru_cache(maxsize=128)
+def _spec(bev_type):
+    return engine.get_spec(DF_SPEC, bev_type)
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ============================================================
+# 2. 연산 (dict 입력 → dict 출력, 모두 동기 함수)
+# ============================================================
+def _slots(req):
+    if 'slots' in req:
+        if not isinstance(req['slots'], list) or len(req['slots']) > 20:
+            raise ApiError(400, "'slots'는 20개 이하 리스트 (19번째까지 원료, 20번째 정제수)")
+        bad = [i + 1 for i, s in enumerate(req['slots']) if not isinstance(s, dict)]
+        if bad:
+            raise ApiError(400, f"'slots' 항목은 JSON 객체: {bad}번째")
+        slots = [dict(engine.EMPTY_SLOT, **s) for s in req['slots']]
+        slots += engine.init_slots()[len(slots):]
+        return [engine.calc_slot_contributions(s) for s in slots]
+    items = req.get('formulation')
+    if not isinstance(items, list):
+        raise ApiError(400, "'formulation'(배합 리스트) 또는 'slots' 필요")
+    bad = [i + 1 for i, it in enumerate(items) if not isinstance(it, dict)]
+    if bad:
+        raise ApiError(400, f"'formulation' 항목은 JSON 객체: {bad}번째")
+    try:
+        return engine.slots_from_formulation(items, DF_ING, PH_COL)
+    except ValueError as e:
+        raise ApiError(400, str(e))
+
+
+def _positive(v, what):
+    """양수 숫자만 (문자열·0·음수·NaN은 400 — 기본값으로 바꾸지 않음)"""
+    x = engine.safe_float(v, None) if not isinstance(v, bool) else None
+    if x is None or not np.isfinite(x) or x <= 0:
+        raise ApiError(400, f"{what}는 양수: {v!r}")
+    return int(x) if x == int(x) else x
+
+
+def _volume(req):
+    return _positive(req.get('volume_ml', 500), 'volume_ml')
+
+
+def _active(slots):
+    return [{'슬롯': i + 1, **s} for i, s in enumerate(slots)
+            if s.get('원료명') and engine.safe_float(s.get('배합비(%)', 0)) > 0]
+
+
+def _ph_model(req):
+    m = req.get('ph_model') or 'linear'
+    if m not in engine.PH_MODELS:
+        raise ApiError(400, f"알 수 없는 ph_model: {m!r} (가능: {list(engine.PH_MODELS)})")
+    return m
+
+
+def _sweet_model(req):
+    m = req.get('sweet_model') or 'linear'
+    if m not in engine.SWEET_MODELS:
+        raise ApiError(400, f"알 수 없는 sweet_model: {m!r} (가능: {list(engine.SWEET_MODELS)})")
+    return m
+
+
+def _price_date(req):
+    d = req.get('price_date')
+    if not d:
+        return None
+    try:
+        return np.datetime64(str(d)[:10], 'D')
+    except ValueError:
+        raise ApiError(400, f"price_date는 YYYY-MM-DD: {d!r}")
+
+
+def _score(slots, bev_type, volume_ml, ph_model='linear', sweet_model='linear', price_date=None):
+    result = engine.calc_formulation(slots, volume_ml, ph_model, sweet_model, price_date, PRICES)
+    spec = _spec(bev_type) if bev_type else None
+    comp = engine.check_compliance(result, spec) if spec else {}
+    return {'result': result, 'spec': spec,
+            'compliance': {k: {'판정': v[0], '적합': v[1]} for k, v in comp.items()}}
+
+
+def op_calc(req):
+    slots = _slots(req)
+    out = _score(slots, req.get('bev_type', ''), _volume(req), _ph_model(req), _sweet_model(req),
+                  _price_date(req))
+    if req.get('include_slots'):
+        out['slots'] = _active(slots)
+    unknown = [s['원료명'] for s in _active(slots) if s.get('is_custom')]
+    if unknown:
+        out['unmatched'] = unknown
+    return out
+
+
+def op_guide(req):
+    bev_type, flavor = req.get('bev_type', ''), req.get('flavor', '')
+    if not bev_type or not flavor:
+        raise ApiError(400, "'bev_type', 'flavor' 필요")
+    slots = engine.load_guide(DF_GUIDE, bev_type, flavor, DF_ING, PH_COL)
+    return {'slots': _active(slots),
+            **_score(slots, bev_type, _volume(req), _ph_model(req), _sweet_model(req),
+                     _price_date(req))}
+
+
+def op_reverse(req):
+    if 'No' in req:
+        rows = DF_PRODUCT[DF_PRODUCT['No'] == req['No']]
+    elif req.get('제품명'):
+        rows = DF_PRODUCT[DF_PRODUCT['제품명'] == req['제품명']]
+    else:
+        raise ApiError(400, "'No' 또는 '제품명' 필요")
+    if rows.empty:
+        raise ApiError(404, "시장제품DB에 없는 제품")
+    prod = rows.iloc[0]
+    slots = engine.reverse_engineer(prod, DF_ING, PH_COL)
+    return {'제품명': prod.get('제품명', ''), 'slots': _active(slots),
+            **_score(slots, req.get('bev_type', ''), _volume(req), _ph_model(req), _sweet_model(req),
+                     _price_date(req))}
+
+
+def op_label(req):
+    slots = _slots(req)
+    engine.calc_formulation(slots)   # 정제수 슬롯 보정
+    return {'label': engine.generate_food_label(
+        slots, req.get('product_name', ''), _volume(req),
+        req.get('bev_type', ''), NUTRIENTS)}
+
+
+def op_recipe(req):
+    slots = _slots(req)
+    engine.calc_formulation(slots)
+    scales = req.get('scales') or [1, 5, 20]
+    if not isinstance(scales, list):
+        raise ApiError(400, f"'scales'는 L 목록: {scales!r}")
+    return {'recipe': engine.generate_lab_recipe(slots, [_positive(x, 'scales') for x in scales])}
+
+
+def op_batch(req):
+    """생산 배치 지시서 — SKU 1건 (여러 SKU는 /v1/batch/bulk). sheets=true면 인쇄용 텍스트도"""
+    slots = _slots(req)
+    batches = req.get('batches') or engine.BATCH_SIZES_L
+    if not isinstance(batches, (list, tuple)):
+        raise ApiError(400, f"'batches'는 L 목록: {batches!r}")
+    batches = [_positive(x, 'batches') for x in batches]
+    tank = _positive(req.get('tank_capacity_l', engine.TANK_CAPACITY_L), 'tank_capacity_l')
+    name = req.get('product_name') or 'SKU'
+    df = engine.production_batches([{'name': name, 'slots': slots, 'batches': batches}], DF_ING, tank)
+    out = {'rows': df.astype(object).where(df.notna(), None).to_dict('records')}
+    if req.get('sheets'):
+        out['sheets'] = dict(engine.iter_batch_sheets(df))
+    return out
+
+
+def _haccp_job(req):
+    """HACCP 요청 1건 → (engine 일괄 생성용 job, 문서 목록)"""
+    if not isinstance(req, dict):
+        raise ApiError(400, "요청은 JSON 객체여야 합니다")
+    bev_type = req.get('bev_type', '')
+    if not bev_type:
+        raise ApiError(400, "'bev_type' 필요")
+    names = req.get('docs') or HACCP_DOCS
+    if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+        raise ApiError(400, f"'docs'는 문서 이름 목록: {names!r} (가능: {HACCP_DOCS})")
+    bad = [n for n in names if n not in HACCP_DOCS]
+    if bad:
+        raise ApiError(400, f"알 수 없는 문서: {bad} (가능: {HACCP_DOCS})")
+    slots = None
+    if 'formulation' in req or 'slots' in req:
+        slots = _slots(req)
+        engine.calc_formulation(slots)
+    return {'bev_type': bev_type, 'product_name': req.get('product_name', ''), 'slots': slots}, names
+
+
+def _haccp_jobs(items):
+    """ZIP용 job 전체를 응답 시작 전에 만듦 — 입력 오류는 400/422 ApiError (헤더를 보낸 뒤엔 상태코드를 못 바꿈)"""
+    jobs = []
+    for i, req in enumerate(items, 1):
+        try:
+            jobs.append(_haccp_job(req))
+        except ApiError as e:
+            raise ApiError(e.status, f"{i}번째 제품: {e}")
+        except Exception as e:
+            raise ApiError(422, f"{i}번째 제품: {type(e).__name__}: {e}")
+    return jobs
+
+
+def op_haccp(req):
+    job, names = _haccp_job(req)
+    docs = engine.haccp_documents(job['bev_type'], DF_PROCESS, job['product_name'], job['slots'], names)
+    return {'bev_type': job['bev_type'], 'docs': docs}
+
+
+OPS = {'calc': op_calc, 'guide': op_guide, 'reverse': op_reverse,
+       'label': op_label, 'recipe': op_recipe, 'batch': op_batch, 'haccp': op_haccp}
+
+
+def run_op(op, req):
+    """단건 실행 — 예외는 ApiError로 통일"""
+    if not isinstance(req, dict):
+        raise ApiError(400, "요청은 JSON 객체여야 합니다")
+    try:
+        return OPS[op](req)
+    except ApiError:
+        raise
+    except Exception as e:
+        raise ApiError(422, f"{type(e).__name__}: {e}")
+
+
+def run_bulk(op, items, start=0):
+    """여러 건 실행 → NDJSON 바이트 (건별 성공/실패 분리)"""
+    lines = []
+    for i, req in enumerate(items, start):
+        try:
+            row = {'i': i, 'ok': True, **run_op(op, req)}
+        except ApiError as e:
+            row = {'i': i, 'ok': False, 'status': e.status, 'error': str(e)}
+        if isinstance(req, dict) and 'id' in req:
+            row['id'] = req['id']
+        lines.append(_dumps(row))
+    return b'\n'.join(lines) + b'\n' if lines else b''
+
+
+# ============================================================
+# 3. JSON 직렬화 / 본문 파싱
+# ============================================================
+def _default(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, datetime):
+        return o.isoformat()
+    return str(o)
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, default=_default).encode('utf-8')
+
+
+def parse_bulk(body):
+    """NDJSON / JSON 배열 / {"items": [...]} 모두 허용"""
+    try:
+        text = body.decode('utf-8').strip()
+    except UnicodeDecodeError as e:
+        raise ApiError(400, f"본문은 UTF-8이어야 합니다: {e}")
+    if not text:
+        return []
+    if text[0] in '[{':
+        try:
+            data = json.loads(text)
+            if isinstance(data, list):
+                return data
+            if isinstance(data, dict) and isinstance(data.get('items'), list):
+                return data['items']
+            return [data]
+        except json.JSONDecodeError:
+            pass   # 한 줄 1객체(NDJSON)로 재시도
+    items = []
+    for n, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            raise ApiError(400, f"NDJSON {n}번째 줄 파싱 실패: {e}")
+    return items
+
+
+# ============================================================
+# 4. ASGI 앱
+# ============================================================
+async def _read_body(receive):
+    chunks, size = [], 0
+    while True:
+        msg = await receive()
+        if msg['type'] == 'http.disconnect':
+            raise ApiError(499, "client disconnected")
+        chunk = msg.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY:
+            raise ApiError(413, f"요청 본문이 {MAX_BODY // 1024 // 1024}MB를 초과")
+        chunks.append(chunk)
+        if not msg.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _send_json(send, status, obj):
+    body = _dumps(obj)
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json; charset=utf-8'),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _stream_bulk(send, op, items):
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/x-ndjson; charset=utf-8'),
+                            (b'x-item-count', str(len(items)).encode())]})
+    loop = asyncio.get_running_loop()
+    for start in range(0, len(items), BULK_CHUNK):
+        # CPU 작업은 스레드에서 — 이벤트루프(다른 요청/헬스체크)를 막지 않음
+        chunk = await loop.run_in_executor(None, run_bulk, op, items[start:start + BULK_CHUNK], start)
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+class _ZipSink:
+    """ZipFile 출력 대상 (seek 불가) — 쓰인 바이트를 모아 두었다가 drain()으로 꺼냄"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        out, self.parts = b''.join(self.parts), []
+        return out
+
+
+def _zip_jobs(zf, jobs):
+    for job, names in jobs:
+        for path, text in engine.iter_haccp_bundle([job], DF_PROCESS, names):
+            with zf.open(path, 'w') as f:
+                f.write(text.encode('utf-8'))
+
+
+async def _stream_haccp_zip(send, items):
+    import zipfile
+    if not items:
+        items = [{'bev_type': bt} for bt in DF_SPEC['음료유형'].dropna().astype(str)]
+    loop = asyncio.get_running_loop()
+    jobs = await loop.run_in_executor(None, _haccp_jobs, items)   # 입력 오류는 응답 전에
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/zip'),
+                            (b'content-disposition', b'attachment; filename="HACCP.zip"'),
+                            (b'x-item-count', str(len(jobs)).encode())]})
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for start in range(0, len(jobs), ZIP_CHUNK):
+            await loop.run_in_executor(None, _zip_jobs, zf, jobs[start:start + ZIP_CHUNK])
+            await send({'type': 'http.response.body', 'body': sink.drain(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': sink.drain(), 'more_body': False})
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            msg = await receive()
+            if msg['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif msg['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    method, parts = scope['method'], [p for p in scope['path'].split('/') if p]
+    try:
+        if method == 'GET' and parts == ['health']:
+            return await _send_json(send, 200, {'ok': True, 'pid': os.getpid(),
+                                                'ingredients': len(DF_ING),
+                                                'price_unmatched': PRICES['unmatched']})
+        if method == 'GET' and parts == ['v1', 'ops']:
+            return await _send_json(send, 200, {'ops': list(OPS), 'haccp_docs': list(HACCP_DOCS)})
+        if len(parts) < 2 or parts[0] != 'v1' or parts[1] not in OPS or len(parts) > 3 \
+                or (len(parts) == 3 and parts[2] != 'bulk' and parts[1:] != ['haccp', 'zip']):
+            raise ApiError(404, f"없는 경로: {scope['path']}")
+        if method != 'POST':
+            raise ApiError(405, "POST만 지원")
+        op, bulk = parts[1], len(parts) == 3
+        body = await _read_body(receive)
+        if parts[1:] == ['haccp', 'zip']:
+            return await _stream_haccp_zip(send, parse_bulk(body))
+        if bulk:
+            return await _stream_bulk(send, op, parse_bulk(body))
+        try:
+            req = json.loads(body or b'{}')
+        except ValueError as e:             # JSONDecodeError, UTF-8 아닌 본문(UnicodeDecodeError)
+            raise ApiError(400, f"JSON 파싱 실패: {e}")
+        loop = asyncio.get_running_loop()
+        return await _send_json(send, 200, await loop.run_in_executor(None, run_op, op, req))
+    except ApiError as e:
+        if e.status != 499:
+            await _send_json(send, e.status, {'ok': False, 'error': str(e)})
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="engine 헤드리스 HTTP API")
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8600)
+    a = ap.parse_args()
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("uvicorn이 필요합니다: pip install uvicorn  (다중 워커는 gunicorn --preload 사용)")
+    uvicorn.run(app, host=a.host, port=a.port, log_level='info')
+
+
+if __name__ == '__main__':
+    main()
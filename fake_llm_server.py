@@ -0,0 +1,242 @@
+"""
+fake_llm_server.py — OpenAI/Gemini 대역 서버 (오프라인 부하·지연 벤치마크용)
+- POST /v1/chat/completions          : 페르소나별 고정 응답 (배합 JSON, 이화학 추정 JSON 등)
+- POST /v1/images/generations        : 로컬 PNG URL 반환 (GET /files/<name>.png)
+- POST /{v1|v1beta}/models/<m>:generateContent : Gemini 응답
+- 지연시간 분포(fixed/uniform/lognormal), 오류율(429/500) 설정 가능
+
+실행: python fake_llm_server.py --port 8765 --median-ms 800 --sigma 0.6 --error-rate 0.02
+앱 연결: OPENAI_BASE_URL=http://127.0.0.1:8765/v1  GEMINI_API_BASE=http://127.0.0.1:8765
+"""
+import argparse
+import json
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# ============================================================
+# 1. 지연/오류 설정
+# ============================================================
+class FakeConfig:
+    def __init__(self, dist='lognormal', median_ms=800.0, sigma=0.5, min_ms=0.0, max_ms=None,
+                 error_rate=0.0, image_ms=None, seed=None):
+        self.dist = dist
+        self.median_ms = float(median_ms)
+        self.sigma = float(sigma)
+        self.min_ms = float(min_ms)
+        self.max_ms = max_ms
+        self.error_rate = float(error_rate)
+        self.image_ms = image_ms          # 이미지 생성 중앙값 (None이면 median_ms × 10)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def latency_s(self, median_ms=None):
+        med = self.median_ms if median_ms is None else float(median_ms)
+        with self.lock:
+            if self.dist == 'fixed':
+                ms = med
+            elif self.dist == 'uniform':
+                ms = self.rng.uniform(self.min_ms, 2 * med - self.min_ms)
+            else:
+                ms = med * math.exp(self.rng.gauss(0, self.sigma))
+        ms = max(self.min_ms, ms)
+        if self.max_ms is not None:
+            ms = min(float(self.max_ms), ms)
+        return ms / 1000.0
+
+    def error(self):
+        """오류 주입: None 또는 (status, message)"""
+        with self.lock:
+            if self.rng.random() >= self.error_rate:
+                return None
+            return (429, "Rate limit reached (fake)") if self.rng.random() < 0.7 else (500, "Internal error (fake)")
+
+
+# ============================================================
+# 2. 고정 응답 (engine 파서/스키마와 일치)
+# ============================================================
+_FORMULATION = [
+    {"슬롯": 1, "원료명": "사과농축과즙(70Brix)", "배합비": 8.0, "구분": "원재료", "용도특성": "주 과즙원"},
+    {"슬롯": 5, "원료명": "백설탕(정제당)", "배합비": 5.5, "구분": "당류", "용도특성": "기본 감미"},
+    {"슬롯": 6, "원료명": "액상과당(HFCS55)", "배합비": 2.0, "구분": "당류", "용도특성": "바디감"},
+    {"슬롯": 9, "원료명": "펙틴(HM/고메톡실)", "배합비": 0.1, "구분": "안정제", "용도특성": "혼탁 안정"},
+    {"슬롯": 13, "원료명": "구연산(무수)", "배합비": 0.2, "구분": "산미료", "용도특성": "산미 조절"},
+    {"슬롯": 14, "원료명": "아스코르빈산(비타민C)", "배합비": 0.03, "구분": "기타", "용도특성": "산화방지"},
+    {"슬롯": 15, "원료명": "사과향", "배합비": 0.05, "구분": "향료", "용도특성": "향 보강"},
+]
+
+_ESTIMATION = {"Brix": 65, "pH": 3.6, "산도_pct": 2.5, "감미도_설탕대비": 0, "예상단가_원kg": 6000,
+               "1pct_Brix기여": 0.65, "1pct_pH영향": -0.08, "1pct_산도기여": 0.025, "1pct_감미기여": 0.0059}
+
+_LOREM = ("관능적으로 초두감미는 적정하며 중미의 산미 밸런스가 양호합니다. 당산비는 목표 범위 내이고 "
+          "과즙감이 살아 있습니다. 살균 후 향 손실을 고려해 향료를 소폭 보강할 것을 권장합니다. ")
+
+
+def _chat_reply(system, user):
+    if '이화학' in system and 'JSON만' in system:
+        return json.dumps(_ESTIMATION, ensure_ascii=False)
+    if '15자 이내' in system:
+        return "산미 부여·pH 조절"
+    if '배합설계 전문 연구원' in system:
+        return json.dumps({"배합": [{k: v for k, v in f.items() if k != '용도특성'} for f in _FORMULATION]},
+                          ensure_ascii=False)
+    if '마케팅팀으로부터' in system:
+        body = {"음료유형": "과·채음료", "맛": "사과", "컨셉요약": "상큼한 사과 과채음료",
+                "주요원료설명": [{"원료명": "사과농축과즙(70Brix)", "사용이유": "과즙감"}],
+                "배합": _FORMULATION}
+        return "1️⃣ 컨셉분석: 2030 타겟 상큼 음료\n\n```json\n" + json.dumps(body, ensure_ascii=False) + "\n```"
+    if 'Dr. 이음료' in system:
+        mod = {"수정배합": [{"원료명": f["원료명"], "배합비(%)": f["배합비"]} for f in _FORMULATION]}
+        return _LOREM * 3 + "\n\n```json\n" + json.dumps(mod, ensure_ascii=False) + "\n```"
+    if 'creative director' in system:
+        return "bright airy studio light, pastel citrus palette, crisp condensation, clean minimal mood"
+    return _LOREM * 6
+
+
+def _gemini_reply(text):
+    if '배합 변경 제안' in text and ('산미' in text or '변경' in text.split('질문:')[-1]):
+        return _LOREM + '\n```json\n{"changes":[{"슬롯":13,"원료명":"구연산(무수)","배합비":0.25}]}\n```'
+    return _LOREM * 4
+
+
+def _tokens(text):
+    return max(1, int(len(text) / 1.5))
+
+
+def _png(w=64, h=64, rgb=(255, 183, 77)):
+    raw = b''.join(b'\x00' + bytes(rgb) * w for _ in range(h))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+_IMAGE = _png()
+
+
+# ============================================================
+# 3. HTTP 핸들러
+# ============================================================
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeLLM/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status, body, ctype='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _fail_or_wait(self, median_ms=None):
+        time.sleep(self.server.config.latency_s(median_ms))
+        err = self.server.config.error()
+        if err:
+            status, msg = err
+            self._send(status, {"error": {"message": msg, "code": status}})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path.startswith('/files/'):
+            self._send(200, _IMAGE, 'image/png')
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        try:
+            req = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send(400, {"error": {"message": "invalid json"}})
+        path = self.path.split('?')[0]
+        cfg = self.server.config
+
+        if path.endswith('/chat/completions'):
+            if self._fail_or_wait():
+                return
+            msgs = req.get('messages', [])
+            system = ' '.join(m.get('content', '') for m in msgs if m.get('role') == 'system')
+            user = ' '.join(m.get('content', '') for m in msgs if m.get('role') != 'system')
+            text = _chat_reply(system, user)
+            pt, ct = _tokens(system + user), _tokens(text)
+            return self._send(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": req.get('model', 'gpt-4o'),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": pt, "completion_tokens": ct, "total_tokens": pt + ct},
+            })
+
+        if path.endswith('/images/generations'):
+            if self._fail_or_wait(cfg.image_ms if cfg.image_ms is not None else cfg.median_ms * 10):
+                return
+            host = self.headers.get('Host', f"127.0.0.1:{self.server.server_port}")
+            name = f"{abs(hash(req.get('prompt', ''))) % 10**10}.png"
+            return self._send(200, {"created": int(time.time()),
+                                    "data": [{"url": f"http://{host}/files/{name}"}]})
+
+        if ':generateContent' in path:
+            if self._fail_or_wait():
+                return
+            contents = req.get('contents', [])
+            last = ''.join(p.get('text', '') for p in (contents[-1].get('parts', []) if contents else []))
+            text = _gemini_reply(last)
+            all_text = ''.join(p.get('text', '') for c in contents for p in c.get('parts', []))
+            return self._send(200, {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                "finishReason": "STOP"}],
+                "usageMetadata": {"promptTokenCount": _tokens(all_text), "candidatesTokenCount": _tokens(text)},
+            })
+
+        self._send(404, {"error": {"message": f"unknown endpoint {path}"}})
+
+
+def start_server(host='127.0.0.1', port=0, config=None, verbose=False):
+    """백그라운드 스레드로 서버 시작. (server, base_url) 반환 — port=0이면 빈 포트 자동"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.config = config or FakeConfig()
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="OpenAI/Gemini 대역 서버")
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--dist', choices=['fixed', 'uniform', 'lognormal'], default='lognormal')
+    ap.add_argument('--median-ms', type=float, default=800)
+    ap.add_argument('--sigma', type=float, default=0.5, help='lognormal 표준편차 (log 단위)')
+    ap.add_argument('--min-ms', type=float, default=0)
+    ap.add_argument('--max-ms', type=float, default=None)
+    ap.add_argument('--image-ms', type=float, default=None, help='이미지 생성 지연 중앙값')
+    ap.add_argument('--error-rate', type=float, default=0.0)
+    ap.add_argument('--seed', type=int, default=None)
+    ap.add_argument('-v', '--verbose', action='store_true')
+    a = ap.parse_args()
+    cfg = FakeConfig(a.dist, a.median_ms, a.sigma, a.min_ms, a.max_ms, a.error_rate, a.image_ms, a.seed)
+    server, url = start_server(a.host, a.port, cfg, a.verbose)
+    print(f"fake LLM server: {url}")
+    print(f"  OPENAI_BASE_URL={url}/v1  GEMINI_API_BASE={url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+"""
+history_store.py — 배합 히스토리 로컬 저장소 (SQLite, 내용 주소 방식)
+- 슬롯 dict는 정규화 JSON의 해시로 1번만 저장 — 빈 슬롯·같은 원료 슬롯은 모든 버전이 공유
+- 같은 제품의 연속 버전은 바뀐 슬롯(번호 → 해시)만 기록, KEYFRAME_EVERY 버전마다 전체 목록(키프레임)
+- 목록 조회는 메타데이터·결과만 (제품/음료유형/맛/날짜 색인), 슬롯은 로드할 때 복원 — 버전 수천 개도 세션 메모리와 무관
+- 모든 조회·수정·삭제는 작업공간(owner) 단위 — 저장소는 프로세스 공용이지만 다른 사용자의 배합은 보이지도 바뀌지도 않음
+- 원료 → (저장 당시 단가, 배합) 역색인 테이블: 단가가 바뀐 원료를 쓰는 배합만 조회 (engine.reprice_history와 함께)
+- 위치: .history/history.sqlite3 (HISTORY_DB로 변경)
+- owner 이전 파일의 배합은 임의 코드 작업공간으로 이관 — 코드는 DB 옆 legacy_workspace.txt (HISTORY_LEGACY_WS로 지정 가능)
+"""
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+DB_PATH = os.environ.get(
+    'HISTORY_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.history', 'history.sqlite3'))
+LEGACY_FILE = 'legacy_workspace.txt'   # 이관된 이전 배합의 작업공간 코드 (DB와 같은 폴더)
+KEYFRAME_EVERY = 16       # 키프레임 간격 — 슬롯 복원은 최대 이만큼의 델타 적용
+CACHE_SIZE = 512          # 복원한 슬롯 해시 목록 / 슬롯 dict 캐시 항목 수
+PAGE_SIZE = 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner    TEXT NOT NULL DEFAULT '',  -- 작업공간 (사용자)
+    ts       TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    product  TEXT NOT NULL,
+    bev_type TEXT NOT NULL DEFAULT '',
+    flavor   TEXT NOT NULL DEFAULT '',
+    volume   REAL,
+    result   TEXT NOT NULL DEFAULT '{}',
+    notes    TEXT NOT NULL DEFAULT '',
+    parent   INTEGER,                 -- 같은 작업공간·제품의 직전 버전
+    depth    INTEGER NOT NULL,        -- 0 = 키프레임, n = 키프레임 뒤 n번째 델타
+    slots    TEXT NOT NULL,           -- 키프레임: [해시, …], 델타: {"슬롯번호": 해시}
+    snapshot TEXT NOT NULL            -- 슬롯 해시 목록 전체의 해시 (같은 배합 찾기)
+);
+CREATE TABLE IF NOT EXISTS uses (entry INTEGER NOT NULL, owner TEXT NOT NULL DEFAULT '', name TEXT NOT NULL,
+                                 price REAL NOT NULL);
+"""
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS ix_entries_owner_product  ON entries(owner, product, ts);
+CREATE INDEX IF NOT EXISTS ix_entries_owner_bev_type ON entries(owner, bev_type, ts);
+CREATE INDEX IF NOT EXISTS ix_entries_owner_flavor   ON entries(owner, flavor, ts);
+CREATE INDEX IF NOT EXISTS ix_entries_owner_ts       ON entries(owner, ts);
+CREATE INDEX IF NOT EXISTS ix_entries_parent   ON entries(parent);
+CREATE INDEX IF NOT EXISTS ix_entries_snapshot ON entries(snapshot);
+CREATE INDEX IF NOT EXISTS ix_uses_owner ON uses(owner, name, price, entry);
+CREATE INDEX IF NOT EXISTS ix_uses_entry ON uses(entry);
+"""
+_META = 'id, ts, name, product, bev_type, flavor, volume, result, notes'
+
+
+def _default(o):
+    item = getattr(o, 'item', None)      # numpy 스칼라
+    return item() if callable(item) else str(o)
+
+
+def _canon(obj):
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=_default)
+
+
+def _digest(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def _num(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _uses(slots):
+    """단가 역색인 대상 (engine.index_history와 같은 기준 — 정제수·직접입력 제외, 배합비 > 0)"""
+    return [(str(s['원료명']), _num(s.get('단가(원/kg)', 0))) for s in slots[:19]
+            if s.get('원료명') and not s.get('is_custom') and _num(s.get('배합비(%)', 0)) > 0]
+
+
+def _day_after(d):
+    return (datetime.strptime(str(d)[:10], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+class _LRU(OrderedDict):
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def get(self, key, default=None):
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+        return default
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.size:
+            self.popitem(last=False)
+        return value
+
+
+class HistoryStore:
+    """배합 히스토리 저장소 — 프로세스당 1개를 세션들이 공유 (연결 1개 + 잠금)"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+        if 'owner' not in {r[1] for r in self._db.execute('PRAGMA table_info(entries)')}:   # owner 이전 파일
+            self._db.executescript("""
+                ALTER TABLE entries ADD COLUMN owner TEXT NOT NULL DEFAULT '';
+                ALTER TABLE uses ADD COLUMN owner TEXT NOT NULL DEFAULT '';
+                DROP INDEX IF EXISTS ix_uses_name;
+                DROP INDEX IF EXISTS ix_entries_product; DROP INDEX IF EXISTS ix_entries_bev_type;
+                DROP INDEX IF EXISTS ix_entries_flavor;  DROP INDEX IF EXISTS ix_entries_ts;""")
+        self._db.executescript(_INDEXES)
+        self.legacy_owner = self._adopt_legacy()
+        self._lock = threading.RLock()
+        self._hashes = _LRU(CACHE_SIZE)     # 배합 id → 슬롯 해시 목록
+        self._blobs = _LRU(CACHE_SIZE)      # 해시 → 슬롯 dict (불변)
+
+    def _adopt_legacy(self):
+        """owner 이전 파일의 배합('' 작업공간 — 어느 세션에서도 안 보임) → 임의 코드 작업공간으로 이관.
+        코드는 LEGACY_FILE에 기록 (이미 있으면 재사용) → 관리자가 ?ws=<코드>로 열어 확인. 이관할 게 없으면 None"""
+        if self._db.execute("SELECT 1 FROM entries WHERE owner = '' LIMIT 1").fetchone() is None:
+            return None
+        owner = os.environ.get('HISTORY_LEGACY_WS', '')
+        if not owner:
+            note = os.path.join(os.path.dirname(os.path.abspath(self.path)), LEGACY_FILE)
+            try:
+                with open(note, encoding='utf-8') as f:
+                    owner = f.read().strip()
+            except OSError:
+                pass
+            if not owner:
+                owner = secrets.token_urlsafe(16)
+                try:
+                    with open(note, 'w', encoding='utf-8') as f:
+                        f.write(owner + '\n')
+                except OSError:
+                    return None   # 코드를 남길 수 없으면 이관하지 않음 (배합은 그대로 보존)
+        self._db.execute('BEGIN')
+        try:
+            self._db.execute("UPDATE entries SET owner = ? WHERE owner = ''", (owner,))
+            self._db.execute("UPDATE uses SET owner = ? WHERE owner = ''", (owner,))
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        return owner
+
+    # ============================================================
+    # 1. 저장
+    # ============================================================
+    def _put_slots(self, slots):
+        hashes, rows = [], []
+        for s in slots:
+            body = _canon(s)
+            h = _digest(body)
+            hashes.append(h)
+            rows.append((h, body))
+        self._db.executemany('INSERT OR IGNORE INTO blobs(hash, body) VALUES (?, ?)', rows)
+        return hashes
+
+    def _encode(self, owner, product, hashes):
+        """(parent, depth, slots 컬럼) — 같은 제품 직전 버전 대비 바뀐 슬롯만, 간격이 차면 키프레임"""
+        prev = self._db.execute('SELECT id, depth FROM entries WHERE owner = ? AND product = ? ORDER BY id DESC LIMIT 1',
+                                (owner, product)).fetchone()
+        if prev is None:
+            return None, 0, json.dumps(hashes)
+        if prev[1] + 1 >= KEYFRAME_EVERY:
+            return prev[0], 0, json.dumps(hashes)
+        base = self._load_hashes(prev[0])
+        if len(hashes) != len(base):         # 슬롯 수가 다르면 델타 대신 키프레임
+            return prev[0], 0, json.dumps(hashes)
+        delta = {str(i): h for i, (a, h) in enumerate(zip(base, hashes)) if a != h}
+        return prev[0], prev[1] + 1, json.dumps(delta)
+
+    def save(self, owner, entry):
+        """entry: {name, product?, type, flavor, slots, volume, result, notes?, timestamp?} → 새 id.
+        product가 없으면 name — 같은 작업공간·product의 저장은 한 버전 사슬"""
+        product = entry.get('product') or entry['name']
+        ts = entry.get('timestamp') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock, self._db:
+            self._db.execute('BEGIN')
+            hashes = self._put_slots(entry['slots'])
+            parent, depth, body = self._encode(owner, product, hashes)
+            cur = self._db.execute(
+                'INSERT INTO entries(owner, ts, name, product, bev_type, flavor, volume, result, notes, parent, depth, '
+                'slots, snapshot) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (owner, ts, entry['name'], product, entry.get('type', '') or '', entry.get('flavor', '') or '',
+                 entry.get('volume'), _canon(entry.get('result', {})), entry.get('notes', '') or '',
+                 parent, depth, body, _digest(''.join(hashes))))
+            hid = cur.lastrowid
+            self._db.executemany('INSERT INTO uses(entry, owner, name, price) VALUES (?, ?, ?, ?)',
+                                 [(hid, owner, n, p) for n, p in _uses(entry['slots'])])
+            self._hashes.put(hid, hashes)
+        return hid
+
+    def _materialize_children(self, hid):
+        """hid를 기준으로 한 델타 버전들을 키프레임으로 바꿔 둠 (hid 수정·삭제 전)"""
+        for (child,) in self._db.execute('SELECT id FROM entries WHERE parent = ? AND depth > 0', (hid,)).fetchall():
+            full = self._load_hashes(child)
+            self._db.execute('UPDATE entries SET depth = 0, slots = ? WHERE id = ?', (json.dumps(full), child))
+
+    def _check_owner(self, owner, hid):
+        if self._db.execute('SELECT 1 FROM entries WHERE id = ? AND owner = ?', (hid, owner)).fetchone() is None:
+            raise KeyError(hid)
+
+    def update(self, owner, hid, slots=None, result=None, notes=None):
+        """저장 배합 수정 (단가 재평가 반영 등). 슬롯을 바꾸면 그 버전은 키프레임으로 다시 기록.
+        다른 작업공간의 id면 KeyError"""
+        with self._lock, self._db:
+            self._db.execute('BEGIN')
+            self._check_owner(owner, hid)
+            if slots is not None:
+                self._materialize_children(hid)
+                hashes = self._put_slots(slots)
+                self._db.execute('UPDATE entries SET depth = 0, slots = ?, snapshot = ? WHERE id = ?',
+                                 (json.dumps(hashes), _digest(''.join(hashes)), hid))
+                self._db.execute('DELETE FROM uses WHERE entry = ?', (hid,))
+                self._db.executemany('INSERT INTO uses(entry, owner, name, price) VALUES (?, ?, ?, ?)',
+                                     [(hid, owner, n, p) for n, p in _uses(slots)])
+                self._hashes.put(hid, hashes)
+            if result is not None:
+                self._db.execute('UPDATE entries SET result = ? WHERE id = ?', (_canon(result), hid))
+            if notes is not None:
+                self._db.execute('UPDATE entries SET notes = ? WHERE id = ?', (notes, hid))
+
+    def delete(self, owner, hid):
+        """다른 작업공간의 id면 KeyError"""
+        with self._lock, self._db:
+            self._db.execute('BEGIN')
+            self._check_owner(owner, hid)
+            self._materialize_children(hid)
+            self._db.execute('UPDATE entries SET parent = NULL WHERE parent = ?', (hid,))
+            self._db.execute('DELETE FROM uses WHERE entry = ?', (hid,))
+            self._db.execute('DELETE FROM entries WHERE id = ?', (hid,))
+            self._hashes.pop(hid, None)
+
+    def gc(self):
+        """어느 버전도 참조하지 않는 슬롯 blob 삭제 → 삭제 수"""
+        with self._lock, self._db:
+            self._db.execute('BEGIN')
+            used = set()
+            for (body,) in self._db.execute('SELECT slots FROM entries'):
+                v = json.loads(body)
+                used.update(v.values() if isinstance(v, dict) else v)
+            self._db.execute('CREATE TEMP TABLE IF NOT EXISTS _keep (hash TEXT PRIMARY KEY)')
+            self._db.execute('DELETE FROM _keep')
+            self._db.executemany('INSERT INTO _keep VALUES (?)', [(h,) for h in used])
+            n = self._db.execute('DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM _keep)').rowcount
+            self._blobs.clear()
+        return n
+
+    # ============================================================
+    # 2. 조회 (목록은 메타데이터만, 슬롯은 필요할 때 복원)
+    # ============================================================
+    @staticmethod
+    def _where(owner, product=None, bev_type=None, flavor=None, since=None, until=None):
+        cond, args = ['owner = ?'], [owner]
+        for col, v in (('product', product), ('bev_type', bev_type), ('flavor', flavor)):
+            if v:
+                cond.append(f'{col} = ?')
+                args.append(v)
+        if since:
+            cond.append('ts >= ?')
+            args.append(str(since)[:10])
+        if until:
+            cond.append('ts < ?')
+            args.append(_day_after(until))
+        return ' WHERE ' + ' AND '.join(cond), args
+
+    @staticmethod
+    def _meta(row):
+        hid, ts, name, product, bev_type, flavor, volume, result, notes = row
+        return {'id': hid, 'timestamp': ts[:16], 'name': name, 'product': product, 'type': bev_type,
+                'flavor': flavor, 'volume': volume, 'result': json.loads(result), 'notes': notes}
+
+    def query(self, owner, limit=PAGE_SIZE, offset=0, latest=False, **filters):
+        """작업공간의 최신순 메타데이터 목록 (slots 없음). filters: product, bev_type, flavor, since, until (날짜, until 포함).
+        latest=True면 제품별 최신 버전만"""
+        where, args = self._where(owner, **filters)
+        if latest:
+            where += ' AND id IN (SELECT MAX(id) FROM entries WHERE owner = ? GROUP BY product)'
+            args.append(owner)
+        sql = f'SELECT {_META} FROM entries{where} ORDER BY ts DESC, id DESC'
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            args += [limit, offset]
+        with self._lock:
+            return [self._meta(r) for r in self._db.execute(sql, args).fetchall()]
+
+    def count(self, owner, **filters):
+        where, args = self._where(owner, **filters)
+        with self._lock:
+            return self._db.execute(f'SELECT COUNT(*) FROM entries{where}', args).fetchone()[0]
+
+    def facets(self, owner):
+        """필터 선택지 {product, bev_type, flavor: [값, …]} (빈 값 제외)"""
+        with self._lock:
+            return {c: [v for (v,) in self._db.execute(
+                        f"SELECT DISTINCT {c} FROM entries WHERE owner = ? AND {c} != '' ORDER BY {c}", (owner,))]
+                    for c in ('product', 'bev_type', 'flavor')}
+
+    def versions(self, owner, product):
+        """제품의 전체 버전 메타데이터 (오래된 순)"""
+        with self._lock:
+            return [self._meta(r) for r in self._db.execute(
+                f'SELECT {_META} FROM entries WHERE owner = ? AND product = ? ORDER BY id', (owner, product)).fetchall()]
+
+    def same_formulation(self, owner, hid):
+        """hid와 슬롯이 완전히 같은 같은 작업공간의 다른 버전 id 목록"""
+        with self._lock:
+            return [i for (i,) in self._db.execute(
+                'SELECT id FROM entries WHERE owner = ? AND id != ? AND '
+                'snapshot = (SELECT snapshot FROM entries WHERE id = ? AND owner = ?)', (owner, hid, hid, owner))]
+
+    def _load_hashes(self, hid):
+        """키프레임까지 거슬러 올라가 델타를 순서대로 적용 (중간 결과 캐시)"""
+        chain, cur = [], hid
+        while True:
+            hit = self._hashes.get(cur)
+            if hit is not None:
+                base = hit
+                break
+            row = self._db.execute('SELECT parent, depth, slots FROM entries WHERE id = ?', (cur,)).fetchone()
+            if row is None:
+                raise KeyError(hid)
+            if row[1] == 0:
+                base = self._hashes.put(cur, json.loads(row[2]))
+                break
+            chain.append((cur, json.loads(row[2])))
+            cur = row[0]
+        for cid, delta in reversed(chain):
+            base = list(base)
+            for i, h in delta.items():
+                base[int(i)] = h
+            self._hashes.put(cid, base)
+        return base
+
+    def slots(self, owner, hid):
+        """배합 슬롯 복원 (새 dict 목록 — 수정해도 저장소와 무관). 다른 작업공간의 id면 KeyError"""
+        with self._lock:
+            self._check_owner(owner, hid)
+            hashes = self._load_hashes(hid)
+            found = {h: self._blobs.get(h) for h in dict.fromkeys(hashes)}
+            missing = [h for h, s in found.items() if s is None]
+            for i in range(0, len(missing), 500):
+                part = missing[i:i + 500]
+                for h, body in self._db.execute(
+                        f"SELECT hash, body FROM blobs WHERE hash IN ({','.join('?' * len(part))})", part):
+                    found[h] = self._blobs.put(h, json.loads(body))
+            return [dict(found[h]) for h in hashes]
+
+    def get(self, owner, hid):
+        """메타데이터 + 슬롯 (예전 세션 히스토리 항목과 같은 모양)"""
+        with self._lock:
+            row = self._db.execute(f'SELECT {_META} FROM entries WHERE id = ? AND owner = ?', (hid, owner)).fetchone()
+            if row is None:
+                raise KeyError(hid)
+            return {**self._meta(row), 'slots': self.slots(owner, hid)}
+
+    # ============================================================
+    # 3. 단가 역색인 (원료 → 저장 당시 단가 → 배합)
+    # ============================================================
+    def used_ingredients(self, owner):
+        with self._lock:
+            return [n for (n,) in self._db.execute(
+                'SELECT DISTINCT name FROM uses WHERE owner = ? ORDER BY name', (owner,))]
+
+    def stale(self, owner, prices):
+        """작업공간에서 단가가 바뀐 원료를 쓰는 배합만 → {id: {원료명: (이전, 현재)}} (engine.stale_entries와 같은 모양).
+        비용은 (원료, 저장 단가) 종류 수 + 영향 배합 수에 비례"""
+        out = {}
+        with self._lock:
+            pairs = self._db.execute('SELECT DISTINCT name, price FROM uses WHERE owner = ?', (owner,)).fetchall()
+            for name, old in pairs:
+                new = prices.get(name)
+                if new is None or new == old:
+                    continue
+                for (hid,) in self._db.execute('SELECT entry FROM uses WHERE owner = ? AND name = ? AND price = ?',
+                                               (owner, name, old)):
+                    out.setdefault(hid, {})[name] = (old, new)
+        return out
+
+    def stats(self, owner):
+        """(작업공간 배합 수, 제품 수, 전체 슬롯 blob 수, 파일 바이트)"""
+        with self._lock:
+            n, p = self._db.execute('SELECT COUNT(*), COUNT(DISTINCT product) FROM entries WHERE owner = ?',
+                                    (owner,)).fetchone()
+            b = self._db.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+            size = self._db.execute('PRAGMA page_count').fetchone()[0] * self._db.execute('PRAGMA page_size').fetchone()[0]
+        return n, p, b, size
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,151 @@
+"""
+image_store.py — 생성 이미지 로컬 저장소 (내용 주소 방식)
+- 키: sha256(모델, 프롬프트, 사이즈, 품질) — 같은 프롬프트는 재생성 없이 재사용
+- DALL-E 임시 URL은 생성 직후 1회만 다운로드, 이후 원본/썸네일을 디스크에서 제공
+- 용량 상한 초과 시 마지막 접근이 오래된 이미지부터 삭제 (LRU)
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+STORE_DIR = os.environ.get(
+    'IMAGE_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.image_store'))
+MAX_BYTES = int(float(os.environ.get('IMAGE_STORE_MAX_MB', 500)) * 1024 * 1024)
+THUMB_PX = 768            # 화면 표시용 썸네일 긴 변 (px)
+
+_lock = threading.Lock()
+
+
+def image_key(prompt, size="1024x1024", quality="standard", model="dall-e-3"):
+    raw = '\x1f'.join([model, size, quality, prompt.strip()])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _path(key, suffix=''):
+    return os.path.join(STORE_DIR, key[:2], f"{key}{suffix}.png")
+
+
+def _touch(path):
+    """LRU 순서 = mtime. 읽을 때마다 갱신"""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def has(key):
+    return bool(key) and os.path.exists(_path(key))
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def put_bytes(key, data):
+    path = _path(key)
+    _write_atomic(path, data)
+    evict()
+    return path
+
+
+def put_url(key, url, timeout=30):
+    """임시 URL을 1회 다운로드해 저장. 저장 경로 반환 (실패 시 예외)"""
+    import requests
+    resp = requests.get(url, timeout=timeout)
+    resp.raise_for_status()
+    return put_bytes(key, resp.content)
+
+
+def full_path(key):
+    path = _path(key)
+    _touch(path)
+    return path
+
+
+def read_bytes(key):
+    with open(full_path(key), 'rb') as f:
+        return f.read()
+
+
+def thumbnail(key, max_px=THUMB_PX):
+    """썸네일 경로 (최초 요청 시 생성). PIL이 없으면 원본 경로"""
+    src, dst = _path(key), _path(key, f'_t{max_px}')
+    if os.path.exists(dst):
+        _touch(dst)
+        _touch(src)
+        return dst
+    try:
+        from PIL import Image
+    except ImportError:
+        return full_path(key)
+    with Image.open(src) as im:
+        im.thumbnail((max_px, max_px))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), suffix='.tmp')
+        os.close(fd)
+        im.save(tmp, format='PNG', optimize=True)
+        os.replace(tmp, dst)
+    _touch(src)
+    return dst
+
+
+def get_or_create(prompt, size, quality, generate, model="dall-e-3"):
+    """저장소에 있으면 키만 반환, 없으면 generate()로 URL을 받아 저장.
+    (키, 저장소적중여부) 반환"""
+    key = image_key(prompt, size, quality, model)
+    if has(key):
+        _touch(_path(key))
+        return key, True
+    put_url(key, generate())
+    return key, False
+
+
+def evict(max_bytes=None):
+    """총 용량이 상한을 넘으면 마지막 접근이 오래된 키부터 원본+썸네일 함께 삭제"""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    with _lock:
+        entries = {}
+        for root, _, files in os.walk(STORE_DIR):
+            for fn in files:
+                if not fn.endswith('.png'):
+                    continue
+                p = os.path.join(root, fn)
+                try:
+                    st_ = os.stat(p)
+                except OSError:
+                    continue
+                key = fn[:64]
+                size, mtime = entries.get(key, (0, 0.0))
+                entries[key] = (size + st_.st_size, max(mtime, st_.st_mtime))
+        total = sum(s for s, _ in entries.values())
+        removed = 0
+        for key, (size, _) in sorted(entries.items(), key=lambda kv: kv[1][1]):
+            if total <= max_bytes:
+                break
+            d = os.path.join(STORE_DIR, key[:2])
+            for fn in os.listdir(d):
+                if fn.startswith(key):
+                    try:
+                        os.remove(os.path.join(d, fn))
+                    except OSError:
+                        pass
+            total -= size
+            removed += 1
+        return removed
+
+
+def usage():
+    """(이미지 수, 총 바이트)"""
+    n = total = 0
+    for root, _, files in os.walk(STORE_DIR):
+        for fn in files:
+            if fn.endswith('.png'):
+                total += os.path.getsize(os.path.join(root, fn))
+                n += '_t' not in fn
+    return n, total
@@ -0,0 +1,85 @@
+"""
+keyword_matcher.py — 다중 키워드 표 동시 검색 (Aho-Corasick 오토마톤)
+- 여러 키워드 표(알레르기·공정 아이콘·프롬프트 매핑 등)를 오토마톤 1개로 컴파일
+- 텍스트 1회 선형 스캔으로 모든 표의 매칭 항목을 찾음 — 키워드 수가 늘어도 스캔 비용은 텍스트 길이에 비례
+- 결과 순서는 각 표(dict)의 항목 순서를 따름 (기존 'for k in 표: if k in text' 규칙과 동일)
+"""
+import functools
+from collections import deque
+
+
+class KeywordMatcher:
+    """tables: {표이름: {항목: [키워드, ...]}} — 대소문자 구분, 빈 키워드는 무시"""
+
+    def __init__(self, tables, cache_size=4096):
+        self.tables = {t: list(items) for t, items in tables.items()}   # 표별 항목 순서
+        self._goto = [{}]
+        self._out = [set()]
+        for t, items in tables.items():
+            for item, keywords in items.items():
+                for kw in keywords:
+                    if kw:
+                        self._add(kw, (t, item))
+        self._fail = self._link()
+        self._out = [frozenset(o) for o in self._out]
+        self.find = functools.lru_cache(maxsize=cache_size)(self._scan)
+
+    # ============================================================
+    # 1. 오토마톤 구성
+    # ============================================================
+    def _add(self, keyword, label):
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._out.append(set())
+                self._goto[node][ch] = nxt
+            node = nxt
+        self._out[node].add(label)
+
+    def _link(self):
+        """실패 링크 (BFS) — 접미사 노드의 출력도 합쳐 둠"""
+        goto, out = self._goto, self._out
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] |= out[fail[nxt]]
+        return fail
+
+    # ============================================================
+    # 2. 검색
+    # ============================================================
+    def _scan(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        node, found = 0, set()
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return frozenset(found)
+
+    def pick(self, found, table):
+        """find() 결과 중 table 항목만, 표 순서대로"""
+        return [item for item in self.tables[table] if (table, item) in found]
+
+    def matches(self, text, table):
+        return self.pick(self.find(str(text)), table)
+
+    def first(self, text, table, default=None):
+        """표 순서상 가장 앞의 매칭 항목 (없으면 default)"""
+        found = self.find(str(text))
+        for item in self.tables[table]:
+            if (table, item) in found:
+                return item
+        return default
@@ -0,0 +1,144 @@
+"""
+llm_gateway.py — 프로세스 공용 LLM 호출 게이트웨이
+- 요청 병합(single-flight): 동시에 들어온 동일 요청은 하나의 API 호출을 공유
+- 토큰버킷 속도제한: 공급자별 분당 요청수/토큰수, 한도 초과 시 오류 대신 대기열
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+# ============================================================
+# 1. 공급자별 한도 (분당 요청수, 분당 토큰수)
+# ============================================================
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+RATE_LIMITS = {
+    'openai': (_env_int('OPENAI_RPM', 500), _env_int('OPENAI_TPM', 200000)),
+    'gemini': (_env_int('GEMINI_RPM', 150), _env_int('GEMINI_TPM', 1000000)),
+}
+
+
+def estimate_tokens(text, max_tokens=0):
+    """한국어 위주 프롬프트 토큰 추정 (≈1.5자/토큰) + 출력 한도.
+    OpenAI TPM은 max_tokens까지 예약 차감하므로 함께 계산."""
+    return int(len(str(text or '')) / 1.5) + int(max_tokens or 0)
+
+
+# ============================================================
+# 2. 토큰버킷 (예약 방식 — 먼저 온 요청이 먼저 나감)
+# ============================================================
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.rate = max(per_minute, 1) / 60.0
+        self.capacity = float(max(per_minute, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, n=1):
+        """n개를 즉시 차감(음수 허용)하고, 잔량이 0 이상이 될 때까지의 대기시간(초) 반환"""
+        n = min(float(n), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """요청수 버킷 + 토큰수 버킷. acquire()는 두 버킷 중 긴 쪽만큼 대기."""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def acquire(self, tokens=0):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens) if tokens else 0.0)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+LIMITERS = {p: RateLimiter(rpm, tpm) for p, (rpm, tpm) in RATE_LIMITS.items()}
+
+
+def configure_limits(provider, rpm, tpm):
+    """런타임 한도 변경 (예: 유료 티어 상향 시)"""
+    RATE_LIMITS[provider] = (rpm, tpm)
+    LIMITERS[provider] = RateLimiter(rpm, tpm)
+
+
+# ============================================================
+# 3. 요청 병합 (single-flight)
+# ============================================================
+class _Flight:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        """같은 key로 진행 중인 호출이 있으면 그 결과를 기다려 공유. (결과, 공유여부) 반환"""
+        with self.lock:
+            flight = self.calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.calls[key] = _Flight()
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            flight.event.set()
+        return flight.result, False
+
+
+_FLIGHT = SingleFlight()
+
+
+def request_key(*parts):
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def call_shared(provider, key_parts, fn, tokens=0):
+    """게이트웨이 경유 호출. (결과, 공유여부) 반환.
+    key_parts가 같은 동시 요청은 fn을 한 번만 실행하고 결과를 공유(결과는 읽기전용으로 취급).
+    실제 실행 직전에만 속도제한 대기열을 통과하므로 병합된 요청은 한도를 소모하지 않음."""
+    limiter = LIMITERS.get(provider)
+
+    def _run():
+        if limiter:
+            limiter.acquire(tokens)
+        return fn()
+
+    return _FLIGHT.do(request_key(provider, *key_parts), _run)
+
+
+def call(provider, key_parts, fn, tokens=0):
+    return call_shared(provider, key_parts, fn, tokens)[0]
@@ -0,0 +1,189 @@
+"""
+llm_metrics.py — LLM 호출 계측 (지연시간·토큰·비용, 페이지/페르소나별)
+- track(): 호출 1건을 감싸 wall time, TTFB, 토큰, 모델, 캐시상태, 결과를 기록
+- 로컬 SQLite 저장소 (.metrics/llm_calls.sqlite3, LLM_METRICS_DB로 변경)
+- load_calls()/latency_table()/daily_spend(): 관리자 대시보드용 집계
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+METRICS_DB = os.environ.get(
+    'LLM_METRICS_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.metrics', 'llm_calls.sqlite3'))
+ENABLED = os.environ.get('LLM_METRICS', '1') != '0'
+LISTENERS = []   # 호출 1건 기록 직후 rec를 받는 콜백 (perf_profile 등)
+
+# USD — 토큰은 1M 토큰당 (입력, 출력), 이미지는 장당
+PRICES = {
+    'gpt-4o':           (2.50, 10.00),
+    'gpt-4o-mini':      (0.15, 0.60),
+    'gemini-2.5-pro':   (1.25, 10.00),
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-1.5-pro':   (1.25, 5.00),
+    'gemini-1.5-flash': (0.075, 0.30),
+}
+IMAGE_PRICES = {
+    ('dall-e-3', '1024x1024', 'standard'): 0.040,
+    ('dall-e-3', '1024x1024', 'hd'):       0.080,
+    ('dall-e-3', '1024x1792', 'standard'): 0.080,
+    ('dall-e-3', '1792x1024', 'standard'): 0.080,
+    ('dall-e-3', '1024x1792', 'hd'):       0.120,
+    ('dall-e-3', '1792x1024', 'hd'):       0.120,
+}
+
+
+# ============================================================
+# 1. 호출 컨텍스트 (Streamlit 세션 = 스레드)
+# ============================================================
+_ctx = threading.local()
+
+
+def set_page(page):
+    """현재 스레드(세션 rerun)의 페이지명 — 라우터에서 페이지 함수 호출 전에 설정"""
+    _ctx.page = page
+
+
+def current_page():
+    return getattr(_ctx, 'page', '')
+
+
+class CallRecord:
+    def __init__(self, provider, model, persona):
+        self.provider = provider
+        self.model = model
+        self.persona = persona or ''
+        self.page = current_page()
+        self.t0 = time.perf_counter()
+        self.ttfb_ms = None
+        self.wall_ms = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.image = None            # (size, quality) — 이미지 호출만
+        self.cache = 'miss'          # miss / coalesced / hit
+        self.outcome = 'ok'
+        self.error = ''
+
+    def first_byte(self, *args, **kwargs):
+        """httpx/requests 응답 훅 — 헤더 수신 시점 기록 (반환값 없음 필수)"""
+        if self.ttfb_ms is None:
+            self.ttfb_ms = (time.perf_counter() - self.t0) * 1000
+
+    def usage(self, prompt_tokens=0, completion_tokens=0):
+        self.prompt_tokens = int(prompt_tokens or 0)
+        self.completion_tokens = int(completion_tokens or 0)
+
+    @property
+    def cost_usd(self):
+        if self.cache != 'miss' or self.outcome != 'ok':
+            return 0.0
+        if self.image:
+            return IMAGE_PRICES.get((self.model, *self.image), 0.0)
+        p_in, p_out = PRICES.get(self.model, (0.0, 0.0))
+        return (self.prompt_tokens * p_in + self.completion_tokens * p_out) / 1e6
+
+
+@contextmanager
+def track(provider, model, persona=''):
+    """LLM 호출 1건 계측. 예외는 outcome='error'로 기록 후 그대로 전파."""
+    rec = CallRecord(provider, model, persona)
+    try:
+        yield rec
+    except Exception as e:
+        rec.outcome = 'error'
+        rec.error = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        rec.wall_ms = (time.perf_counter() - rec.t0) * 1000
+        _write(rec)
+        for fn in LISTENERS:
+            try:
+                fn(rec)
+            except Exception:
+                pass
+
+
+# ============================================================
+# 2. SQLite 저장소
+# ============================================================
+_lock = threading.Lock()
+_conn = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    ts TEXT, day TEXT, page TEXT, persona TEXT, provider TEXT, model TEXT,
+    wall_ms REAL, ttfb_ms REAL, prompt_tokens INTEGER, completion_tokens INTEGER,
+    cache TEXT, outcome TEXT, error TEXT, cost_usd REAL
+);
+CREATE INDEX IF NOT EXISTS ix_llm_calls_ts ON llm_calls(ts);
+"""
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(METRICS_DB) or '.', exist_ok=True)
+        _conn = sqlite3.connect(METRICS_DB, check_same_thread=False)
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+
+def _write(rec):
+    if not ENABLED:
+        return
+    now = datetime.now()
+    row = (now.isoformat(timespec='seconds'), now.strftime('%Y-%m-%d'), rec.page, rec.persona,
+           rec.provider, rec.model, round(rec.wall_ms, 1),
+           None if rec.ttfb_ms is None else round(rec.ttfb_ms, 1),
+           rec.prompt_tokens, rec.completion_tokens, rec.cache, rec.outcome, rec.error,
+           rec.cost_usd)
+    try:
+        with _lock:
+            conn = _db()
+            conn.execute("INSERT INTO llm_calls VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)", row)
+            conn.commit()
+    except Exception:
+        pass  # 계측 실패가 본 기능을 막지 않도록
+
+
+# ============================================================
+# 3. 집계 (대시보드)
+# ============================================================
+def load_calls(days=7):
+    import pandas as pd
+    since = (datetime.now() - timedelta(days=days)).isoformat(timespec='seconds')
+    with _lock:
+        return pd.read_sql_query("SELECT * FROM llm_calls WHERE ts >= ? ORDER BY ts",
+                                 _db(), params=(since,))
+
+
+def latency_table(df, by='persona'):
+    """그룹별 호출수·p50/p95/p99·TTFB·토큰·비용"""
+    import pandas as pd
+    if df.empty:
+        return pd.DataFrame()
+    g = df.groupby(by, dropna=False)
+    out = pd.DataFrame({
+        '호출수': g.size(),
+        '오류율(%)': g['outcome'].apply(lambda s: (s != 'ok').mean() * 100).round(1),
+        '병합/캐시(%)': g['cache'].apply(lambda s: (s != 'miss').mean() * 100).round(1),
+        'p50(ms)': g['wall_ms'].quantile(0.50).round(0),
+        'p95(ms)': g['wall_ms'].quantile(0.95).round(0),
+        'p99(ms)': g['wall_ms'].quantile(0.99).round(0),
+        'TTFB p50(ms)': g['ttfb_ms'].quantile(0.50).round(0),
+        '입력토큰': g['prompt_tokens'].sum(),
+        '출력토큰': g['completion_tokens'].sum(),
+        '비용($)': g['cost_usd'].sum().round(4),
+    })
+    return out.sort_values('비용($)', ascending=False).reset_index()
+
+
+def daily_spend(df):
+    import pandas as pd
+    if df.empty:
+        return pd.DataFrame()
+    return df.pivot_table(index='day', columns='provider', values='cost_usd',
+                          aggfunc='sum', fill_value=0).round(4)
@@ -0,0 +1,260 @@
+"""
+loadtest_app.py — 다중 세션 부하 테스트 (Streamlit AppTest + fake_llm_server)
+
+수업(40명+)처럼 여러 세션이 동시에 교육용 실습/배합 시뮬레이터를 조작할 때 서버가 어디서 포화되는지 측정.
+세션 1개 = AppTest 1개 = 스레드 1개 (실서버도 세션별 스크립트 스레드가 한 프로세스를 공유).
+AppTest는 실행마다 전역(Runtime·secrets·config)을 바꿔 끼우므로, 실서버처럼 하나를 공유하도록 고정해 씀.
+동시 세션 수를 단계적으로 늘리며 rerun 지연 p50/p95/p99, 처리량, 세션당 메모리를 보고하고
+p95가 --slo-ms 이내인 최대 동시 세션 수를 산출.
+
+예) python loadtest_app.py --ramp 1,4,8,16,32,48 --flows education,simulator --iterations 3
+    python loadtest_app.py --ramp 8 --with-llm --median-ms 600 --json load.json
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_llm_server  # noqa: E402
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+PAGE_SIM, PAGE_EDU = "🧪 배합 시뮬레이터", "🎓 교육용 실습"
+
+
+# ============================================================
+# 1. 세션 1개 조작 (AppTest 위젯 API)
+# ============================================================
+SECRETS = {"OPENAI_API_KEY": "sk-fake-load", "GEMINI_API_KEY": "fake-gemini-key"}
+
+
+def share_apptest_globals():
+    """AppTest를 여러 스레드에서 동시에 돌릴 수 있게 전역 상태를 1벌로 고정.
+    - Runtime: 공용 mock 1개 (st.cache_data 저장소도 실서버처럼 세션 간 공유)
+    - ScriptCache: app.py 컴파일 1회 공유 (실서버와 동일; 스레드별 동시 ast.parse 회피)
+    - secrets / config('global.appTest'): 실행마다 교체·복원하지 않도록 미리 설정"""
+    import contextlib
+    from unittest.mock import MagicMock
+    import streamlit as st
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test
+    from streamlit.testing.v1.util import build_mock_config_get_option
+
+    rt = MagicMock(spec=Runtime)
+    rt.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    rt.cache_storage_manager = MemoryCacheStorageManager()
+    rt.dataframe_source_mgr = app_test.DataframeSourceManager()
+    bidi = app_test.BidiComponentManager()
+    bidi.discover_and_register_components(start_file_watching=False)
+    rt.bidi_component_registry = bidi
+    Runtime.instance = classmethod(lambda cls: rt)
+    Runtime.exists = classmethod(lambda cls: True)
+
+    st.secrets = Secrets()
+    st.secrets._secrets = dict(SECRETS)
+    config.get_option = build_mock_config_get_option({"global.appTest": True})
+    app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+    script_cache = app_test.ScriptCache()
+    script_cache.get_bytecode(APP_PATH)      # 스레드 시작 전 미리 컴파일
+    app_test.ScriptCache = lambda: script_cache
+
+
+class Session:
+    """AppTest 래퍼 — 매 조작(rerun) 지연을 기록"""
+
+    def __init__(self, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.lat = []         # (단계명, ms)
+        self.errors = []
+
+    def step(self, name, widget_action):
+        t0 = time.perf_counter()
+        try:
+            widget_action().run()
+            if self.at.exception:
+                self.errors.append(f"{name}: {self.at.exception[0].value[:200]}")
+        except Exception as e:
+            self.errors.append(f"{name}: {type(e).__name__}: {e}"[:200])
+        self.lat.append((name, (time.perf_counter() - t0) * 1000))
+
+    def widget(self, kind, key=None, label=None):
+        for w in getattr(self.at, kind):
+            if (key is None or w.key == key) and (label is None or label in (w.label or '')):
+                return w
+        raise LookupError(f"{kind} key={key} label={label} 없음")
+
+    def go(self, page):
+        self.step(f"open:{page}", lambda: self.at.sidebar.radio[0].set_value(page))
+
+
+def flow_education(s, rng, with_llm=False):
+    """실습: 음료유형 선택 → 단계별 원료 선택·배합비 입력 → 규격판정 확인"""
+    s.go(PAGE_EDU)
+    bev = s.widget('selectbox', key='edu_bev')
+    s.step('edu:bev', lambda: bev.set_value(rng.choice(bev.options)))
+    for si in (0, 4, 12):
+        sel = s.widget('selectbox', key=f'ei{si}')
+        s.step('edu:pick', lambda sel=sel: sel.set_value(rng.choice(sel.options[1:])))
+        s.step('edu:pct', lambda si=si: s.widget('number_input', key=f'ep{si}')
+               .set_value(round(rng.uniform(0.1, 10), 2)))
+
+
+def flow_simulator(s, rng, with_llm=False):
+    """시뮬레이터: 음료유형 선택 → 가이드 로딩 → 행 편집(배합비·원료) → 결과/규격판정 (+AI 추천·에이전트)"""
+    s.go(PAGE_SIM)
+    bt = s.widget('selectbox', label='음료유형')
+    s.step('sim:bev', lambda: bt.set_value(bt.options[rng.randrange(3)]))
+    s.step('sim:guide', lambda: s.widget('button', label='가이드배합비').click())
+    for idx in (0, 1, 4):
+        s.step('sim:pct', lambda idx=idx: s.widget('number_input', key=f'pct{idx}')
+               .set_value(round(rng.uniform(0.5, 8), 3)))
+    sel = s.widget('selectbox', key='i5')
+    s.step('sim:pick', lambda: sel.set_value(rng.choice(sel.options[2:])))
+    if with_llm:
+        s.step('sim:ai', lambda: s.widget('button', label='AI 추천배합비').click())
+        if s.at.chat_input:
+            s.step('sim:agent', lambda: s.at.chat_input[0].set_value("산미를 조금 올려줘"))
+
+
+FLOWS = {'education': flow_education, 'simulator': flow_simulator}
+
+
+# ============================================================
+# 2. 동시 실행 / 집계
+# ============================================================
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss / 2**20
+        except ImportError:
+            return float('nan')
+
+
+def run_level(n, flows, iterations, think_ms, timeout, with_llm, seed):
+    """동시 세션 n개 — 전원 세션 생성·첫 실행 후 동시에 시나리오 반복. 결과 dict"""
+    gc.collect()
+    rss0 = _rss_mb()
+    sessions = [None] * n
+    ready = threading.Barrier(n + 1)
+
+    def worker(i):
+        rng = random.Random(seed * 1000 + i)
+        s = Session(timeout)
+        s.step('init', lambda: s.at)
+        sessions[i] = s
+        ready.wait()
+        for it in range(iterations):
+            try:
+                FLOWS[flows[(i + it) % len(flows)]](s, rng, with_llm)
+            except LookupError as e:     # 이전 조작 실패로 위젯이 안 그려짐 → 이번 시나리오 중단
+                s.errors.append(f"flow: {e}")
+            if think_ms:
+                time.sleep(rng.uniform(0.5, 1.5) * think_ms / 1000)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(n)]
+    for t in threads:
+        t.start()
+    ready.wait()                 # 모든 세션이 살아 있는 시점의 메모리
+    rss_live = _rss_mb()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    lat = np.array([ms for s in sessions for name, ms in s.lat if name != 'init'])
+    by_step = {}
+    for s in sessions:
+        for name, ms in s.lat:
+            by_step.setdefault(name.split(':')[0] + ':' + name.split(':')[-1], []).append(ms)
+    errors = [e for s in sessions for e in s.errors]
+    del sessions
+    return {
+        'sessions': n, 'reruns': int(len(lat)), 'errors': len(errors),
+        'throughput_rps': round(len(lat) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(float(np.percentile(lat, 50)), 1) if len(lat) else None,
+        'p95_ms': round(float(np.percentile(lat, 95)), 1) if len(lat) else None,
+        'p99_ms': round(float(np.percentile(lat, 99)), 1) if len(lat) else None,
+        'max_ms': round(float(lat.max()), 1) if len(lat) else None,
+        'rss_mb': round(rss_live, 1),
+        'mb_per_session': round((rss_live - rss0) / n, 2),
+        'steps_p95_ms': {k: round(float(np.percentile(v, 95)), 1) for k, v in sorted(by_step.items())},
+        'sample_error': errors[0] if errors else '',
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Streamlit 다중 세션 부하 테스트 (AppTest)")
+    ap.add_argument('--ramp', default='1,4,8,16,32,48', help='단계별 동시 세션 수')
+    ap.add_argument('--flows', default='education,simulator', help=f"시나리오 ({','.join(FLOWS)})")
+    ap.add_argument('--iterations', type=int, default=2, help='세션당 시나리오 반복 횟수')
+    ap.add_argument('--think-ms', type=float, default=0, help='조작 사이 사용자 대기시간(평균)')
+    ap.add_argument('--slo-ms', type=float, default=1000, help='rerun p95 목표 (지속 가능 판정 기준)')
+    ap.add_argument('--max-error-rate', type=float, default=0.01)
+    ap.add_argument('--timeout', type=float, default=120, help='rerun 1회 제한시간(초)')
+    ap.add_argument('--with-llm', action='store_true', help='AI 추천배합·Gemini 에이전트 단계 포함')
+    ap.add_argument('--median-ms', type=float, default=400, help='대역 LLM 응답 지연 중앙값')
+    ap.add_argument('--keep-going', action='store_true', help='SLO 초과 후에도 다음 단계 계속')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--json', help='결과 JSON 저장 경로')
+    a = ap.parse_args()
+
+    logging.disable(logging.WARNING)    # AppTest 세션마다 나오는 경고 억제
+    cfg = fake_llm_server.FakeConfig('lognormal', a.median_ms, 0.5, seed=a.seed)
+    server, base = fake_llm_server.start_server(config=cfg)
+    os.environ['OPENAI_BASE_URL'] = base + '/v1'
+    os.environ['GEMINI_API_BASE'] = base
+    os.environ.setdefault('LLM_METRICS', '0')
+    share_apptest_globals()
+    import llm_gateway
+    for p in list(llm_gateway.RATE_LIMITS):
+        llm_gateway.configure_limits(p, 10**6, 10**9)
+
+    flows = [f.strip() for f in a.flows.split(',') if f.strip() in FLOWS]
+    levels = [int(x) for x in a.ramp.split(',') if x.strip()]
+    rows, sustainable = [], 0
+    print(f"flows={','.join(flows)} iterations={a.iterations} slo_p95={a.slo_ms:.0f}ms llm={'on' if a.with_llm else 'off'}")
+    print(f"{'sessions':>8}{'reruns':>8}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'MB/sess':>9}{'RSS':>8}{'err':>5}")
+    for n in levels:
+        r = run_level(n, flows, a.iterations, a.think_ms, a.timeout, a.with_llm, a.seed)
+        rows.append(r)
+        ok = (r['p95_ms'] is not None and r['p95_ms'] <= a.slo_ms
+              and r['errors'] <= a.max_error_rate * max(1, r['reruns']))
+        print(f"{n:>8}{r['reruns']:>8}{r['throughput_rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+              f"{r['p99_ms']:>9}{r['mb_per_session']:>9}{r['rss_mb']:>8.0f}{r['errors']:>5}"
+              f"{'' if ok else '  ✗ SLO'}")
+        if r['sample_error']:
+            print(f"  └ {r['sample_error']}")
+        if ok:
+            sustainable = n
+        elif not a.keep_going:
+            break
+    slow = max(rows[-1]['steps_p95_ms'].items(), key=lambda kv: kv[1]) if rows else None
+    print(f"\n최대 지속 가능 동시 세션: {sustainable} (p95 ≤ {a.slo_ms:.0f}ms)")
+    if slow:
+        print(f"마지막 단계에서 가장 느린 조작: {slow[0]} p95 {slow[1]:,.0f}ms")
+    if a.json:
+        with open(a.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(a), 'max_sustainable_sessions': sustainable, 'levels': rows},
+                      f, ensure_ascii=False, indent=2)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+perf_profile.py — 앱 rerun 단위 서버 처리시간 계측 (opt-in)
+- 켜기: 환경변수 APP_PROFILE=1 (또는 cprofile / pyinstrument). APP_PROFILE=url이면 평소엔 꺼 두고 URL ?profile=… 요청만 계측
+  (환경변수가 없으면 URL 파라미터는 무시 — 방문자가 디스크 기록을 켜지 못하도록)
+- rerun 1회 = 페이지 함수 1회. 시간을 DB / 엔진 / LLM / 위젯 렌더링(나머지)으로 분해
+- 가장 느린 rerun 몇 개는 cProfile(.prof) / pyinstrument(.html)로 .profiles/에 보관
+- 기록: .metrics/app_profile.jsonl (APP_PROFILE_LOG로 변경) — 배포 환경 회귀 추적용, APP_PROFILE_LOG_MB 넘으면 .1로 교체
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import llm_metrics
+
+MODE = os.environ.get('APP_PROFILE', '').strip().lower()     # '' / 1 / cprofile / pyinstrument / url
+LOG_PATH = os.environ.get(
+    'APP_PROFILE_LOG',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.metrics', 'app_profile.jsonl'))
+PROFILE_DIR = os.environ.get(
+    'APP_PROFILE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.profiles'))
+KEEP_SLOWEST = int(os.environ.get('APP_PROFILE_KEEP', 5))   # 보관할 느린 rerun 프로파일 수
+LOG_MAX_BYTES = int(float(os.environ.get('APP_PROFILE_LOG_MB', 20)) * 1024 * 1024)   # 넘으면 LOG_PATH.1로 교체
+MODES = ('1', 'cprofile', 'pyinstrument')
+
+# 엔진 함수 중 DB 조회로 분류할 것 (나머지는 '엔진')
+DB_FUNCS = {'load_data', 'load_nutrients', 'load_substitutes', 'load_prices', 'load_history', 'load_db', 'prepare_db', 'ph_column', 'get_spec', 'match_process'}
+
+_ctx = threading.local()
+_lock = threading.Lock()
+_slowest = []          # [(total_ms, 파일경로)] — 프로세스 공용, 느린 순 KEEP_SLOWEST개
+
+
+def resolve_mode(query_value=None):
+    """환경변수 모드. APP_PROFILE=url일 때만 URL 쿼리 값을 따름. 꺼져 있으면 ''"""
+    m = str(query_value or '').strip().lower() if MODE == 'url' else MODE
+    if m in ('true', 'on', 'yes'):
+        m = '1'
+    return m if m in MODES else ''
+
+
+# ============================================================
+# 1. rerun 기록
+# ============================================================
+class Rerun:
+    def __init__(self, page, mode, session=''):
+        self.page = page
+        self.mode = mode
+        self.session = session
+        self.t0 = time.perf_counter()
+        self.ms = {'db': 0.0, 'engine': 0.0, 'llm': 0.0}
+        self.calls = Counter()      # 함수별 누적 ms
+        self.n_llm = 0
+        self.stack = []             # 바깥 계측 호출 안에서 발생한 LLM ms (중복 집계 방지)
+        self.total_ms = 0.0
+        self.profile_path = ''
+        self._prof = None
+
+    def add(self, cat, name, ms):
+        self.ms[cat] += ms
+        self.calls[name] += ms
+
+    def summary(self):
+        s = {k: round(v, 1) for k, v in self.ms.items()}
+        return {
+            'ts': datetime.now().isoformat(timespec='seconds'), 'session': self.session,
+            'page': self.page, 'total_ms': round(self.total_ms, 1),
+            'db_ms': s['db'], 'engine_ms': s['engine'], 'llm_ms': s['llm'],
+            'render_ms': round(max(0.0, self.total_ms - sum(self.ms.values())), 1),
+            'llm_calls': self.n_llm,
+            'top': [[k, round(v, 1)] for k, v in self.calls.most_common(5)],
+            'profile': self.profile_path,
+        }
+
+
+def current():
+    return getattr(_ctx, 'run', None)
+
+
+def _on_llm(rec):
+    run = current()
+    if run is None:
+        return
+    run.n_llm += 1
+    run.add('llm', f"llm:{rec.provider}/{rec.model}", rec.wall_ms)
+    if run.stack:
+        run.stack[-1] += rec.wall_ms
+
+
+def _timed(fn, cat):
+    @functools.wraps(fn)
+    def inner(*args, **kwargs):
+        run = current()
+        if run is None or run.stack:      # 계측 꺼짐 / 중첩 호출은 바깥 호출에 포함
+            return fn(*args, **kwargs)
+        run.stack.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            run.add(cat, fn.__name__, ms - run.stack.pop())   # LLM 대기 시간은 LLM으로
+    inner.__perf_wrapped__ = True
+    return inner
+
+
+def instrument(namespace, module, extra=()):
+    """namespace(app 전역)에 들어온 module 함수들을 계측 래퍼로 교체. extra: 추가로 감쌀 이름"""
+    names = [n for n, v in vars(module).items()
+             if callable(v) and not n.startswith('_') and getattr(v, '__module__', '') == module.__name__
+             and not isinstance(v, type)]
+    for n in list(names) + list(extra):
+        f = namespace.get(n)
+        if f is None or getattr(f, '__perf_wrapped__', False) or isinstance(f, type):
+            continue
+        namespace[n] = _timed(f, 'db' if n in DB_FUNCS else 'engine')
+
+
+def start(page, mode, session=''):
+    """rerun 시작 — 스크립트 맨 앞(DB 로딩 전)에서 호출"""
+    if llm_metrics.LISTENERS.count(_on_llm) == 0:
+        llm_metrics.LISTENERS.append(_on_llm)
+    run = Rerun(page, mode, session)
+    _ctx.run = run
+    if mode == 'cprofile':
+        import cProfile
+        run._prof = cProfile.Profile()
+        run._prof.enable()
+    elif mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+            run._prof = Profiler()
+            run._prof.start()
+        except ImportError:
+            run.mode = '1'
+    return run
+
+
+def set_page(page):
+    run = current()
+    if run is not None:
+        run.page = page
+
+
+def finish():
+    """rerun 종료 — 요약 dict 반환 (로그 파일에도 1줄 추가). 계측 중이 아니면 None"""
+    run = current()
+    if run is None:
+        return None
+    _ctx.run = None
+    run.total_ms = (time.perf_counter() - run.t0) * 1000
+    if run._prof is not None:
+        _keep_profile(run)
+    row = run.summary()
+    _append(row)
+    return row
+
+
+def record_fragment(section, ms, session=''):
+    """프래그먼트 단독 재실행(페이지 전체 rerun 아님) 시간 기록"""
+    _append({'ts': datetime.now().isoformat(timespec='seconds'), 'session': session,
+             'page': f"fragment:{section}", 'total_ms': round(ms, 1)})
+
+
+# ============================================================
+# 2. 느린 rerun 프로파일 보관
+# ============================================================
+def _keep_profile(run):
+    if run.mode == 'cprofile':
+        run._prof.disable()
+    else:
+        run._prof.stop()
+    with _lock:
+        if len(_slowest) >= KEEP_SLOWEST and run.total_ms <= _slowest[-1][0]:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stem = f"{datetime.now():%Y%m%d_%H%M%S}_{int(run.total_ms)}ms_{_safe(run.page)}"
+        if run.mode == 'cprofile':
+            path = os.path.join(PROFILE_DIR, stem + '.prof')
+            run._prof.dump_stats(path)
+        else:
+            path = os.path.join(PROFILE_DIR, stem + '.html')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(run._prof.output_html())
+        run.profile_path = path
+        _slowest.append((run.total_ms, path))
+        _slowest.sort(key=lambda x: -x[0])
+        while len(_slowest) > KEEP_SLOWEST:
+            _, old = _slowest.pop()
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def _safe(text):
+    return ''.join(ch for ch in str(text) if ch.isalnum())[:20] or 'page'
+
+
+def slowest():
+    with _lock:
+        return list(_slowest)
+
+
+# ============================================================
+# 3. 로그 파일 / 집계
+# ============================================================
+def _append(row):
+    try:
+        line = json.dumps(row, ensure_ascii=False)
+        with _lock:
+            os.makedirs(os.path.dirname(LOG_PATH) or '.', exist_ok=True)
+            with open(LOG_PATH, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+                size = f.tell()
+            if size > LOG_MAX_BYTES:
+                os.replace(LOG_PATH, LOG_PATH + '.1')     # 직전 파일 1개만 보관
+    except Exception:
+        pass  # 계측 실패가 본 기능을 막지 않도록
+
+
+def _tail(path, limit, block=64 * 1024):
+    """파일 끝에서부터 블록 단위로 읽어 마지막 limit줄만 (파일 전체를 읽지 않음)"""
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos, data = end, b''
+        while pos > 0 and data.count(b'\n') <= limit:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.split(b'\n')
+    if pos > 0:
+        lines = lines[1:]                      # 잘린 첫 줄
+    return [ln.decode('utf-8', 'replace') for ln in lines if ln.strip()][-limit:]
+
+
+def load_log(path=None, limit=20000):
+    """최근 limit줄 → DataFrame"""
+    import pandas as pd
+    path = path or LOG_PATH
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    lines = _tail(path, limit)
+    rows = []
+    for ln in lines:
+        try:
+            rows.append(json.loads(ln))
+        except ValueError:
+            continue
+    return pd.DataFrame(rows)
+
+
+def page_table(df):
+    """페이지별 rerun 수 · p50/p95 · 평균 분해(ms)"""
+    import pandas as pd
+    if df.empty:
+        return pd.DataFrame()
+    g = df.groupby('page')
+    out = pd.DataFrame({
+        'reruns': g.size(),
+        'p50_ms': g['total_ms'].quantile(0.5),
+        'p95_ms': g['total_ms'].quantile(0.95),
+    })
+    for c in ('db_ms', 'engine_ms', 'llm_ms', 'render_ms'):
+        if c in df:
+            out[c.replace('_ms', '_avg')] = g[c].mean()
+    return out.round(1).sort_values('p95_ms', ascending=False).reset_index()